@@ -0,0 +1,135 @@
+"""
+Incrementally maintained merchant analytics.
+
+Settlement code calls `record_payment` / `record_withdrawal` inside its own
+database transaction, so the per-merchant totals in `analytics` and the daily
+buckets in `analytics_daily` commit or roll back together with the payment.
+`rebuild` recomputes everything from the raw transaction history:
+
+    python analytics.py rebuild
+"""
+import argparse
+import uuid
+from datetime import datetime, date
+from decimal import Decimal
+
+from sqlalchemy import func, case, delete
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import SessionLocal
+from models import Analytics, AnalyticsDaily, Payment, Transaction
+
+
+# Payments created by /withdraw carry this marker in `data`
+WITHDRAWAL = "Withdrawal"
+
+
+def _upsert(db, model, keys, values):
+    """Insert a row or add `values` onto the existing one, atomically."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(model).values(**keys, **values)
+    increments = {
+        name: getattr(model, name) + stmt.excluded[name]
+        for name in values
+        if name not in ("analytics_id", "last_updated")
+    }
+    if "last_updated" in values:
+        increments["last_updated"] = stmt.excluded.last_updated
+    db.execute(stmt.on_conflict_do_update(index_elements=list(keys), set_=increments))
+
+
+def _to_decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def record_payment(db, user_id, amount, gas_fee, when=None):
+    """Count a successful incoming payment. Does not commit."""
+    when = when or datetime.utcnow()
+    amount = _to_decimal(amount)
+    _upsert(db, Analytics, {"user_id": user_id}, {
+        "analytics_id": str(uuid.uuid4()),
+        "total_payments": 1,
+        "total_revenue": amount,
+        "last_updated": when,
+    })
+    _upsert(db, AnalyticsDaily, {"user_id": user_id, "day": when.date()}, {
+        "payment_count": 1,
+        "payment_volume": amount,
+        "withdrawal_count": 0,
+        "withdrawal_volume": 0,
+        "gas_fees": _to_decimal(gas_fee),
+    })
+
+
+def record_withdrawal(db, user_id, amount, gas_fee, when=None):
+    """Count a withdrawal sent from the merchant wallet. Does not commit."""
+    when = when or datetime.utcnow()
+    _upsert(db, AnalyticsDaily, {"user_id": user_id, "day": when.date()}, {
+        "payment_count": 0,
+        "payment_volume": 0,
+        "withdrawal_count": 1,
+        "withdrawal_volume": _to_decimal(amount),
+        "gas_fees": _to_decimal(gas_fee),
+    })
+
+
+def rebuild(db):
+    """Recompute all rollups from the successful transactions in bulk."""
+    is_withdrawal = Payment.data == WITHDRAWAL
+    day = func.date(Transaction.created_at)
+    rows = (
+        db.query(
+            Payment.user_id,
+            day,
+            func.sum(case((is_withdrawal, 0), else_=1)),
+            func.sum(case((is_withdrawal, 0), else_=Transaction.amount)),
+            func.sum(case((is_withdrawal, 1), else_=0)),
+            func.sum(case((is_withdrawal, Transaction.amount), else_=0)),
+            func.sum(Transaction.gas_fee),
+        )
+        .join(Payment, Payment.payment_id == Transaction.payment_id)
+        .filter(Transaction.status == "Successful")
+        .group_by(Payment.user_id, day)
+        .all()
+    )
+
+    daily = []
+    totals = {}
+    for user_id, bucket, payment_count, payment_volume, withdrawal_count, withdrawal_volume, gas_fees in rows:
+        daily.append({
+            "user_id": user_id,
+            "day": bucket if isinstance(bucket, date) else date.fromisoformat(bucket),
+            "payment_count": payment_count,
+            "payment_volume": payment_volume,
+            "withdrawal_count": withdrawal_count,
+            "withdrawal_volume": withdrawal_volume,
+            "gas_fees": gas_fees,
+        })
+        if payment_count:
+            # Like record_payment: only withdrawals don't make a totals row
+            count, revenue = totals.get(user_id, (0, 0))
+            totals[user_id] = (count + payment_count, revenue + _to_decimal(payment_volume or 0))
+
+    now = datetime.utcnow()
+    db.execute(delete(AnalyticsDaily))
+    db.execute(delete(Analytics))
+    db.bulk_insert_mappings(AnalyticsDaily, daily)
+    db.bulk_insert_mappings(Analytics, [
+        {"analytics_id": str(uuid.uuid4()), "user_id": user_id, "total_payments": count, "total_revenue": revenue, "last_updated": now}
+        for user_id, (count, revenue) in totals.items()
+    ])
+    db.commit()
+    return len(daily)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain merchant analytics rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        buckets = rebuild(db)
+        print(f"Rebuilt {buckets} daily buckets")
+    finally:
+        db.close()
@@ -1,26 +1,30 @@
 from fastapi import FastAPI, Depends, HTTPException, WebSocket, BackgroundTasks, status, APIRouter
-import requests
+from fastapi.responses import StreamingResponse
 import asyncio
 
+from sqlalchemy import select, and_, update
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import uuid
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
+from jose import jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
 from datetime import datetime, timedelta
 
 from xenon import create_wallet, import_wallet, get_gas_to_usdc
-from schema import WalletImportRequest, InitiatePaymentRequest, CreateBusiness, Token, TokenData, UserInDB, LoginBusiness, BusinessOut, CreateCheckoutRequest, InitiateCheckout
-from database import SessionLocal, engine, get_db
-from models import Base, Business, Wallet, Payment, Transaction, Analytics
-import monitor
+from schema import WalletImportRequest, InitiatePaymentRequest, CreateBusiness, Token, TokenData, UserInDB, LoginBusiness, BusinessOut, BusinessIdentity, CreateCheckoutRequest, InitiateCheckout
+from database import SessionLocal, engine, get_db, get_async_db, session_scope
+from models import Base, Business, Wallet, Payment, Transaction, Analytics, BUSINESS_CHANGED, api_key_hash
+import analytics
+import webhooks
+import events
+from watcher import chain_watcher, register_handler, close_watch
+from cache import TTLCache
+from pagination import paginate, page_size, history_filters
+from pubsub import subscribe
+from serialization import ORJSONResponse, to_dict
 import os
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
-
-
-# Initialize ThreadPoolExecutor
-executor = ThreadPoolExecutor(max_workers=5)
 
 
 router = APIRouter()
@@ -33,12 +37,16 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# api_key_hash(api_key) -> business identity, evicted when the business record changes on any worker
+API_KEY_CACHE_TTL = int(os.getenv("API_KEY_CACHE_TTL", "300"))
+api_key_cache = TTLCache(maxsize=10000, ttl=API_KEY_CACHE_TTL)
+# Bumped on every business change, so a lookup that raced one doesn't cache what it read
+api_key_changes = 0
 
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 
-def transacts(data, db):
+def transacts(data, db, result):
+    """Settle an API payment and notify the merchant webhook once the chain watcher reports its outcome."""
     url = data["webhook"]
     sender_address = data["sender"]
     reciever_address = data["recv"]
@@ -47,8 +55,6 @@ def transacts(data, db):
     payment_id = data["payment_id"]
     payment = db.query(Payment).filter(Payment.payment_id == payment_id).first()
 
-    result = monitor.monitor_transactions(sender_address, reciever_address, amount)
-    print('hereeeeee')
     if result != False:
         # Prepare transaction data
         print("DATAAA")
@@ -67,9 +73,6 @@ def transacts(data, db):
             "blockNumber": receipt['blockNumber']
         }
 
-        # Update payment and create transaction
-        update_payment_and_create_transaction(payment_id, transaction_data, db)
-
         # Prepare webhook data
         webhook_data = {
             "receipt": result,
@@ -84,12 +87,9 @@ def transacts(data, db):
             "gas_fee": gas_fee
         }
 
-        response = requests.post(url, json=webhook_data)
-        if response.status_code == 200:
-            print(response.json())
-        else:
-            print(f"Failed to send webhook. Status code: {response.status_code}, Response: {response.text}")
-        
+        # Update payment and create transaction; the webhook is queued in the same commit
+        update_payment_and_create_transaction(payment_id, transaction_data, db, webhook=(url, webhook_data) if url else None)
+
     else:
         transaction_data = {
             "transaction_hash": "Failed",
@@ -101,7 +101,14 @@ def transacts(data, db):
         }
         update_payment_and_create_transaction(payment_id, transaction_data, db)
 
-def update_payment_and_create_transaction(payment_id, transaction_data, db: Session = Depends(get_db)):
+def settle_payment(data, result):
+    """Settlement handler for durable API payment watches."""
+    with session_scope() as db:
+        transacts(data, db, result)
+
+register_handler("api", settle_payment)
+
+def update_payment_and_create_transaction(payment_id, transaction_data, db: Session = Depends(get_db), webhook=None):
     """
     Update the payment table and create a new row in the Transactions table.
     Args:
@@ -113,17 +120,26 @@ def update_payment_and_create_transaction(payment_id, transaction_data, db: Sess
             - amount: float
             - gas_fee: float
             - blockNumber: int or None
+        webhook: optional (url, payload) to add to the webhook outbox
     """
     # Update the payment table
     payment = db.query(Payment).filter(Payment.payment_id == payment_id).first()
     if not payment:
         raise HTTPException(status_code=404, detail="No Payment with this ID")
     
-    # Update payment status
-    payment.transaction_hash = transaction_data["transaction_hash"]
-    payment.status = "Successful" if transaction_data["status"] == 1 else "Failed"
-    db.commit()
-    db.refresh(payment)
+    # Update payment status; only the first settlement of a pending payment wins,
+    # even when two workers race on it
+    settled = db.execute(
+        update(Payment)
+        .where(Payment.payment_id == payment_id, Payment.status == "Pending")
+        .values(
+            transaction_hash=transaction_data["transaction_hash"],
+            status="Successful" if transaction_data["status"] == 1 else "Failed",
+        )
+    ).rowcount
+    if not settled:
+        db.rollback()
+        return {"message": "Payment already settled", "payment_status": payment.status}
     
     # Create a new row in the Transactions table
     new_transaction = Transaction(
@@ -139,15 +155,25 @@ def update_payment_and_create_transaction(payment_id, transaction_data, db: Sess
     )
     
     try:
+        # Payment, transaction, analytics counters and the watch settle in one commit
         db.add(new_transaction)
+        close_watch(db, payment_id)
+        if transaction_data["status"] == 1:
+            analytics.record_payment(db, payment.user_id, transaction_data["amount"], transaction_data["gas_fee"])
+        if webhook:
+            webhooks.enqueue(db, payment_id, *webhook)
         db.commit()
         db.refresh(new_transaction)
+        db.refresh(payment)
     except Exception as e:
         db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create transaction record: {str(e)}"
         )
+    events.publish_status(payment)
+    if webhook:
+        webhooks.dispatcher.notify()
     
     return {
         "message": "Payment and Transaction updated successfully",
@@ -157,24 +183,34 @@ def update_payment_and_create_transaction(payment_id, transaction_data, db: Sess
 
 
 # Utility Functions
-def to_dict(model):
-    """Convert SQLAlchemy model instance to dictionary."""
-    return {column.name: getattr(model, column.name) for column in model.__table__.columns}
+def _invalidate_api_keys(change):
+    global api_key_changes
+    api_key_changes += 1
+    for key_hash in change["api_key_hashes"]:
+        api_key_cache.pop(key_hash)
+
+subscribe(BUSINESS_CHANGED, _invalidate_api_keys)
 
 # Dependency
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        user = db.query(Business).filter(Business.api_key == token).first()
-        if user is None:
-            raise credentials_exception
-    except JWTError:
+    key_hash = api_key_hash(token)
+    business = api_key_cache.get(key_hash)
+    if business is not None:
+        return business
+    changes_seen = api_key_changes
+    user = (await db.execute(select(Business).where(Business.api_key == token))).scalars().first()
+    if user is None:
         raise credentials_exception
-    return user
+    business = BusinessIdentity.model_validate(user)
+    # A key rotated while we were reading may already be evicted; don't put it back
+    if changes_seen == api_key_changes:
+        api_key_cache.set(key_hash, business)
+    return business
 
 # Routes
 @router.get("/")
@@ -196,8 +232,6 @@ def initiate_payment(body: InitiatePaymentRequest, background_tasks: BackgroundT
     sender_address = body.sender_address
     payment = Payment(payment_id=str(uuid.uuid4()), user_id=business.user_id, data=body.data, receiver_address=reciever_address, amount=amount, sender_address=sender_address)
     db.add(payment)
-    db.commit()
-    db.refresh(payment)
 
     post_data = {
         "sender": sender_address,
@@ -207,9 +241,12 @@ def initiate_payment(body: InitiatePaymentRequest, background_tasks: BackgroundT
         "payment_id": payment.payment_id,
         "webhook": body.webhook
     }
-    
-    future = executor.submit(transacts, post_data, db)
-    print(future)
+
+    # The watch commits with the payment so it survives a restart
+    watch = chain_watcher.open_watch(db, "api", payment.payment_id, sender_address, reciever_address, amount, post_data)
+    db.commit()
+    db.refresh(payment)
+    chain_watcher.track(watch)
 
     return {"payment_id": payment.payment_id, "merchant_address":reciever_address}
 
@@ -255,6 +292,25 @@ def payment_status(paymentId: str, db: Session = Depends(get_db), business: Busi
 
     return post_data
 
+@router.get("/payment/events/{paymentId}")
+async def payment_events(paymentId: str, db: AsyncSession = Depends(get_async_db), business: BusinessOut = Depends(get_current_user)):
+    """
+    Server-Sent Events stream of a payment's status, ending once it is Successful or Failed.
+    """
+    payment = await db.get(Payment, paymentId)
+    if not payment:
+        raise HTTPException(status_code=404, detail="No Payment with this ID")
+    if business.user_id != payment.user_id:
+        raise HTTPException(status_code=403, detail="You are not authorized to view this payment")
+    return StreamingResponse(events.payment_sse(paymentId), media_type="text/event-stream", headers=events.SSE_HEADERS)
+
+@router.get("/payments/events")
+async def merchant_payment_events(business: BusinessOut = Depends(get_current_user)):
+    """
+    Server-Sent Events stream of status changes for all of the business's payments.
+    """
+    return StreamingResponse(events.merchant_sse(business.user_id), media_type="text/event-stream", headers=events.SSE_HEADERS)
+
 @router.get("/transaction/{transactionId}", response_model=dict)
 def transaction_details(transactionId: str, db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
     """
@@ -269,20 +325,32 @@ def transaction_details(transactionId: str, db: Session = Depends(get_db), busin
 
     post_data = to_dict(transaction)
 
-    return post_data
+    return ORJSONResponse(post_data)
 
 @router.get("/transaction/to/{wallet_address}")
-def wallet_transactions(wallet_address: str, db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
+def wallet_transactions(
+    wallet_address: str,
+    cursor: str = None,
+    limit: int = None,
+    status: str = None,
+    start: datetime = None,
+    end: datetime = None,
+    db: Session = Depends(get_db),
+    business: BusinessOut = Depends(get_current_user),
+):
     """
     API endpoint to get Transactions to a wallet address.
+    Newest first, one page at a time; the cursor for the next page is returned in the X-Next-Cursor header.
     """
-    transactions = db.query(Transaction).filter(Transaction.to_address == wallet_address).all()
     business_wallet = db.query(Wallet).filter(Wallet.user_id == business.user_id).first()
-    if not transactions:
-        raise HTTPException(status_code=404, detail="No Transactions to this wallet address")
     if business_wallet.address != wallet_address:
         raise HTTPException(status_code=403, detail="You are not authorized to view these transactions")
 
+    condition = and_(Transaction.to_address == wallet_address, *history_filters(Transaction, status, start, end))
+    transactions, next_cursor = paginate(db, Transaction, [condition], cursor=cursor, limit=page_size(limit))
+    if not transactions and not cursor:
+        raise HTTPException(status_code=404, detail="No Transactions to this wallet address")
     post_data = [to_dict(transaction) for transaction in transactions]
 
-    return post_data
+    # Returned as a response so the rows skip FastAPI's jsonable_encoder pass
+    return ORJSONResponse(post_data, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, Depends, HTTPException, WebSocket, BackgroundTasks, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import requests
 import asyncio
 
@@ -7,29 +8,59 @@ from sqlalchemy.orm import Session
 import uuid
 import os
 import secrets
+import hashlib
+import time
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-from sqlalchemy import or_
-
-from xenon import create_wallet, import_wallet, get_gas_to_usdc, get_wallet_balances, send_base_eth
-from schema import WalletImportRequest, CreateBusiness, Token, TokenData, UserInDB, LoginBusiness, BusinessOut, CreateCheckoutRequest, InitiateCheckout, WithdrawRequest
-from database import SessionLocal, engine, get_db
-from models import Base, Business, Wallet, Payment, Transaction, Analytics
-import monitor
+from sqlalchemy import or_, and_, select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.concurrency import run_in_threadpool
+
+from xenon import create_wallet, import_wallet, get_gas_to_usdc, get_wallet_balances, balance_cache, receipt_tracker, web3
+from schema import WalletImportRequest, CreateBusiness, Token, TokenData, UserInDB, LoginBusiness, BusinessOut, BusinessIdentity, CreateCheckoutRequest, InitiateCheckout, WithdrawRequest
+from database import SessionLocal, engine, get_db, async_engine, get_async_db, migrate, session_scope, pool_stats
+from models import Base, Business, Wallet, Payment, Transaction, Analytics, AnalyticsDaily, BUSINESS_CHANGED
+import analytics
 import api
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import export
+import webhooks
+import events
+import payouts
+import monitor
+from serialization import ORJSONResponse, to_dict
+from watcher import chain_watcher, register_handler, close_watch
+from price import price_oracle
+from cache import TTLCache
+from pagination import paginate, page_size, history_filters
+import passwords
+from pubsub import subscribe
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-
-# Initialize ThreadPoolExecutor
-executor = ThreadPoolExecutor(max_workers=5)
-
-app = FastAPI(title="LianFlow API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema is managed by Alembic, see migrations/
+    await run_in_threadpool(migrate)
+    # Run the shared chain watcher alongside the app; in websocket mode it lives on this event loop.
+    # Started first, so watches resumed below join it rather than starting a watcher of their own.
+    await chain_watcher.astart()
+    # Pick up payments that were still open when the previous process stopped
+    await run_in_threadpool(chain_watcher.resume)
+    # Deliver merchant webhooks from the outbox on this event loop
+    await webhooks.dispatcher.start()
+    # Send queued withdrawals, including any a previous process left unfinished
+    payouts.scheduler.start()
+    yield
+    await run_in_threadpool(payouts.scheduler.stop)
+    await webhooks.dispatcher.stop()
+    await chain_watcher.astop()
+    await async_engine.dispose()
+
+app = FastAPI(title="LianFlow API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(api.router, prefix="/api/v1", tags=["API V1"])
 
@@ -47,29 +78,26 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60*24
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# sha256(JWT) -> (claims, business identity, generation), kept until the token expires
+principal_cache = TTLCache(maxsize=10000)
+business_generations = {}
+business_changes = 0
 
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 
-def transacts(data,  db: Session = Depends(get_db)):
+def transacts(data, db, result):
+    """Settle a checkout payment once the chain watcher reports its outcome."""
     print("transacts")
     sender_address = data["sender"]
     reciever_address = data["recv"]
     amount = data["amount"]
     email = data["email"]
     payment_id = data["payment_id"]
-    print("move")
     # payment = db.query(Payment).filter(Payment.payment_id == payment_id).first()
 
-    result = monitor.monitor_transactions(sender_address, reciever_address, amount)
-    print('done')
     if result != False:
         # Prepare transaction data
         print("Success")
@@ -120,6 +148,13 @@ def transacts(data,  db: Session = Depends(get_db)):
         }
         update_payment_and_create_transaction(payment_id, transaction_data, db)
 
+def settle_checkout(data, result):
+    """Settlement handler for durable checkout watches."""
+    with session_scope() as db:
+        transacts(data, db, result)
+
+register_handler("checkout", settle_checkout)
+
 def update_payment_and_create_transaction(payment_id, transaction_data, db: Session = Depends(get_db)):
     """
     Update the payment table and create a new row in the Transactions table.
@@ -138,11 +173,19 @@ def update_payment_and_create_transaction(payment_id, transaction_data, db: Sess
     if not payment:
         raise HTTPException(status_code=404, detail="No Payment with this ID")
     
-    # Update payment status
-    payment.transaction_hash = transaction_data["transaction_hash"]
-    payment.status = "Successful" if transaction_data["status"] == 1 else "Failed"
-    db.commit()
-    db.refresh(payment)
+    # Update payment status; only the first settlement of a pending payment wins,
+    # even when two workers race on it
+    settled = db.execute(
+        update(Payment)
+        .where(Payment.payment_id == payment_id, Payment.status == "Pending")
+        .values(
+            transaction_hash=transaction_data["transaction_hash"],
+            status="Successful" if transaction_data["status"] == 1 else "Failed",
+        )
+    ).rowcount
+    if not settled:
+        db.rollback()
+        return {"message": "Payment already settled", "payment_status": payment.status}
     
     # Create a new row in the Transactions table
     new_transaction = Transaction(
@@ -158,15 +201,21 @@ def update_payment_and_create_transaction(payment_id, transaction_data, db: Sess
     )
     
     try:
+        # Payment, transaction, analytics counters and the watch settle in one commit
         db.add(new_transaction)
+        close_watch(db, payment_id)
+        if transaction_data["status"] == 1:
+            analytics.record_payment(db, payment.user_id, transaction_data["amount"], transaction_data["gas_fee"])
         db.commit()
         db.refresh(new_transaction)
+        db.refresh(payment)
     except Exception as e:
         db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create transaction record: {str(e)}"
         )
+    events.publish_status(payment)
     
     return {
         "message": "Payment and Transaction updated successfully",
@@ -180,18 +229,11 @@ def generate_api_key():
     """Generate a secure API key."""
     return secrets.token_urlsafe(32)
 
-def to_dict(model):
-    """Convert SQLAlchemy model instance to dictionary."""
-    return {column.name: getattr(model, column.name) for column in model.__table__.columns}
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return passwords.hash_password(password)
 
-def get_user(db, email: str):
-    user = db.query(Business).filter(Business.email == email).first()
+async def get_user(db: AsyncSession, email: str):
+    user = (await db.execute(select(Business).where(Business.email == email))).scalars().first()
     if user:
         return UserInDB(**to_dict(user))
     raise HTTPException(
@@ -200,9 +242,11 @@ def get_user(db, email: str):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-def authenticate_user(db, email: str, password: str):
-    user = get_user(db, email)
-    if not user or not verify_password(password, user.password_hash):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user(db, email)
+    # Hand the connection back to the pool instead of holding it while bcrypt runs
+    await db.close()
+    if not user or not await passwords.verify_password_async(password, user.password_hash):
         raise HTTPException(
             status_code=401,
             detail="Incorrect email or password",
@@ -216,13 +260,29 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def _invalidate_principals(change):
+    global business_changes
+    # Bumping the generation makes every cached principal of this business stale
+    business_generations[change["user_id"]] = business_generations.get(change["user_id"], 0) + 1
+    business_changes += 1
+
+subscribe(BUSINESS_CHANGED, _invalidate_principals)
+
 # Dependency
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    cached = principal_cache.get(token_hash)
+    if cached is not None:
+        claims, business, generation = cached
+        if generation == business_generations.get(business.user_id, 0):
+            return business
+
+    changes_seen = business_changes
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         token_data = TokenData(**payload)
@@ -231,10 +291,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(Business).filter(Business.email == email).first()
+    user = (await db.execute(select(Business).where(Business.email == email))).scalars().first()
     if user is None:
         raise credentials_exception
-    return user
+
+    business = BusinessIdentity.model_validate(user)
+    # A verified token stays valid until it expires, so cache it until then,
+    # unless a business changed while we were reading it
+    if changes_seen == business_changes:
+        generation = business_generations.get(business.user_id, 0)
+        principal_cache.set(token_hash, (payload, business, generation), ttl=token_data.exp - time.time())
+    return business
 
 # Routes
 @app.get("/")
@@ -245,6 +312,25 @@ def read_root():
 def uptimer():
     return {"status": "ok"}
 
+@app.get("/metrics", tags=["System"])
+def metrics():
+    """
+    Runtime cache and pool statistics for this worker.
+    """
+    return {
+        "price": price_oracle.stats(),
+        "api_key_cache": api.api_key_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "password_hashing": passwords.stats(),
+        "webhooks": webhooks.dispatcher.stats(),
+        "db_pool": pool_stats(),
+        "balances": balance_cache.stats(),
+        "events": events.broker.stats(),
+        "receipts": receipt_tracker.stats(),
+        "payouts": payouts.scheduler.stats(),
+        "rpc": {"xenon": web3.provider.stats(), "monitor": monitor.w3.provider.stats()},
+    }
+
 
 @app.post("/users/signup", tags=["Auth"])
 def create_user(body: CreateBusiness, db: Session = Depends(get_db)):
@@ -279,9 +365,9 @@ def create_user(body: CreateBusiness, db: Session = Depends(get_db)):
     }
 
 @app.post("/login", response_model=Token, tags=["Auth"])
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    usr = db.query(Business).filter(Business.business_name == form_data.username).first()
-    user = authenticate_user(db, usr.email, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    usr = (await db.execute(select(Business).where(Business.business_name == form_data.username))).scalars().first()
+    user = await authenticate_user(db, usr.email, form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -293,8 +379,8 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post('/users/token', summary="Create access and refresh tokens for user", response_model=Token, tags=["Auth"])
-async def login_token(data: LoginBusiness, db: Session = Depends(get_db)):
-    result = db.query(Business).filter(Business.email == data.email).first()
+async def login_token(data: LoginBusiness, db: AsyncSession = Depends(get_async_db)):
+    result = (await db.execute(select(Business).where(Business.email == data.email))).scalars().first()
 
     user = result
     if user is None:
@@ -304,7 +390,9 @@ async def login_token(data: LoginBusiness, db: Session = Depends(get_db)):
         )
 
     hashed_pass = user.password_hash
-    if not verify_password(data.password, hashed_pass):
+    # Hand the connection back to the pool instead of holding it while bcrypt runs
+    await db.close()
+    if not await passwords.verify_password_async(data.password, hashed_pass):
         raise HTTPException(
             status_code=451,
             detail="Incorrect email or password"
@@ -378,34 +466,73 @@ def get_wallet_balance(db: Session = Depends(get_db), business: BusinessOut = De
 
 
 @app.get("/dashboard", tags=["Business"])
-async def dashboard_details(db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
+async def dashboard_details(db: AsyncSession = Depends(get_async_db), business: BusinessOut = Depends(get_current_user)):
     data = {}
-    wallets = db.query(Wallet).filter(Wallet.user_id == business.user_id).first()
-    payments = db.query(Payment).filter(Payment.user_id == business.user_id).all()
+    wallets = (await db.execute(select(Wallet).where(Wallet.user_id == business.user_id))).scalars().first()
     if wallets == None:
         return {"message": "Create wallet", "status": 430}
-    else:
-        transactions = (
-        db.query(Transaction)
-        .filter(
-            or_(
-                Transaction.to_address == wallets.address,
-                Transaction.from_address == wallets.address
-            )
+
+    # Counts and volume are aggregated by the database in a single round trip
+    wallet_transactions = or_(
+        Transaction.to_address == wallets.address,
+        Transaction.from_address == wallets.address
+    )
+    num_of_payments, num_of_transactions, transaction_volume = (await db.execute(
+        select(
+            select(func.count()).select_from(Payment).where(Payment.user_id == business.user_id).scalar_subquery(),
+            select(func.count()).select_from(Transaction).where(wallet_transactions).scalar_subquery(),
+            select(func.coalesce(func.sum(Transaction.amount), 0))
+            .where(wallet_transactions, Transaction.status == "Successful")
+            .scalar_subquery(),
         )
-        .order_by(Transaction.created_at.desc())
-    ).all()
-    balances = get_wallet_balances(wallets.address)
+    )).one()
+    recent_payments = (await db.execute(
+        select(Payment)
+        .where(Payment.user_id == business.user_id)
+        .order_by(Payment.created_at.desc())
+        .limit(3)
+    )).scalars().all()
+
+    # Balance lookups are blocking RPC calls, keep them off the event loop
+    balances = await run_in_threadpool(get_wallet_balances, wallets.address)
     data["balances"] = balances
     data["business"] = business
-    data["num_of_payments"] = len(payments)
-    data["num_of_transactions"] = len(transactions)
+    data["num_of_payments"] = num_of_payments
+    data["num_of_transactions"] = num_of_transactions
     data["wallets"] = wallets
-    data["transactions"] = sorted(payments, key=lambda x: x.created_at, reverse=True)[:3]
-    successful_transactions = [t for t in transactions if t.status == "Successful"]
-    data["transaction_volume"] = sum(float(t.amount) for t in successful_transactions)
+    data["transactions"] = recent_payments
+    data["transaction_volume"] = float(transaction_volume)
     return data
 
+@app.get("/analytics", tags=["Business"])
+async def analytics_details(days: int = 30, db: AsyncSession = Depends(get_async_db), business: BusinessOut = Depends(get_current_user)):
+    """
+    Daily payment volume, counts and gas fees for the last `days` days, served from the rollups.
+    """
+    start = datetime.utcnow().date() - timedelta(days=max(days, 1) - 1)
+    totals = (await db.execute(select(Analytics).where(Analytics.user_id == business.user_id))).scalars().first()
+    buckets = (await db.execute(
+        select(AnalyticsDaily)
+        .where(AnalyticsDaily.user_id == business.user_id, AnalyticsDaily.day >= start)
+        .order_by(AnalyticsDaily.day)
+    )).scalars().all()
+    return {
+        "total_payments": totals.total_payments if totals else 0,
+        "total_revenue": float(totals.total_revenue) if totals else 0.0,
+        "last_updated": totals.last_updated if totals else None,
+        "daily": [
+            {
+                "day": bucket.day,
+                "payment_count": bucket.payment_count,
+                "payment_volume": float(bucket.payment_volume),
+                "withdrawal_count": bucket.withdrawal_count,
+                "withdrawal_volume": float(bucket.withdrawal_volume),
+                "gas_fees": float(bucket.gas_fees),
+            }
+            for bucket in buckets
+        ],
+    }
+
 @app.get("/me", tags=["Business"])
 async def business_details(business: BusinessOut = Depends(get_current_user)):
     return business
@@ -452,7 +579,7 @@ def get_payment(paymentId: str, db: Session = Depends(get_db),):
     post_data["business_id"] = payment.user_id
     post_data["gas_amount"] = amount
     post_data["total_amount"] = total_amount
-    return post_data
+    return ORJSONResponse(post_data)
 
 @app.post("/checkout/initiate", response_model=dict, tags=["Payment"])
 def initiate_checkout_payment(Data: InitiateCheckout, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
@@ -464,11 +591,6 @@ def initiate_checkout_payment(Data: InitiateCheckout, background_tasks: Backgrou
         raise HTTPException(status_code=404, detail="No Payment with this ID")
     payment.data = Data.data
     payment.sender_address = Data.sender_address
-    db.commit()
-    db.refresh(payment)
-
-    amount = payment.amount
-    total_amount = get_gas_to_usdc(amount)
 
     post_data = {
         "sender": Data.sender_address,
@@ -477,8 +599,14 @@ def initiate_checkout_payment(Data: InitiateCheckout, background_tasks: Backgrou
         "email": Data.data,
         "payment_id": Data.payment_id
     }
-    future = executor.submit(transacts, post_data, db)
-    print(future)
+    # The watch is stored with the payment so it survives a restart
+    watch = chain_watcher.open_watch(db, "checkout", payment.payment_id, Data.sender_address, payment.receiver_address, payment.amount, post_data)
+    db.commit()
+    db.refresh(payment)
+    chain_watcher.track(watch)
+
+    amount = payment.amount
+    total_amount = get_gas_to_usdc(amount)
 
 
     data = {
@@ -492,7 +620,7 @@ def initiate_checkout_payment(Data: InitiateCheckout, background_tasks: Backgrou
     return data
 
 @app.get("/regenerate-api-key", tags=["Business"])
-async def regenerate_api_key(db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
+async def regenerate_api_key(db: AsyncSession = Depends(get_async_db), business: BusinessOut = Depends(get_current_user)):
     """
     Regenerate API key for the authenticated business.
     """
@@ -501,10 +629,10 @@ async def regenerate_api_key(db: Session = Depends(get_db), business: BusinessOu
         new_api_key = generate_api_key()
         
         # Update the business record
-        business_record = db.query(Business).filter(Business.user_id == business.user_id).first()
+        business_record = await db.get(Business, business.user_id)
         business_record.api_key = new_api_key
-        db.commit()
-        db.refresh(business_record)
+        await db.commit()
+        await db.refresh(business_record)
         
         return {
             "message": "API key regenerated successfully",
@@ -517,67 +645,121 @@ async def regenerate_api_key(db: Session = Depends(get_db), business: BusinessOu
         )
 
 
+@app.get("/transactions/export", tags=["Business"])
+def export_transactions(
+    format: str = "ndjson",
+    status: str = None,
+    start: datetime = None,
+    end: datetime = None,
+    db: Session = Depends(get_db),
+    business: BusinessOut = Depends(get_current_user),
+):
+    """
+    Stream the business wallet's full transaction history, oldest first, as NDJSON or CSV.
+    """
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be one of: " + ", ".join(export.FORMATS))
+    wallet = db.query(Wallet).filter(Wallet.user_id == business.user_id).first()
+    if not wallet:
+        raise HTTPException(status_code=404, detail="No wallet found for this business")
+    filters = history_filters(Transaction, status, start, end)
+    conditions = [
+        and_(Transaction.to_address == wallet.address, *filters),
+        and_(Transaction.from_address == wallet.address, Transaction.to_address != wallet.address, *filters),
+    ]
+    filename = f"transactions-{datetime.utcnow():%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        export.stream_transactions(conditions, format),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.get("/transactions/")
 @app.get("/transactions/{num}")
-def get_transactions(num: str = None, db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
+def get_transactions(
+    num: int = None,
+    cursor: str = None,
+    limit: int = None,
+    status: str = None,
+    start: datetime = None,
+    end: datetime = None,
+    db: Session = Depends(get_db),
+    business: BusinessOut = Depends(get_current_user),
+):
     """
     API endpoint to get Transaction to a wallet address.
+    Newest first, one page at a time; pass `next_cursor` back as `cursor` for the next page.
     """
     wallet = db.query(Wallet).filter(Wallet.user_id == business.user_id).first()
-    transaction_query = (
-        db.query(Transaction)
-        .filter(
-            or_(
-                Transaction.to_address == wallet.address,
-                Transaction.from_address == wallet.address
-            )
-        )
-        .order_by(Transaction.created_at.desc())
+    filters = history_filters(Transaction, status, start, end)
+    transactions, next_cursor = paginate(
+        db,
+        Transaction,
+        [
+            and_(Transaction.to_address == wallet.address, *filters),
+            and_(Transaction.from_address == wallet.address, Transaction.to_address != wallet.address, *filters),
+        ],
+        cursor=cursor,
+        limit=page_size(limit or num),
     )
 
-    if num:
-        transaction_query = transaction_query.limit(int(num))
-
-    transactions = transaction_query.all()
-    if not transactions:
-        pass
-        # raise HTTPException(status_code=404, detail="No Transaction to this wallet address")
-
-    post_data = {"transacts":[to_dict(transaction) for transaction in transactions]}
+    post_data = {"transacts":[to_dict(transaction) for transaction in transactions], "next_cursor": next_cursor}
 
-    return post_data
+    # Returned as a response so the rows skip FastAPI's jsonable_encoder pass
+    return ORJSONResponse(post_data)
 
 @app.get("/payments/")
 @app.get("/payments/{num}")
-def get_payments(num: str = None, db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
+def get_payments(
+    num: int = None,
+    cursor: str = None,
+    limit: int = None,
+    status: str = None,
+    start: datetime = None,
+    end: datetime = None,
+    db: Session = Depends(get_db),
+    business: BusinessOut = Depends(get_current_user),
+):
     """
     API endpoint to get Transaction to a wallet address.
+    Newest first, one page at a time; pass `next_cursor` back as `cursor` for the next page.
     """
     wallet = db.query(Wallet).filter(Wallet.user_id == business.user_id).first()
-    payment_query = (
-        db.query(Payment)
-        .filter(
-            or_(
-                Payment.receiver_address == wallet.address,
-                Payment.sender_address == wallet.address
-            )
-        )
-        .order_by(Payment.created_at.desc())
+    filters = history_filters(Payment, status, start, end)
+    payments, next_cursor = paginate(
+        db,
+        Payment,
+        [
+            and_(Payment.receiver_address == wallet.address, *filters),
+            and_(Payment.sender_address == wallet.address, Payment.receiver_address != wallet.address, *filters),
+        ],
+        cursor=cursor,
+        limit=page_size(limit or num),
     )
 
-    if num:
-        payment_query = payment_query.limit(int(num))
+    post_data = {"payments":[to_dict(payment) for payment in payments], "next_cursor": next_cursor}
 
-    payments = payment_query.all()
-    
-    if not payments:
-        pass
-        # raise HTTPException(status_code=404, detail="No Transaction to this wallet address")
+    return ORJSONResponse(post_data)
     
-    post_data = {"payments":[to_dict(payment) for payment in payments]}
 
-    return post_data
-    
+@app.get("/payment/events/{paymentId}")
+async def payment_events(paymentId: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Server-Sent Events stream of a payment's status, ending once it is Successful or Failed.
+    """
+    if await db.get(Payment, paymentId) is None:
+        raise HTTPException(status_code=404, detail="No Payment with this ID")
+    return StreamingResponse(events.payment_sse(paymentId), media_type="text/event-stream", headers=events.SSE_HEADERS)
+
+
+@app.websocket("/ws/payment/{paymentId}")
+async def payment_socket(websocket: WebSocket, paymentId: str):
+    """
+    WebSocket that sends a payment's status as JSON on connect and on every change.
+    """
+    await websocket.accept()
+    await events.payment_websocket(websocket, paymentId)
+
 
 @app.get("/payment/status/{paymentId}", response_model=dict)
 def payment_status(paymentId: str, db: Session = Depends(get_db)):
@@ -596,44 +778,29 @@ def payment_status(paymentId: str, db: Session = Depends(get_db)):
 
     return post_data
 
-def withdraw_neox(wallet, amount, receiver_address, db: Session = get_db()):
-    result = send_base_eth(wallet.address, wallet.private_key, receiver_address, amount)
-    receipt = result
-    gas_used = receipt['gasUsed']
-    gas_price = receipt['effectiveGasPrice']
-    gas_fee = (gas_used * gas_price) / 10**18  # Convert from Wei to native token
-    payment = Payment(payment_id=str(uuid.uuid4()), user_id=wallet.user_id, receiver_address=receiver_address, amount=amount, sender_address=wallet.address, status="Successful", data="Withdrawal", transaction_hash=result["transactionHash"])
-    db.add(payment)
-    db.commit()
-    db.refresh(payment)
-    transaction = Transaction(transaction_id=str(uuid.uuid4()), payment_id=payment.payment_id, from_address=result["from"], to_address=result["to"], amount=amount, gas_fee=gas_fee, status="Successful" if result["status"] == 1 else "Failed", block_number=result["blockNumber"], transaction_hash=result["transactionHash"])
-    db.add(transaction)
-    db.commit()
-    db.refresh(transaction)
-    return True
-
 @app.post("/withdraw")
-def withdraw(body: WithdrawRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
+def withdraw(body: WithdrawRequest, db: Session = Depends(get_db), business: BusinessOut = Depends(get_current_user)):
     """
     API endpoint to withdraw funds from the business's wallet.
+    The withdrawal is queued and sent by the payout scheduler.
     """
     # try:
     wallet = db.query(Wallet).filter(Wallet.user_id == business.user_id).first()
-    if wallet.address == body.receiver_address:
-        raise HTTPException(status_code=402, detail="Cannot Withdraw to your Business Address")
     if not wallet:
         raise HTTPException(status_code=404, detail="No wallet found for this business")
-    balance = get_wallet_balances(wallet.address)
-    if body.amount > balance["GAS"]:
+    if wallet.address == body.receiver_address:
+        raise HTTPException(status_code=402, detail="Cannot Withdraw to your Business Address")
+    # Always read the balance from the node here, never from the cache,
+    # and hold back what earlier withdrawals still waiting in the queue will spend
+    balance = get_wallet_balances(wallet.address, fresh=True)
+    if body.amount > balance["ETH"] - float(payouts.in_flight_amount(db, wallet.address)):
         raise HTTPException(status_code=402, detail="Insufficient balance")
 
-    amount = body.amount
-    receiver_address = body.receiver_address
-    background_tasks.add_task(withdraw_neox, wallet, amount, receiver_address, db)
-    # except Exception as e:
-    #     raise HTTPException(status_code=400, detail=f"Failed to send transaction, {e}")
+    payout_id = payouts.enqueue(db, wallet, body.receiver_address, body.amount)
+    db.commit()
+    payouts.scheduler.notify()
 
-    return {"message": "Withdrawal Initiated successfully"}
+    return {"message": "Withdrawal Initiated successfully", "payout_id": payout_id}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,129 @@
+"""
+Per-address wallet balance cache, keyed to block height.
+
+Each entry remembers the block its balance was read at. It stays valid until
+the chain head has moved more than BALANCE_MAX_BLOCK_LAG blocks past it, or
+until something that touches the address is seen: the chain watcher calls
+`invalidate` for transactions it observes and withdrawals call it after
+sending. The head itself is cached for BALANCE_HEAD_TTL seconds, so repeated
+dashboard loads are served without any RPC calls.
+
+Reads that must be exact, like the withdrawal balance check, pass
+`fresh=True` to go to the node and refresh the entry.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+BALANCE_MAX_BLOCK_LAG = int(os.getenv("BALANCE_MAX_BLOCK_LAG", "15"))
+BALANCE_HEAD_TTL = float(os.getenv("BALANCE_HEAD_TTL", "2"))
+
+
+class BalanceCache:
+    def __init__(self, w3, loader=None, max_block_lag=BALANCE_MAX_BLOCK_LAG, head_ttl=BALANCE_HEAD_TTL, maxsize=10000):
+        self.w3 = w3
+        # loader(address, block_identifier) -> value to cache; the native balance in wei by default
+        self.loader = loader or (lambda address, block_identifier: w3.eth.get_balance(address, block_identifier=block_identifier))
+        self.max_block_lag = max_block_lag
+        self.head_ttl = head_ttl
+        self.maxsize = maxsize
+
+        self._lock = threading.Lock()
+        # lowercase address -> (block_number, loaded value)
+        self._entries = OrderedDict()
+        # lowercase address -> generation, bumped by invalidations that land while a read is in flight
+        self._generations = {}
+        self._readers = {}
+        self._head = None
+        self._head_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def head_block(self):
+        if self._head is None or time.time() - self._head_at > self.head_ttl:
+            head = self.w3.eth.block_number
+            with self._lock:
+                # Never move backwards if a slower concurrent fetch finishes last
+                if self._head is None or head >= self._head:
+                    self._head = head
+                self._head_at = time.time()
+        return self._head
+
+    def get(self, address, fresh=False):
+        """Balances of `address`, as returned by the loader."""
+        key = address.lower()
+        if fresh:
+            # Read at "latest" and file it under the last head we know of, which is never newer
+            return self._fetch(key, address, "latest", self._head)
+        head = self.head_block()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and head - entry[0] <= self.max_block_lag:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        return self._fetch(key, address, head, head)
+
+    def _fetch(self, key, address, block_identifier, block_number):
+        with self._lock:
+            generation = self._generations.setdefault(key, 0)
+            self._readers[key] = self._readers.get(key, 0) + 1
+        try:
+            balance = self.loader(address, block_identifier)
+        except Exception:
+            with self._lock:
+                self._release(key)
+            raise
+        with self._lock:
+            # An invalidation arrived while we were reading, so the value may already be stale
+            if self._release(key) == generation and block_number is not None:
+                self._entries[key] = (block_number, balance)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return balance
+
+    def _release(self, key):
+        generation = self._generations[key]
+        self._readers[key] -= 1
+        if not self._readers[key]:
+            del self._readers[key]
+            del self._generations[key]
+        return generation
+
+    def invalidate(self, address, block_number=None):
+        """
+        Forget the cached balance of `address`. With a `block_number`, entries
+        read at or after that block already include the change and are kept.
+        """
+        if not address:
+            return
+        key = address.lower()
+        with self._lock:
+            if key in self._generations:
+                self._generations[key] += 1
+            entry = self._entries.get(key)
+            if entry is not None and (block_number is None or entry[0] < block_number):
+                del self._entries[key]
+                self.invalidations += 1
+
+    def invalidate_transaction(self, tx):
+        block_number = tx.get("blockNumber")
+        self.invalidate(tx.get("from"), block_number)
+        self.invalidate(tx.get("to"), block_number)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "head": self._head,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,106 @@
+"""
+/dashboard latency for a business with a large payment history.
+
+    python -m bench.dashboard [payments] [requests]
+
+Signs up a business with a wallet, fills in `payments` payments and as many
+transactions for it (plus as many again for another business), and times
+GET /dashboard. For comparison it also times loading the same history
+row by row and counting it in Python, which is what the dashboard did
+before it aggregated in SQL. Wallet balances come from the chain, so they
+are replaced with a constant here; only the database work is measured.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("SECRET_KEY", "bench")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert, or_, select  # noqa: E402
+
+import app  # noqa: E402
+from database import AsyncSessionLocal, SessionLocal, migrate  # noqa: E402
+from models import Business, Payment, Transaction, Wallet  # noqa: E402
+
+
+def fill(user_id, address, count, batch=5000):
+    started = datetime.utcnow() - timedelta(days=365)
+    with SessionLocal() as db:
+        for offset in range(0, count, batch):
+            payments, transactions = [], []
+            for i in range(offset, min(offset + batch, count)):
+                payment_id = str(uuid.uuid4())
+                created_at = started + timedelta(seconds=i * 365 * 86400 // count)
+                sender = "0x%040x" % random.getrandbits(160)
+                status = random.choice(("Successful", "Successful", "Failed", "Pending"))
+                amount = round(random.uniform(1, 500), 2)
+                payments.append(dict(payment_id=payment_id, user_id=user_id, receiver_address=address, sender_address=sender,
+                                     amount=amount, status=status, created_at=created_at, updated_at=created_at))
+                transactions.append(dict(transaction_id=str(uuid.uuid4()), payment_id=payment_id, from_address=sender,
+                                         to_address=address, amount=amount, gas_fee=0.0001, status=status,
+                                         transaction_hash="0x%064x" % random.getrandbits(256), created_at=created_at))
+            db.execute(insert(Payment), payments)
+            db.execute(insert(Transaction), transactions)
+        db.commit()
+
+
+async def load_rows(user_id, address):
+    """The dashboard's numbers the way it used to compute them: every row loaded and counted in Python."""
+    async with AsyncSessionLocal() as db:
+        payments = (await db.execute(select(Payment).where(Payment.user_id == user_id))).scalars().all()
+        transactions = (await db.execute(
+            select(Transaction)
+            .where(or_(Transaction.to_address == address, Transaction.from_address == address))
+            .order_by(Transaction.created_at.desc())
+        )).scalars().all()
+        recent = sorted(payments, key=lambda payment: payment.created_at, reverse=True)[:3]
+        volume = sum(float(t.amount) for t in transactions if t.status == "Successful")
+        return len(payments), len(transactions), recent, volume
+
+
+def timed(fn, count):
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def main(count=50000, requests=20):
+    migrate()
+    client = TestClient(app.app)
+    signup = client.post("/users/signup", json={"email": "bench@example.com", "business_name": "Bench", "password": "bench"})
+    headers = {"Authorization": f"Bearer {signup.json()['access_token']}"}
+    address = "0x" + "ab" * 20
+    with SessionLocal() as db:
+        user_id = db.query(Business.user_id).filter(Business.email == "bench@example.com").scalar()
+        db.add(Wallet(wallet_id=str(uuid.uuid4()), user_id=user_id, address=address, private_key="0x" + "11" * 32))
+        db.add(Business(user_id="other", email="other@example.com", business_name="Other", password_hash="x"))
+        db.commit()
+
+    started = time.perf_counter()
+    fill(user_id, address, count)
+    fill("other", "0x" + "cd" * 20, count)
+    print(f"filled {2 * count} payments and {2 * count} transactions in {time.perf_counter() - started:.1f}s")
+
+    app.get_wallet_balances = lambda address, fresh=False: {"ETH": 1.0}
+    response = client.get("/dashboard", headers=headers).json()
+    assert response["num_of_payments"] == count, response
+
+    p50, worst = timed(lambda: client.get("/dashboard", headers=headers), requests)
+    print(f"/dashboard (SQL aggregates): p50 {p50 * 1000:.1f} ms, max {worst * 1000:.1f} ms")
+    p50, worst = timed(lambda: asyncio.run(load_rows(user_id, address)), max(3, requests // 5))
+    print(f"loading every row instead:   p50 {p50 * 1000:.1f} ms, max {worst * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
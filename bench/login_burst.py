@@ -0,0 +1,121 @@
+"""
+/payment/status latency while a burst of logins hits the same worker.
+
+    python -m bench.login_burst [logins_in_flight] [seconds]
+
+Runs the app in a uvicorn worker process and polls GET /payment/status for
+a few seconds on its own, then again while `logins_in_flight` clients keep
+posting to /users/token, each one a bcrypt verification. Reports p50/p99
+status latency for both phases and how the logins were answered; logins
+beyond PASSWORD_HASH_MAX_PENDING get a 503 rather than queueing.
+"""
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("SECRET_KEY", "bench")
+
+import httpx  # noqa: E402
+
+import passwords  # noqa: E402
+from database import SessionLocal, migrate  # noqa: E402
+from models import Business, Payment  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+async def poll_status(client, payment_id, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get(f"/payment/status/{payment_id}")
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.text
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+async def log_in(client, stop, outcomes):
+    while not stop.is_set():
+        response = await client.post("/users/token", json={"email": "bench@example.com", "password": "bench"})
+        outcomes[response.status_code] += 1
+        if response.status_code == 503:
+            # Clients back off with jitter, so retries don't arrive in lockstep
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")) * random.uniform(0.5, 1.5))
+
+
+async def run(url, payment_id, logins, seconds):
+    limits = httpx.Limits(max_connections=logins + 10, max_keepalive_connections=logins + 10)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client, \
+            httpx.AsyncClient(base_url=url, timeout=60) as checkout:
+        deadline = time.time() + 30
+        while True:
+            try:
+                await checkout.get("/")
+                break
+            except httpx.TransportError:
+                assert time.time() < deadline, "app did not start"
+                await asyncio.sleep(0.1)
+
+        idle = await poll_status(checkout, payment_id, seconds)
+
+        stop = asyncio.Event()
+        outcomes = Counter()
+        burst = [asyncio.create_task(log_in(client, stop, outcomes)) for _ in range(logins)]
+        await asyncio.sleep(0.5)
+        busy = await poll_status(checkout, payment_id, seconds)
+        stop.set()
+        await asyncio.gather(*burst)
+        metrics = (await checkout.get("/metrics")).json()
+    return idle, busy, outcomes, metrics
+
+
+def main(logins=64, seconds=5):
+    migrate()
+    payment_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(Business(user_id="bench", email="bench@example.com", business_name="Bench",
+                        password_hash=passwords.pwd_context.hash("bench")))
+        db.add(Payment(payment_id=payment_id, user_id="bench", receiver_address="0x" + "ab" * 20, amount=1))
+        db.commit()
+
+    port = free_port()
+    # A worker process of its own, so the load generator doesn't compete with it for the GIL.
+    # Lifespan off: no chain watcher or schedulers, just the HTTP paths under test.
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--lifespan", "off", "--log-level", "warning"],
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        idle, busy, outcomes, metrics = asyncio.run(run(f"http://127.0.0.1:{port}", payment_id, logins, seconds))
+    finally:
+        server.terminate()
+        server.wait()
+
+    for label, latencies in (("idle", idle), (f"{logins} logins in flight", busy)):
+        print(f"/payment/status {label}: {len(latencies)} requests, "
+              f"p50 {percentile(latencies, 50) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms")
+    print(f"logins answered: {dict(outcomes)}")
+    print(f"password_hashing: {metrics['password_hashing']}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,69 @@
+"""
+Payouts per second through the payout scheduler, against a local dev chain.
+
+    python -m bench.payouts [payouts] [wallets]
+
+Queues the payouts spread over the source wallets, starts a scheduler and
+times how long it takes until every one is settled as Successful.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("SECRET_KEY", "bench")
+
+from eth_account import Account  # noqa: E402
+from sqlalchemy import func  # noqa: E402
+from web3 import HTTPProvider, Web3  # noqa: E402
+
+import payouts  # noqa: E402
+from database import SessionLocal, migrate  # noqa: E402
+from models import Business, Payout, Wallet  # noqa: E402
+from sender import GasPriceCache, NonceManager, ReceiptTracker  # noqa: E402
+from tests.stubs import DevChain  # noqa: E402
+
+
+def main(count=1000, wallet_count=4):
+    migrate()
+    chain = DevChain().start()
+    w3 = Web3(HTTPProvider(chain.url))
+    payouts.web3 = w3
+    payouts.nonce_manager = NonceManager(w3)
+    payouts.gas_price_cache = GasPriceCache(w3)
+    payouts.receipt_tracker = ReceiptTracker(w3, poll_interval=0.1)
+
+    accounts = [Account.create() for _ in range(wallet_count)]
+    with SessionLocal() as db:
+        db.add(Business(user_id="bench", email="bench@example.com", business_name="Bench", password_hash="x"))
+        for account in accounts:
+            db.add(Wallet(wallet_id=str(uuid.uuid4()), user_id="bench", address=account.address, private_key=account.key.hex()))
+            chain.balances[account.address.lower()] = 10**24
+        db.commit()
+        wallets = db.query(Wallet).all()
+        for i in range(count):
+            payouts.enqueue(db, wallets[i % wallet_count], Web3.to_checksum_address("0x" + "%040x" % (i + 1)), 0.001)
+        db.commit()
+
+    scheduler = payouts.PayoutScheduler(poll_interval=0.1)
+    started = time.perf_counter()
+    scheduler.start()
+    while True:
+        with SessionLocal() as db:
+            done = db.query(func.count()).select_from(Payout).filter(Payout.status == payouts.SUCCESSFUL).scalar()
+        if done == count:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    scheduler.stop()
+    chain.stop()
+
+    print(f"{count} payouts from {wallet_count} wallet(s) settled in {elapsed:.2f}s: {count / elapsed:.0f} payouts/s")
+    print(f"RPC requests: {chain.node.requests} ({chain.node.batches} batches), by method: {dict(chain.node.calls)}")
+    print(f"scheduler: {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
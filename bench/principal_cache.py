@@ -0,0 +1,61 @@
+"""
+Cost of authenticating a request, with and without the JWT principal cache.
+
+    python -m bench.principal_cache [requests]
+
+Signs up a business, then sends authenticated GET /me requests through the
+app twice: once with the cache emptied before every request, so each one
+decodes the JWT and loads the business, and once with it warm. Reports
+requests/s and database queries per request for both.
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("SECRET_KEY", "bench")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import app  # noqa: E402
+from database import async_engine, migrate  # noqa: E402
+
+
+def run(client, headers, count, cached):
+    statements = 0
+
+    def count_statement(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    started = time.perf_counter()
+    for _ in range(count):
+        if not cached:
+            app.principal_cache.clear()
+        response = client.get("/me", headers=headers)
+        assert response.status_code == 200, response.text
+    elapsed = time.perf_counter() - started
+    event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    return elapsed, statements
+
+
+def main(count=2000):
+    migrate()
+    client = TestClient(app.app)
+    signup = client.post("/users/signup", json={"email": "bench@example.com", "business_name": "Bench", "password": "bench"})
+    headers = {"Authorization": f"Bearer {signup.json()['access_token']}"}
+    # Warm up connections and the cache
+    client.get("/me", headers=headers)
+
+    for label, cached in (("uncached", False), ("cached", True)):
+        elapsed, statements = run(client, headers, count, cached)
+        print(f"{label:>8}: {count} requests in {elapsed:.2f}s, {count / elapsed:.0f} req/s, "
+              f"{elapsed / count * 1e6:.0f} us/request, {statements / count:.2f} queries/request")
+    print(f"principal_cache: {app.principal_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,109 @@
+"""
+Cost of encoding API list responses and webhook payloads.
+
+    python -m bench.serialization [rows] [repeat]
+
+Loads `rows` transactions and payments and times turning them into a list
+response two ways: the way the app used to (a `__table__.columns` walk per
+row, pydantic's `response_model=dict` encoding and the stdlib JSONResponse)
+and with `serialization.to_dict` and ORJSONResponse. It does the same for a webhook
+payload holding a web3 receipt, `json.dumps` against `serialization.dumps`,
+and checks each pair decodes to the same JSON.
+"""
+import json
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+from collections.abc import Mapping
+from datetime import date, datetime
+from decimal import Decimal
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("SECRET_KEY", "bench")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from hexbytes import HexBytes  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from web3.datastructures import AttributeDict  # noqa: E402
+
+import serialization  # noqa: E402
+from database import SessionLocal, migrate  # noqa: E402
+from models import Payment, Transaction  # noqa: E402
+
+
+def columns_to_dict(row):
+    """`to_dict` as it was: every column looked up by name, for every row."""
+    return {column.name: getattr(row, column.name) for column in row.__table__.columns}
+
+
+# What FastAPI did with a route's dict for `response_model=dict`
+response_model = TypeAdapter(dict)
+
+
+def old_response(content):
+    return JSONResponse(response_model.dump_python(response_model.validate_python(content), mode="json")).body
+
+
+def old_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def fill(count):
+    with SessionLocal() as db:
+        for i in range(count):
+            db.add(Transaction(transaction_id=str(uuid.uuid4()), payment_id=str(uuid.uuid4()), from_address="0x" + "de" * 20,
+                               to_address="0x" + "ab" * 20, amount=Decimal("1.5"), gas_fee=Decimal("0.00021"), status="Successful",
+                               block_number=i, transaction_hash="0x" + "ab" * 32, created_at=datetime.utcnow()))
+            db.add(Payment(payment_id=str(uuid.uuid4()), user_id="bench", receiver_address="0x" + "ab" * 20,
+                           sender_address="0x" + "de" * 20, amount=Decimal("2.25"), status="Pending"))
+        db.commit()
+
+
+def best(fn, number, repeat):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def compare(label, old, new, number, repeat):
+    assert json.loads(old()) == json.loads(new()), f"{label}: outputs differ"
+    before, after = best(old, number, repeat), best(new, number, repeat)
+    print(f"{label}: {before * 1e6:.1f} us -> {after * 1e6:.1f} us ({before / after:.1f}x)")
+
+
+def main(count=100, repeat=5):
+    migrate()
+    fill(count)
+    with SessionLocal() as db:
+        for name, model in (("transactions", Transaction), ("payments", Payment)):
+            rows = db.query(model).all()
+            compare(
+                f"{count} {name}",
+                lambda: old_response({name: [columns_to_dict(row) for row in rows], "next_cursor": None}),
+                lambda: serialization.ORJSONResponse({name: [serialization.to_dict(row) for row in rows], "next_cursor": None}).body,
+                50, repeat,
+            )
+            before = best(lambda: [columns_to_dict(row) for row in rows], 100, repeat)
+            after = best(lambda: [serialization.to_dict(row) for row in rows], 100, repeat)
+            print(f"  rows to dicts alone: {before * 1e6:.1f} us -> {after * 1e6:.1f} us ({before / after:.1f}x)")
+
+    receipt = AttributeDict({
+        "transactionHash": HexBytes("0x" + "ab" * 32), "blockHash": HexBytes("0x" + "cd" * 32), "blockNumber": 123,
+        "from": "0x" + "11" * 20, "to": "0x" + "22" * 20, "gasUsed": 21000, "status": 1,
+        "logs": [AttributeDict({"data": HexBytes("0x00"), "topics": [HexBytes("0x" + "ee" * 32)]})],
+    })
+    payload = {"sender": "0x" + "de" * 20, "recv": "0x" + "ab" * 20, "amount": Decimal("1.5"), "payment_id": str(uuid.uuid4()),
+               "receipt": receipt, "tx_hash": "0x" + "ab" * 32, "created_at": datetime.utcnow()}
+    compare("webhook payload", lambda: json.dumps(payload, default=old_default), lambda: serialization.dumps(payload), 2000, repeat)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
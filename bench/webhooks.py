@@ -0,0 +1,84 @@
+"""
+Webhook deliveries per second while some merchants are slow or failing.
+
+    python -m bench.webhooks [webhooks] [bad_share]
+
+Queues the webhooks across two stub receivers. One answers straight away;
+the other is a struggling merchant that times out on half of its share and
+answers 500 to the rest. Times how long until every webhook for the healthy
+merchant is delivered, which the struggling one shouldn't hold up, and how
+long until every other one has had its first attempt.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("SECRET_KEY", "bench")
+
+from sqlalchemy import func  # noqa: E402
+
+import webhooks  # noqa: E402
+from database import SessionLocal, async_engine, migrate  # noqa: E402
+from models import WebhookOutbox  # noqa: E402
+from tests.stubs import StubReceiver  # noqa: E402
+
+
+def counts():
+    with SessionLocal() as db:
+        return dict(
+            db.query(WebhookOutbox.status, func.count())
+            .filter(WebhookOutbox.attempts > 0)
+            .group_by(WebhookOutbox.status)
+            .all()
+        )
+
+
+async def run(dispatcher, healthy, count):
+    started = time.perf_counter()
+    healthy_done = None
+    await dispatcher.start()
+    while True:
+        attempted = counts()
+        if healthy_done is None and attempted.get(webhooks.DELIVERED, 0) >= healthy:
+            healthy_done = time.perf_counter() - started
+        if sum(attempted.values()) >= count:
+            break
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    await dispatcher.stop()
+    await async_engine.dispose()
+    return healthy_done, elapsed
+
+
+def main(count=2000, bad_share=0.1):
+    migrate()
+    healthy = StubReceiver().start()
+    struggling = StubReceiver(slow_delay=5).start()
+    bad = int(count * bad_share)
+    with SessionLocal() as db:
+        for i in range(count):
+            if i < bad:
+                url = f"{struggling.url}/{'slow' if i % 2 else 'fail'}/{i}"
+            else:
+                url = f"{healthy.url}/ok/{i}"
+            webhooks.enqueue(db, str(uuid.uuid4()), url, {"payment_id": str(i), "status": "Successful", "amount": 1.5})
+        db.commit()
+
+    dispatcher = webhooks.WebhookDispatcher(timeout=1, base_delay=60, poll_interval=0.1)
+    healthy_done, elapsed = asyncio.run(run(dispatcher, count - bad, count))
+    healthy.stop()
+    struggling.stop()
+
+    print(f"{count - bad} webhooks to the healthy merchant delivered in {healthy_done:.2f}s: {(count - bad) / healthy_done:.0f} webhooks/s")
+    print(f"{bad} to the slow or failing merchant all attempted after {elapsed:.2f}s")
+    print(f"outbox: {counts()}")
+    print(f"dispatcher: {dispatcher.stats()}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:3]
+    main(int(args[0]) if args else 2000, float(args[1]) if len(args) > 1 else 0.1)
@@ -1,8 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from contextlib import contextmanager
 from dotenv import load_dotenv
 import os
+import threading
+import time
 
 
 load_dotenv()
@@ -10,10 +16,164 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Async drivers for the sync DATABASE_URL schemes we support
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url):
+    """Derive the async driver URL matching a sync DATABASE_URL."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=ASYNC_DRIVERS.get(backend, url.drivername)).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+# Connection pool sizing, per engine and per worker process. Watchers and other
+# background work only hold a connection for one short unit of work, so the
+# pool is sized for concurrent requests, not for the number of open payments.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Seconds a worker waits for another one's SQLite migration to finish
+SQLITE_MIGRATE_TIMEOUT = 300
+
+
+class _TimedPool:
+    """Records how often and how long callers wait to check a connection out of the pool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def stats(self):
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": self.checkouts,
+            "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else None,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            "timeouts": self.timeouts,
+        }
+
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(url, poolclass):
+    """Engine keyword arguments for the configured pool; in-memory SQLite keeps its single shared connection."""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, TimedQueuePool))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# `async def` endpoints must use the async engine so a slow query never blocks
+# the event loop; plain `def` endpoints keep using SessionLocal, which FastAPI
+# already runs on its threadpool.
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, TimedAsyncQueuePool))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def pool_stats():
+    """Connection pool metrics for both engines."""
+    return {
+        name: pool.stats() if isinstance(pool, _TimedPool) else {"status": pool.status()}
+        for name, pool in (("sync", engine.pool), ("async", async_engine.pool))
+    }
+
+def migrate():
+    """Bring the database schema up to date by running the Alembic migrations."""
+    from alembic import command
+    from alembic.config import Config
+    from sqlalchemy import inspect, text
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    config = Config(os.path.join(base_dir, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(base_dir, "migrations"))
+
+    with engine.begin() as connection:
+        busy_timeout = None
+        try:
+            # Only one worker migrates at a time, the others wait and find nothing to do
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SELECT pg_advisory_xact_lock(7243110)"))
+            elif connection.dialect.name == "sqlite":
+                # No advisory locks; an exclusive transaction around the upgrade does the same job.
+                # Waiting workers give up after busy_timeout, so allow for a slow migration.
+                busy_timeout = connection.exec_driver_sql("PRAGMA busy_timeout").scalar()
+                connection.exec_driver_sql(f"PRAGMA busy_timeout = {SQLITE_MIGRATE_TIMEOUT * 1000}")
+                connection.exec_driver_sql("BEGIN EXCLUSIVE")
+            config.attributes["connection"] = connection
+            inspector = inspect(connection)
+            if inspector.has_table("businesses") and not inspector.has_table("alembic_version"):
+                # Database predates migrations and was built with create_all
+                command.stamp(config, "0001")
+            command.upgrade(config, "head")
+        finally:
+            if busy_timeout is not None:
+                # The connection goes back to the pool
+                connection.exec_driver_sql(f"PRAGMA busy_timeout = {busy_timeout}")
+
+@contextmanager
+def session_scope():
+    """
+    Short-lived session for one unit of background work (settlement,
+    watchers, withdrawals). Commits on success, rolls back on error and
+    always returns the connection to the pool. Request handlers use `get_db`.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -21,3 +181,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency to get an async DB session for `async def` endpoints
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,214 @@
+"""
+Push payment status changes to SSE and WebSocket clients.
+
+Settlement calls `publish_status` after its commit. The message goes out on
+the PAYMENT_STATUS pub/sub channel, so every worker (through Redis when
+REDIS_URL is set) hands it to its `broker`, which fans it out on the event
+loop to everyone following that payment or that merchant. Subscribers read
+from their own bounded queue. Nothing polls the database: a stream reads the
+payment once when it opens and is only woken by published changes.
+"""
+import asyncio
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pubsub
+from database import AsyncSessionLocal
+from models import Payment
+from serialization import dumps
+
+
+PAYMENT_STATUS = "payment.status"
+FINAL_STATUSES = {"Successful", "Failed"}
+
+# Events buffered per subscriber before it is treated as too slow and dropped
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "32"))
+# Seconds between SSE keep-alive comments, so proxies don't close idle streams
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# Stop proxies (nginx in particular) from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def payment_event(payment):
+    return {
+        "payment_id": payment.payment_id,
+        "user_id": payment.user_id,
+        "status": payment.status,
+        "transaction_hash": payment.transaction_hash,
+    }
+
+
+def publish_status(payment):
+    """Announce a payment's committed status. Call only after the commit."""
+    pubsub.publish(PAYMENT_STATUS, payment_event(payment))
+
+
+class Subscription:
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    async def get(self, timeout=None):
+        """Next event, or None on timeout. Raises ConnectionError once the subscriber fell behind."""
+        if self.dropped and self.queue.empty():
+            raise ConnectionError("Subscriber fell too far behind")
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._loop = None
+        # ("payment", payment_id) / ("merchant", user_id) -> subscriptions
+        self._topics = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def handle(self, message):
+        """pubsub handler; may run on any thread."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fan_out, message)
+
+    def _fan_out(self, message):
+        self.published += 1
+        for topic in (("payment", message["payment_id"]), ("merchant", message["user_id"])):
+            for subscription in list(self._topics.get(topic, ())):
+                try:
+                    subscription.queue.put_nowait(message)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    # Never let one slow client hold up the others; it reconnects and reads the current state
+                    subscription.dropped = True
+                    self._topics[topic].discard(subscription)
+                    self.dropped += 1
+
+    @contextmanager
+    def subscribe(self, kind, key):
+        """Follow ("payment", payment_id) or ("merchant", user_id). Must be entered on the event loop."""
+        self._loop = asyncio.get_running_loop()
+        topic = (kind, key)
+        subscription = Subscription(self.queue_size)
+        self._topics[topic].add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def stats(self):
+        return {
+            "topics": len(self._topics),
+            "subscribers": sum(len(subscribers) for subscribers in self._topics.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+broker = EventBroker()
+pubsub.subscribe(PAYMENT_STATUS, broker.handle)
+
+
+def _message(event):
+    """What a client is sent: the fields of /payment/status. The merchant's user_id is only for routing."""
+    return dumps({key: value for key, value in event.items() if key != "user_id"}).decode()
+
+
+def _sse(event):
+    return f"event: status\ndata: {_message(event)}\n\n"
+
+
+async def sse_stream(subscription, initial=None, until_final=False):
+    """
+    Server-Sent Events for a subscription. `initial` is sent first; with
+    `until_final` the stream ends after a Successful or Failed status.
+    """
+    if initial is not None:
+        yield _sse(initial)
+        if until_final and initial["status"] in FINAL_STATUSES:
+            return
+    while True:
+        try:
+            event = await subscription.get(EVENTS_KEEPALIVE)
+        except ConnectionError:
+            return
+        if event is None:
+            yield ": keep-alive\n\n"
+            continue
+        yield _sse(event)
+        if until_final and event["status"] in FINAL_STATUSES:
+            return
+
+
+async def _until_disconnect(websocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+
+async def websocket_stream(websocket, subscription, initial=None, until_final=False):
+    """Send the same events as JSON messages over an accepted WebSocket, then close it."""
+    # Watch for the client going away while we wait, instead of noticing only at the next send
+    disconnected = asyncio.ensure_future(_until_disconnect(websocket))
+    try:
+        if initial is not None:
+            await websocket.send_text(_message(initial))
+            if until_final and initial["status"] in FINAL_STATUSES:
+                await websocket.close()
+                return
+        while True:
+            event = asyncio.ensure_future(subscription.get())
+            await asyncio.wait({event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                event.cancel()
+                return
+            try:
+                message = event.result()
+            except ConnectionError:
+                # 1013: try again later
+                await websocket.close(code=1013)
+                return
+            await websocket.send_text(_message(message))
+            if until_final and message["status"] in FINAL_STATUSES:
+                await websocket.close()
+                return
+    finally:
+        disconnected.cancel()
+
+
+async def _current(payment_id):
+    async with AsyncSessionLocal() as db:
+        payment = await db.get(Payment, payment_id)
+        return payment_event(payment) if payment is not None else None
+
+
+async def payment_sse(payment_id):
+    """SSE for one payment: its current status, then every change until it is final."""
+    # Subscribe before reading, so a change committed in between isn't missed
+    with broker.subscribe("payment", payment_id) as subscription:
+        async for chunk in sse_stream(subscription, await _current(payment_id), until_final=True):
+            yield chunk
+
+
+async def merchant_sse(user_id):
+    """SSE for every payment of one merchant, until the client disconnects."""
+    with broker.subscribe("merchant", user_id) as subscription:
+        async for chunk in sse_stream(subscription):
+            yield chunk
+
+
+async def payment_websocket(websocket, payment_id):
+    with broker.subscribe("payment", payment_id) as subscription:
+        initial = await _current(payment_id)
+        if initial is None:
+            await websocket.close(code=4404, reason="No Payment with this ID")
+            return
+        await websocket_stream(websocket, subscription, initial, until_final=True)
@@ -0,0 +1,93 @@
+"""Baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'businesses',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('business_name', sa.String(), nullable=False),
+        sa.Column('password_hash', sa.String(), nullable=False),
+        sa.Column('api_key', sa.String(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('updated_at', sa.TIMESTAMP(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+        sa.UniqueConstraint('api_key'),
+        sa.UniqueConstraint('email'),
+    )
+    op.create_table(
+        'wallets',
+        sa.Column('wallet_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('address', sa.String(), nullable=False),
+        sa.Column('private_key', sa.String(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['businesses.user_id']),
+        sa.PrimaryKeyConstraint('wallet_id'),
+        sa.UniqueConstraint('address'),
+    )
+    op.create_table(
+        'payments',
+        sa.Column('payment_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('receiver_address', sa.String(), nullable=False),
+        sa.Column('data', sa.String(), nullable=True),
+        sa.Column('amount', sa.DECIMAL(precision=18, scale=8), nullable=False),
+        sa.Column('sender_address', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('transaction_hash', sa.String(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('updated_at', sa.TIMESTAMP(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['businesses.user_id']),
+        sa.PrimaryKeyConstraint('payment_id'),
+    )
+    op.create_table(
+        'transactions',
+        sa.Column('transaction_id', sa.String(), nullable=False),
+        sa.Column('payment_id', sa.String(), nullable=False),
+        sa.Column('from_address', sa.String(), nullable=False),
+        sa.Column('to_address', sa.String(), nullable=False),
+        sa.Column('amount', sa.DECIMAL(precision=18, scale=8), nullable=False),
+        sa.Column('gas_fee', sa.DECIMAL(precision=18, scale=8), nullable=False),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('block_number', sa.BigInteger(), nullable=True),
+        sa.Column('transaction_hash', sa.String(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.ForeignKeyConstraint(['payment_id'], ['payments.payment_id']),
+        sa.PrimaryKeyConstraint('transaction_id'),
+    )
+    op.create_table(
+        'analytics',
+        sa.Column('analytics_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('total_payments', sa.Integer(), nullable=True),
+        sa.Column('total_revenue', sa.DECIMAL(precision=18, scale=8), nullable=True),
+        sa.Column('last_updated', sa.TIMESTAMP(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['businesses.user_id']),
+        sa.PrimaryKeyConstraint('analytics_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('analytics')
+    op.drop_table('transactions')
+    op.drop_table('payments')
+    op.drop_table('wallets')
+    op.drop_table('businesses')
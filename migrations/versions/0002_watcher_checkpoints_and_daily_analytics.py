@@ -0,0 +1,58 @@
+"""Watcher checkpoints and daily analytics rollups
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:05:00
+
+Databases that were created with Base.metadata.create_all may already have
+these tables, so each step checks before creating.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table('watcher_checkpoints'):
+        op.create_table(
+            'watcher_checkpoints',
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('block_number', sa.BigInteger(), nullable=False),
+            sa.Column('updated_at', sa.TIMESTAMP(), nullable=True),
+            sa.PrimaryKeyConstraint('name'),
+        )
+
+    if not inspector.has_table('analytics_daily'):
+        op.create_table(
+            'analytics_daily',
+            sa.Column('user_id', sa.String(), nullable=False),
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('payment_count', sa.Integer(), nullable=False),
+            sa.Column('payment_volume', sa.DECIMAL(precision=18, scale=8), nullable=False),
+            sa.Column('withdrawal_count', sa.Integer(), nullable=False),
+            sa.Column('withdrawal_volume', sa.DECIMAL(precision=18, scale=8), nullable=False),
+            sa.Column('gas_fees', sa.DECIMAL(precision=18, scale=8), nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['businesses.user_id']),
+            sa.PrimaryKeyConstraint('user_id', 'day'),
+        )
+
+    # Analytics counters are upserted on user_id, which needs a unique index
+    existing = {index['name'] for index in inspector.get_indexes('analytics')}
+    if 'ix_analytics_user_id' not in existing:
+        op.create_index('ix_analytics_user_id', 'analytics', ['user_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_analytics_user_id', table_name='analytics')
+    op.drop_table('analytics_daily')
+    op.drop_table('watcher_checkpoints')
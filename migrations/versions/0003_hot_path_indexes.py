@@ -0,0 +1,39 @@
+"""Composite indexes for hot query paths
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ('ix_transactions_to_address_created_at', 'transactions', ['to_address', sa.text('created_at DESC')]),
+    ('ix_transactions_from_address_created_at', 'transactions', ['from_address', sa.text('created_at DESC')]),
+    ('ix_transactions_payment_id', 'transactions', ['payment_id']),
+    ('ix_payments_user_id_created_at', 'payments', ['user_id', sa.text('created_at DESC')]),
+    ('ix_payments_receiver_address_created_at', 'payments', ['receiver_address', sa.text('created_at DESC')]),
+    ('ix_payments_sender_address_created_at', 'payments', ['sender_address', sa.text('created_at DESC')]),
+    ('ix_wallets_user_id', 'wallets', ['user_id']),
+]
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,42 @@
+"""Webhook outbox
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 09:45:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'webhook_outbox',
+        sa.Column('webhook_id', sa.String(), nullable=False),
+        sa.Column('payment_id', sa.String(), nullable=False),
+        sa.Column('url', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.TIMESTAMP(), nullable=False),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('delivered_at', sa.TIMESTAMP(), nullable=True),
+        sa.ForeignKeyConstraint(['payment_id'], ['payments.payment_id']),
+        sa.PrimaryKeyConstraint('webhook_id'),
+    )
+    op.create_index('ix_webhook_outbox_status_next_attempt_at', 'webhook_outbox', ['status', 'next_attempt_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_webhook_outbox_status_next_attempt_at', table_name='webhook_outbox')
+    op.drop_table('webhook_outbox')
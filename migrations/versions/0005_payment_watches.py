@@ -0,0 +1,39 @@
+"""Durable payment watches
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 10:20:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'payment_watches',
+        sa.Column('payment_id', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('sender_address', sa.String(), nullable=False),
+        sa.Column('receiver_address', sa.String(), nullable=False),
+        sa.Column('amount', sa.DECIMAL(precision=18, scale=8), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('start_block', sa.BigInteger(), nullable=True),
+        sa.Column('deadline', sa.TIMESTAMP(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.ForeignKeyConstraint(['payment_id'], ['payments.payment_id']),
+        sa.PrimaryKeyConstraint('payment_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('payment_watches')
@@ -0,0 +1,33 @@
+"""Leases on payment watches
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 10:50:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('payment_watches', sa.Column('owner', sa.String(), nullable=True))
+    op.add_column('payment_watches', sa.Column('lease_expires_at', sa.TIMESTAMP(), nullable=True))
+    op.create_index('ix_payment_watches_owner', 'payment_watches', ['owner'])
+    op.create_index('ix_payment_watches_lease_expires_at', 'payment_watches', ['lease_expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_payment_watches_lease_expires_at', table_name='payment_watches')
+    op.drop_index('ix_payment_watches_owner', table_name='payment_watches')
+    with op.batch_alter_table('payment_watches') as batch_op:
+        batch_op.drop_column('lease_expires_at')
+        batch_op.drop_column('owner')
@@ -0,0 +1,50 @@
+"""Payout queue
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 13:20:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'payouts',
+        sa.Column('payout_id', sa.String(), nullable=False),
+        sa.Column('payment_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('wallet_address', sa.String(), nullable=False),
+        sa.Column('receiver_address', sa.String(), nullable=False),
+        sa.Column('amount', sa.DECIMAL(18, 8), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('nonce', sa.BigInteger(), nullable=True),
+        sa.Column('transaction_hash', sa.String(), nullable=True),
+        sa.Column('raw_transaction', sa.Text(), nullable=True),
+        sa.Column('owner', sa.String(), nullable=True),
+        sa.Column('lease_expires_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('sent_at', sa.TIMESTAMP(), nullable=True),
+        sa.Column('settled_at', sa.TIMESTAMP(), nullable=True),
+        sa.ForeignKeyConstraint(['payment_id'], ['payments.payment_id']),
+        sa.ForeignKeyConstraint(['user_id'], ['businesses.user_id']),
+        sa.PrimaryKeyConstraint('payout_id'),
+    )
+    op.create_index('ix_payouts_status_wallet_address_created_at', 'payouts', ['status', 'wallet_address', 'created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_payouts_status_wallet_address_created_at', table_name='payouts')
+    op.drop_table('payouts')
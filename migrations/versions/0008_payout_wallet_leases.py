@@ -0,0 +1,29 @@
+"""Payout leases on wallets
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 09:40:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('wallets', sa.Column('payout_owner', sa.String(), nullable=True))
+    op.add_column('wallets', sa.Column('payout_lease_expires_at', sa.TIMESTAMP(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('wallets') as batch_op:
+        batch_op.drop_column('payout_lease_expires_at')
+        batch_op.drop_column('payout_owner')
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, String, Integer, DECIMAL, TIMESTAMP, ForeignKey, BigInteger
+from sqlalchemy import Column, String, Integer, DECIMAL, TIMESTAMP, Date, Text, ForeignKey, BigInteger, Index, event, inspect
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, Session, object_session
 import uuid
 from datetime import datetime
 from database import Base
+import hashlib
 import secrets
+import pubsub
 
 class Business(Base):
     __tablename__ = "businesses"
@@ -29,14 +31,46 @@ class Business(Base):
     analytics = relationship("Analytics", back_populates="business")
 
 
+# Caches of business identities listen on this channel to drop stale entries
+BUSINESS_CHANGED = "business.changed"
+
+
+def api_key_hash(api_key):
+    """Stands in for an API key in caches and BUSINESS_CHANGED messages, so the key itself isn't sent to other workers."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+@event.listens_for(Business, "after_update")
+@event.listens_for(Business, "after_delete")
+def _track_business_change(mapper, connection, target):
+    # Remember the change on the session and only announce it once it commits
+    previous_keys = inspect(target).attrs.api_key.history.deleted or ()
+    change = {"user_id": target.user_id, "api_key_hashes": [api_key_hash(key) for key in (target.api_key, *previous_keys)]}
+    object_session(target).info.setdefault("changed_businesses", []).append(change)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_business_changes(session):
+    for change in session.info.pop("changed_businesses", ()):
+        pubsub.publish(BUSINESS_CHANGED, change)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_business_changes(session):
+    session.info.pop("changed_businesses", None)
+
+
 class Wallet(Base):
     __tablename__ = "wallets"
 
     wallet_id = Column(String, primary_key=True, default=str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("businesses.user_id"), nullable=False)
+    user_id = Column(String, ForeignKey("businesses.user_id"), index=True, nullable=False)
     address = Column(String, unique=True, nullable=False)
     private_key = Column(String, nullable=False)
     created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    # One payout scheduler at a time signs for this wallet, so nonces are handed out by a single process
+    payout_owner = Column(String, nullable=True)
+    payout_lease_expires_at = Column(TIMESTAMP, nullable=True)
 
     owner = relationship("Business", back_populates="wallets")
 
@@ -59,11 +93,17 @@ class Payment(Base):
     transactions = relationship("Transaction", back_populates="payment")
 
 
+# Dashboard and listing queries filter on these columns and order by newest first
+Index("ix_payments_user_id_created_at", Payment.user_id, Payment.created_at.desc())
+Index("ix_payments_receiver_address_created_at", Payment.receiver_address, Payment.created_at.desc())
+Index("ix_payments_sender_address_created_at", Payment.sender_address, Payment.created_at.desc())
+
+
 class Transaction(Base):
     __tablename__ = "transactions"
 
     transaction_id = Column(String, primary_key=True, default=str(uuid.uuid4()))
-    payment_id = Column(String, ForeignKey("payments.payment_id"), nullable=False)
+    payment_id = Column(String, ForeignKey("payments.payment_id"), index=True, nullable=False)
     from_address = Column(String, nullable=False)
     to_address = Column(String, nullable=False)
     amount = Column(DECIMAL(18, 8), nullable=False)
@@ -76,13 +116,100 @@ class Transaction(Base):
     payment = relationship("Payment", back_populates="transactions")
 
 
+Index("ix_transactions_to_address_created_at", Transaction.to_address, Transaction.created_at.desc())
+Index("ix_transactions_from_address_created_at", Transaction.from_address, Transaction.created_at.desc())
+
+
 class Analytics(Base):
     __tablename__ = "analytics"
 
     analytics_id = Column(String, primary_key=True, default=str(uuid.uuid4()))
-    user_id = Column(String, ForeignKey("businesses.user_id"), nullable=False)
+    user_id = Column(String, ForeignKey("businesses.user_id"), unique=True, index=True, nullable=False)
     total_payments = Column(Integer, default=0)
     total_revenue = Column(DECIMAL(18, 8), default=0)
     last_updated = Column(TIMESTAMP, default=datetime.utcnow)
 
     business = relationship("Business", back_populates="analytics")
+
+
+class AnalyticsDaily(Base):
+    __tablename__ = "analytics_daily"
+
+    user_id = Column(String, ForeignKey("businesses.user_id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    payment_count = Column(Integer, nullable=False, default=0)
+    payment_volume = Column(DECIMAL(18, 8), nullable=False, default=0)
+    withdrawal_count = Column(Integer, nullable=False, default=0)
+    withdrawal_volume = Column(DECIMAL(18, 8), nullable=False, default=0)
+    gas_fees = Column(DECIMAL(18, 8), nullable=False, default=0)
+
+
+class WatcherCheckpoint(Base):
+    __tablename__ = "watcher_checkpoints"
+
+    name = Column(String, primary_key=True)
+    block_number = Column(BigInteger, nullable=False)
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PaymentWatch(Base):
+    __tablename__ = "payment_watches"
+
+    payment_id = Column(String, ForeignKey("payments.payment_id"), primary_key=True)
+    kind = Column(String, nullable=False)
+    sender_address = Column(String, nullable=False)
+    receiver_address = Column(String, nullable=False)
+    amount = Column(DECIMAL(18, 8), nullable=False)
+    payload = Column(Text, nullable=False)
+    start_block = Column(BigInteger, nullable=True)
+    deadline = Column(TIMESTAMP, nullable=False)
+    # The process watching this payment holds a lease it keeps renewing; an expired lease can be taken over
+    owner = Column(String, nullable=True, index=True)
+    lease_expires_at = Column(TIMESTAMP, nullable=True, index=True)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+
+
+class WebhookOutbox(Base):
+    __tablename__ = "webhook_outbox"
+
+    webhook_id = Column(String, primary_key=True)
+    payment_id = Column(String, ForeignKey("payments.payment_id"), nullable=False)
+    url = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="Pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(TIMESTAMP, nullable=False, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    delivered_at = Column(TIMESTAMP, nullable=True)
+
+
+# The dispatcher polls for pending rows that are due
+Index("ix_webhook_outbox_status_next_attempt_at", WebhookOutbox.status, WebhookOutbox.next_attempt_at)
+
+
+class Payout(Base):
+    __tablename__ = "payouts"
+
+    payout_id = Column(String, primary_key=True)
+    payment_id = Column(String, ForeignKey("payments.payment_id"), nullable=False)
+    user_id = Column(String, ForeignKey("businesses.user_id"), nullable=False)
+    wallet_address = Column(String, nullable=False)
+    receiver_address = Column(String, nullable=False)
+    amount = Column(DECIMAL(18, 8), nullable=False)
+    status = Column(String, nullable=False, default="Queued")
+    # Stored before broadcasting, so a restarted worker can resend the exact same transaction
+    nonce = Column(BigInteger, nullable=True)
+    transaction_hash = Column(String, nullable=True)
+    raw_transaction = Column(Text, nullable=True)
+    owner = Column(String, nullable=True)
+    lease_expires_at = Column(TIMESTAMP, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)
+    sent_at = Column(TIMESTAMP, nullable=True)
+    settled_at = Column(TIMESTAMP, nullable=True)
+
+
+# The scheduler claims queued payouts per source wallet, oldest first
+Index("ix_payouts_status_wallet_address_created_at", Payout.status, Payout.wallet_address, Payout.created_at)
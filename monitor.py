@@ -7,25 +7,38 @@ from web3.providers.persistent import (
     AsyncIPCProvider,
     WebSocketProvider,
 )
-import requests
-import time
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from price import price_oracle
+from rpc import ProviderPool, parse_rpc_urls
 
 
 # # Wallet or contract address to monitor
-rpc_url = "https://sepolia.base.org"
+# Comma-separated; each call goes to the healthiest endpoint and fails over to the others
+rpc_urls = parse_rpc_urls(os.getenv("MONITOR_RPC_URLS", "https://sepolia.base.org"))
+rpc_url = rpc_urls[0]
 # "https://neoxt4seed1.ngd.network"
 
 
 # Connect to an Ethereum node (e.g., using Infura or a local node)
-w3 = Web3(Web3.HTTPProvider(rpc_url))
+w3 = Web3(ProviderPool(rpc_urls))
+
+# Transaction lookups are resolved in JSON-RPC batches of this many hashes,
+# with up to RPC_BATCH_CONCURRENCY batches in flight at once
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "100"))
+RPC_BATCH_CONCURRENCY = int(os.getenv("RPC_BATCH_CONCURRENCY", "4"))
+# Full blocks are much larger than transactions, so fewer go in a batch
+RPC_BLOCK_BATCH_SIZE = 10
+_batch_executor = ThreadPoolExecutor(max_workers=RPC_BATCH_CONCURRENCY, thread_name_prefix="rpc-batch")
 
 
-# Function to fetch ETH to USDT price from CoinGecko
+# Convert a wei amount to USDC using the cached price oracle
 def get_gas_to_usdc(value):
-    url = "https://min-api.cryptocompare.com/data/price?fsym=ETH&tsyms=USDC"
-    response = requests.get(url)
-    data = response.json()
-    usdC_val = data['USDC']
+    usdC_val = price_oracle.get_price()
     usdt_balance = (value / 10**18) * usdC_val
     return usdt_balance
 
@@ -44,11 +57,134 @@ def monitor_confirmed_transactions(tx_hash):
 
 
 
+def fetch_transaction(tx_hash):
+    """Fetch a transaction by hash, returning None if the node doesn't know it."""
+    try:
+        return w3.eth.get_transaction(tx_hash)
+    except Exception as e:
+        print(f"Error fetching transaction {tx_hash}: {e}")
+    return None
+
+
+def _format_transaction(raw):
+    """Normalise a raw eth_getTransactionByHash result the way w3.eth.get_transaction would."""
+    return AttributeDict({
+        **raw,
+        "hash": HexBytes(raw["hash"]),
+        "from": Web3.to_checksum_address(raw["from"]),
+        "to": Web3.to_checksum_address(raw["to"]) if raw.get("to") else None,
+        "value": int(raw["value"], 16),
+        "blockNumber": int(raw["blockNumber"], 16) if raw.get("blockNumber") else None,
+    })
+
+
+def _format_block(raw):
+    """Normalise a raw full-transaction eth_getBlockByNumber result."""
+    return AttributeDict({
+        **raw,
+        "number": int(raw["number"], 16),
+        "transactions": [_format_transaction(tx) for tx in raw["transactions"]],
+    })
+
+
+def _batch_results(responses):
+    return [
+        _format_transaction(response["result"]) if response.get("result") else None
+        for response in responses
+    ]
+
+
+def _to_hex(tx_hash):
+    return tx_hash if isinstance(tx_hash, str) else Web3.to_hex(tx_hash)
+
+
+def _chunks(tx_hashes, chunk_size):
+    return [tx_hashes[i:i + chunk_size] for i in range(0, len(tx_hashes), chunk_size)]
+
+
+def _fetch_chunk(chunk):
+    try:
+        responses = w3.provider.make_batch_request(
+            [("eth_getTransactionByHash", [_to_hex(tx_hash)]) for tx_hash in chunk]
+        )
+        return _batch_results(responses)
+    except Exception as e:
+        print(f"Error fetching batch of {len(chunk)} transactions: {e}")
+        return [None] * len(chunk)
+
+
+def fetch_transactions(tx_hashes, chunk_size=RPC_BATCH_SIZE):
+    """
+    Resolve many transaction hashes with JSON-RPC batch requests of
+    `chunk_size` hashes, with up to RPC_BATCH_CONCURRENCY batches in flight.
+    Returns transactions in the same order as the hashes, None where unknown.
+    """
+    tx_hashes = list(tx_hashes)
+    if not tx_hashes:
+        return []
+    chunks = _chunks(tx_hashes, chunk_size)
+    if len(chunks) == 1:
+        return _fetch_chunk(chunks[0])
+    return [tx for chunk_result in _batch_executor.map(_fetch_chunk, chunks) for tx in chunk_result]
+
+
+def _fetch_block_chunk(chunk):
+    try:
+        responses = w3.provider.make_batch_request(
+            [("eth_getBlockByNumber", [hex(block_number), True]) for block_number in chunk]
+        )
+        return [_format_block(response["result"]) if response.get("result") else None for response in responses]
+    except Exception as e:
+        print(f"Error fetching blocks {chunk[0]}-{chunk[-1]}: {e}")
+        return [None] * len(chunk)
+
+
+def fetch_blocks(block_numbers, chunk_size=RPC_BLOCK_BATCH_SIZE):
+    """
+    Fetch full-transaction blocks with JSON-RPC batch requests, in the same
+    order as `block_numbers`, None where the node has no block.
+    """
+    chunks = _chunks(list(block_numbers), chunk_size)
+    return [block for chunk_result in _batch_executor.map(_fetch_block_chunk, chunks) for block in chunk_result]
+
+
+async def fetch_transactions_async(async_w3, tx_hashes, chunk_size=RPC_BATCH_SIZE, max_in_flight=RPC_BATCH_CONCURRENCY):
+    """Async counterpart of `fetch_transactions` for an AsyncWeb3 HTTP connection."""
+    tx_hashes = list(tx_hashes)
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def fetch_chunk(chunk):
+        async with in_flight:
+            try:
+                responses = await async_w3.provider.make_batch_request(
+                    [("eth_getTransactionByHash", [_to_hex(tx_hash)]) for tx_hash in chunk]
+                )
+                return _batch_results(responses)
+            except Exception as e:
+                print(f"Error fetching batch of {len(chunk)} transactions: {e}")
+                return [None] * len(chunk)
+
+    chunk_results = await asyncio.gather(*(fetch_chunk(chunk) for chunk in _chunks(tx_hashes, chunk_size)))
+    return [tx for chunk_result in chunk_results for tx in chunk_result]
+
+
+def match_block_transactions(block, receivers):
+    """
+    Return the transactions in a full-transaction block whose recipient is in
+    `receivers` (a set of lowercase addresses), in one pass over the block.
+    """
+    by_receiver = {}
+    for tx in block['transactions']:
+        if tx['to']:
+            by_receiver.setdefault(tx['to'].lower(), []).append(tx)
+    return [tx for receiver in by_receiver.keys() & receivers for tx in by_receiver[receiver]]
+
+
 # Function to check if a transaction meets the criteria
 def check_transaction(tx_hash, sender_address, receiver_address, target_amount):
     try:
         # Get the transaction details using the transaction hash
-        tx = w3.eth.get_transaction(tx_hash)
+        tx = fetch_transaction(tx_hash)
 
         if tx:
             t_hash = f"0x{tx['hash'].hex()}"
@@ -73,51 +209,25 @@ def check_transaction(tx_hash, sender_address, receiver_address, target_amount):
         print(f"Error fetching transaction {tx_hash}: {e}")
     return False
 
-# Poll for new pending transactions
+# Block until a transaction between the two addresses is confirmed
 def monitor_transactions(address_1, address_2, target_amount, timeout=60*10):
-    # with open("transaction_new_log.txt", "a") as file:
-        # file.write(f"Monitoring transactions between {address_1} and {address_2} for amount {target_amount} GAS\n")
-    start_time = time.time()
-    info = False
-    filter_id = None
-    
-    try:
-        print("step 1")
-        filter = w3.eth.filter('pending')
-        filter_id = filter.filter_id
-
-        while (time.time() - start_time) <= timeout:  # Simplified timeout check
-            print("step 2")
-            pending_transactions = w3.eth.get_filter_changes(filter.filter_id)
-            print(f"pending_transactions: {pending_transactions}")
-            
-            for tx_hash in pending_transactions:
-                print("step 3")
-                # if (time.time() - start_time) > timeout:
-                #     break
-                    
-                data = check_transaction(tx_hash, address_1, address_2, target_amount)
-                print(f"data: {data}")
-                if data:
-                    print("step 4")
-                    receipt = None
-                    while not receipt and (time.time() - start_time) <= timeout:
-                        time.sleep(2)
-                        receipt = monitor_confirmed_transactions(tx_hash)
-                        print("step 5")
-
-                    if receipt and receipt['status'] == 1:
-                        print("step 6")
-                        return {"receipt": receipt, "tx_hash": f"0x{tx_hash.hex()}"}
-                    
-            # time.sleep(1)   Add small delay to prevent excessive CPU usage
-            
-        return info
-    except:
-        if filter_id:
-            try:
-                w3.eth.uninstall_filter(filter_id)
-            except Exception as e:
-                print(f"Error uninstalling filter: {e}")
-    return info
-
+    """
+    Blocking convenience wrapper around the shared chain watcher. Prefer
+    registering a callback with `watcher.chain_watcher` directly so no thread
+    is held for the lifetime of the payment.
+    """
+    from watcher import chain_watcher
+
+    done = threading.Event()
+    outcome = {"result": False}
+
+    def on_result(result):
+        outcome["result"] = result
+        done.set()
+
+    watch_id = f"monitor-{uuid.uuid4()}"
+    chain_watcher.register(watch_id, address_1, address_2, target_amount, on_result, timeout=timeout)
+    # Leave room for the final confirmation round after the deadline
+    if not done.wait(timeout + chain_watcher.poll_interval * 5):
+        chain_watcher.cancel(watch_id)
+    return outcome["result"]
@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination on (created_at, primary key), newest first.
+
+Cursors are opaque to clients. A page is fetched with `WHERE (created_at, id) <
+cursor ORDER BY created_at DESC, id DESC LIMIT n`, so page N costs the same as
+page 1 and memory per request is bounded by the page size.
+"""
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select, union_all
+from sqlalchemy.orm import aliased
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        created_at = datetime.fromisoformat(created_at)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Decodes, but not to anything we issued; it would only fail later, in the query
+    if not isinstance(row_id, (str, int)) or isinstance(row_id, bool):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, row_id
+
+
+def page_size(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def history_filters(model, status=None, start=None, end=None):
+    """Optional status and created_at range filters for the history endpoints."""
+    filters = []
+    if status:
+        filters.append(model.status == status)
+    if start:
+        filters.append(model.created_at >= start)
+    if end:
+        filters.append(model.created_at < end)
+    return filters
+
+
+def paginate(db, model, conditions, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of `model` rows matching any of `conditions`, plus the
+    cursor for the next page (None on the last page).
+
+    Each condition is paged on its own and the branches are merged, so an OR
+    across two indexed columns still only reads `limit` rows per branch.
+    """
+    id_column = model.__mapper__.primary_key[0]
+    keyset = []
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        keyset.append(or_(model.created_at < created_at, and_(model.created_at == created_at, id_column < row_id)))
+    ordering = (model.created_at.desc(), id_column.desc())
+
+    if len(conditions) == 1:
+        rows = db.query(model).filter(conditions[0], *keyset).order_by(*ordering).limit(limit + 1).all()
+    else:
+        branches = [
+            select(model).where(condition, *keyset).order_by(*ordering).limit(limit + 1).subquery()
+            for condition in conditions
+        ]
+        merged = union_all(*[select(branch) for branch in branches]).subquery()
+        row = aliased(model, merged)
+        rows = (
+            db.query(row)
+            .order_by(row.created_at.desc(), getattr(row, id_column.key).desc())
+            .limit(limit + 1)
+            .all()
+        )
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.created_at, getattr(last, id_column.key))
+    return rows[:limit], next_cursor
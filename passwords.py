@@ -0,0 +1,88 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow, so hashing and verification run on a small
+dedicated thread pool (bcrypt releases the GIL while it works). Admission
+control caps how many operations may be queued at once; beyond that callers
+get a 503 straight away instead of piling up behind a login storm and
+starving the rest of the worker.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+# Password hashing
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_lock = threading.Lock()
+_pending = 0
+rejected = 0
+
+
+def _admit():
+    global _pending, rejected
+    with _lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts in progress, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+
+
+def _release(future=None):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def _submit(fn, *args):
+    """Queue `fn` on the pool. Its admission slot is held until it has run, even if the caller stops waiting."""
+    _admit()
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _release()
+        raise
+    future.add_done_callback(_release)
+    return future
+
+
+async def _run_async(fn, *args):
+    # A client that disconnects cancels the wait; work that hasn't started yet is dropped along with it
+    return await asyncio.wrap_future(_submit(fn, *args))
+
+
+def _run(fn, *args):
+    return _submit(fn, *args).result()
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_async(pwd_context.verify, plain_password, hashed_password)
+
+
+async def hash_password_async(password):
+    return await _run_async(pwd_context.hash, password)
+
+
+def verify_password(plain_password, hashed_password):
+    return _run(pwd_context.verify, plain_password, hashed_password)
+
+
+def hash_password(password):
+    return _run(pwd_context.hash, password)
+
+
+def stats():
+    return {"pending": _pending, "workers": PASSWORD_HASH_WORKERS, "max_pending": PASSWORD_HASH_MAX_PENDING, "rejected": rejected}
@@ -0,0 +1,476 @@
+"""
+Persistent, batched payout queue for withdrawals.
+
+/withdraw only records a Queued payout, together with its Pending
+"Withdrawal" payment, in one commit. The `PayoutScheduler` thread claims
+queued payouts per source wallet while holding a lease on the wallet
+itself, so only one process hands out its nonces. On taking the wallet it
+re-reads the pending nonce from the node once; for as long as it holds
+the wallet it reserves runs of consecutive nonces from the local counter,
+signs each group and stores the signed transactions before broadcasting
+them back to back. Receipts come in
+through the shared receipt tracker and are settled in one bulk write per
+round.
+
+If a lease expires (the worker died, or no receipt arrived), another
+worker takes the payout over. Unsigned claims go back to the queue. Signed
+payouts are broadcast again from the stored bytes, so a payout can never
+be paid twice. After PAYOUT_MAX_RESENDS takeovers the chain is asked
+before giving up: a payout whose transaction was mined after all is
+settled from its receipt, and one is only marked Failed once another
+transaction has used its nonce, so it can never be mined.
+"""
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+from sqlalchemy import func, or_, select, update
+from web3 import Web3
+from web3.exceptions import Web3RPCError
+
+import analytics
+from database import session_scope
+from models import Payment, Payout, Transaction, Wallet
+from sender import RECEIPT_TIMEOUT
+from xenon import web3, sign_base_eth, nonce_manager, gas_price_cache, receipt_tracker, balance_cache
+
+
+PAYOUT_BATCH_SIZE = int(os.getenv("PAYOUT_BATCH_SIZE", "50"))
+PAYOUT_POLL_INTERVAL = float(os.getenv("PAYOUT_POLL_INTERVAL", "2"))
+PAYOUT_LEASE_TTL = int(os.getenv("PAYOUT_LEASE_TTL", "60"))
+PAYOUT_MAX_RESENDS = int(os.getenv("PAYOUT_MAX_RESENDS", "3"))
+# Source wallets broadcast in parallel; payouts within one wallet always go out in nonce order
+PAYOUT_WALLET_WORKERS = int(os.getenv("PAYOUT_WALLET_WORKERS", "4"))
+
+QUEUED = "Queued"
+SENDING = "Sending"
+SENT = "Sent"
+SUCCESSFUL = "Successful"
+FAILED = "Failed"
+IN_FLIGHT = (QUEUED, SENDING, SENT)
+# What recovery finds on chain for a payout that ran out of resends
+MINED = "mined"
+REPLACED = "replaced"
+
+
+def enqueue(db, wallet, receiver_address, amount):
+    """Queue a withdrawal from `wallet`. Does not commit; call `scheduler.notify()` after the commit."""
+    payment_id = str(uuid.uuid4())
+    payout_id = str(uuid.uuid4())
+    db.add(Payment(payment_id=payment_id, user_id=wallet.user_id, receiver_address=receiver_address, amount=amount, sender_address=wallet.address, status="Pending", data=analytics.WITHDRAWAL))
+    db.add(Payout(payout_id=payout_id, payment_id=payment_id, user_id=wallet.user_id, wallet_address=wallet.address, receiver_address=receiver_address, amount=amount, status=QUEUED, attempts=0))
+    return payout_id
+
+
+def in_flight_amount(db, wallet_address):
+    """Total of the wallet's payouts that have not settled yet."""
+    total = db.execute(
+        select(func.sum(Payout.amount)).where(Payout.wallet_address == wallet_address, Payout.status.in_(IN_FLIGHT))
+    ).scalar()
+    return total or 0
+
+
+class _Stopped(Exception):
+    """Broadcasting a group stopped part way; the nonce counter must be re-read."""
+
+
+def _nonce_error(error):
+    """The node refused a transaction because of its nonce, not because of the payout itself."""
+    message = str(error).lower()
+    return "nonce" in message or "replacement transaction underpriced" in message
+
+
+class PayoutScheduler:
+    def __init__(self, batch_size=PAYOUT_BATCH_SIZE, poll_interval=PAYOUT_POLL_INTERVAL, lease_ttl=PAYOUT_LEASE_TTL,
+                 max_resends=PAYOUT_MAX_RESENDS, wallet_workers=PAYOUT_WALLET_WORKERS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_ttl = timedelta(seconds=lease_ttl)
+        # Broadcast payouts wait this long for a receipt before another worker may take them over
+        self.sent_ttl = timedelta(seconds=RECEIPT_TIMEOUT + lease_ttl)
+        self.max_resends = max_resends
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._wallets = ThreadPoolExecutor(max_workers=wallet_workers, thread_name_prefix="payout-wallet")
+        self._lock = threading.Lock()
+        self._receipts = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.sent = 0
+        self.settled = 0
+        self.failed = 0
+        self.resent = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="payout-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 5)
+
+    def notify(self):
+        """Wake the scheduler after new payouts commit."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            for step in (self.recover, self.dispatch, self.settle):
+                try:
+                    step()
+                except Exception as e:
+                    print(f"Payout {step.__name__} failed: {e}")
+            self._wake.wait(self.poll_interval)
+
+    def dispatch(self):
+        """Send every queued payout, one group per source wallet at a time, until the queue is empty."""
+        while not self._stop.is_set():
+            with session_scope() as db:
+                wallets = db.execute(select(Payout.wallet_address).where(Payout.status == QUEUED).distinct()).scalars().all()
+            sent = sum(self._wallets.map(self._send_wallet, wallets))
+            self.sent += sent
+            if not sent:
+                # Empty, leased by other workers, or every wallet is failing; try again next round
+                return
+
+    def _lease_wallet(self, wallet_address):
+        """Compare-and-set lease on the wallet row; works the same on SQLite and PostgreSQL."""
+        now = datetime.utcnow()
+        with session_scope() as db:
+            return db.execute(
+                update(Wallet)
+                .where(
+                    Wallet.address == wallet_address,
+                    or_(Wallet.payout_owner.is_(None), Wallet.payout_owner == self.owner, Wallet.payout_lease_expires_at < now),
+                )
+                .values(payout_owner=self.owner, payout_lease_expires_at=now + self.lease_ttl)
+            ).rowcount == 1
+
+    def _release_wallet(self, wallet_address):
+        with session_scope() as db:
+            db.execute(
+                update(Wallet)
+                .where(Wallet.address == wallet_address, Wallet.payout_owner == self.owner)
+                .values(payout_owner=None, payout_lease_expires_at=None)
+            )
+
+    def _claim(self, wallet_address):
+        """Claim a group of queued payouts; also returns the wallet's key and the lowest nonce still free."""
+        now = datetime.utcnow()
+        with session_scope() as db:
+            ids = db.execute(
+                select(Payout.payout_id)
+                .where(Payout.status == QUEUED, Payout.wallet_address == wallet_address)
+                .order_by(Payout.created_at)
+                .limit(self.batch_size)
+            ).scalars().all()
+            if not ids:
+                return [], None, 0
+            # Conditional update, so each payout is claimed by exactly one worker
+            db.execute(
+                update(Payout)
+                .where(Payout.payout_id.in_(ids), Payout.status == QUEUED)
+                .values(status=SENDING, owner=self.owner, lease_expires_at=now + self.lease_ttl)
+            )
+            payouts = db.execute(
+                select(Payout.payout_id, Payout.receiver_address, Payout.amount)
+                .where(Payout.payout_id.in_(ids), Payout.status == SENDING, Payout.owner == self.owner)
+                .order_by(Payout.created_at)
+            ).all()
+            private_key = db.execute(select(Wallet.private_key).where(Wallet.address == wallet_address)).scalar_one()
+            # Signed transactions the node may not have seen yet still own their nonces
+            last_signed = db.execute(
+                select(func.max(Payout.nonce)).where(Payout.wallet_address == wallet_address, Payout.status.in_((SENDING, SENT)))
+            ).scalar()
+        return payouts, private_key, 0 if last_signed is None else last_signed + 1
+
+    def _send_wallet(self, wallet_address):
+        if not self._lease_wallet(wallet_address):
+            # Another worker is sending from this wallet
+            return 0
+        # Other workers, or sends from outside the app, may have used nonces while we didn't hold the wallet.
+        # While we do, nobody else in the app sends from it, so the local counter stays right between groups
+        nonce_manager.resync(wallet_address)
+        sent = 0
+        try:
+            while True:
+                group = self._send_group(wallet_address)
+                sent += group
+                # A short group means the queue is drained or sending stopped; renewing fails if the lease was lost
+                if group < self.batch_size or self._stop.is_set() or not self._lease_wallet(wallet_address):
+                    return sent
+        finally:
+            self._release_wallet(wallet_address)
+
+    def _send_group(self, wallet_address):
+        payouts, private_key, floor = self._claim(wallet_address)
+        if not payouts:
+            return 0
+        sent = []
+        try:
+            with nonce_manager.reserve(wallet_address, len(payouts), floor) as first_nonce:
+                gas_price = gas_price_cache.get()
+                signed = [
+                    sign_base_eth(private_key, payout.receiver_address, payout.amount, first_nonce + i, gas_price)
+                    for i, payout in enumerate(payouts)
+                ]
+                # Stored before anything is broadcast; from here on recovery resends these exact transactions
+                with session_scope() as db:
+                    db.bulk_update_mappings(Payout, [
+                        {
+                            "payout_id": payout.payout_id,
+                            "nonce": first_nonce + i,
+                            "transaction_hash": Web3.to_hex(signed_tx.hash),
+                            "raw_transaction": Web3.to_hex(signed_tx.raw_transaction),
+                        }
+                        for i, (payout, signed_tx) in enumerate(zip(payouts, signed))
+                    ])
+
+                error = None
+                for payout, signed_tx in zip(payouts, signed):
+                    try:
+                        web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                    except Exception as e:
+                        # The exact same transaction is already in the mempool
+                        if not (isinstance(e, Web3RPCError) and "already known" in str(e).lower()):
+                            error = e
+                            break
+                    receipt_tracker.track(signed_tx.hash, partial(self._on_receipt, payout.payout_id))
+                    sent.append(payout.payout_id)
+                if error is not None and isinstance(error, Web3RPCError) and _nonce_error(error):
+                    # A node that failed over may have accepted it before this one answered; then it is sent
+                    failed_tx = signed[len(sent)]
+                    if self._known(failed_tx.hash):
+                        receipt_tracker.track(failed_tx.hash, partial(self._on_receipt, payouts[len(sent)].payout_id))
+                        sent.append(payouts[len(sent)].payout_id)
+                self._mark_sent(sent)
+                if error is not None:
+                    raise _Stopped()
+        except _Stopped:
+            self._stopped(payouts[len(sent):], error)
+        except Exception as e:
+            print(f"Sending payouts from {wallet_address} failed: {e}")
+            if not sent:
+                self._release([payout.payout_id for payout in payouts])
+        finally:
+            balance_cache.invalidate(wallet_address)
+        return len(sent)
+
+    def _release(self, payout_ids):
+        """Queue claimed payouts again, unless they were already signed and stored."""
+        with session_scope() as db:
+            db.execute(
+                update(Payout)
+                .where(Payout.payout_id.in_(payout_ids), Payout.owner == self.owner, Payout.status == SENDING, Payout.raw_transaction.is_(None))
+                .values(status=QUEUED, owner=None, lease_expires_at=None)
+            )
+
+    def _mark_sent(self, payout_ids):
+        if not payout_ids:
+            return
+        now = datetime.utcnow()
+        with session_scope() as db:
+            db.execute(
+                update(Payout)
+                .where(Payout.payout_id.in_(payout_ids))
+                .values(status=SENT, sent_at=now, lease_expires_at=now + self.sent_ttl)
+            )
+
+    @staticmethod
+    def _known(tx_hash):
+        try:
+            web3.eth.get_transaction(tx_hash)
+            return True
+        except Exception:
+            return False
+
+    def _stopped(self, unsent, error):
+        """Broadcasting stopped at unsent[0]; nothing after it went out."""
+        failed_payout = unsent[0]
+        unsent_ids = [payout.payout_id for payout in unsent]
+        print(f"Payout {failed_payout.payout_id} was not broadcast: {error}")
+        with session_scope() as db:
+            if not isinstance(error, Web3RPCError):
+                # It may still have reached a node. Every unsent payout keeps the transaction it was signed
+                # with, so whichever copy is mined pays once; recovery rebroadcasts them in nonce order now
+                db.execute(update(Payout).where(Payout.payout_id.in_(unsent_ids)).values(lease_expires_at=datetime.utcnow()))
+            else:
+                requeue = unsent_ids
+                if not _nonce_error(error):
+                    # Rejected for the payout itself (e.g. insufficient funds), so it will never be mined
+                    self._fail(db, [failed_payout.payout_id], str(error))
+                    requeue = unsent_ids[1:]
+                # Refused by the node, so none of these can be mined: sign them again next round from the
+                # node's pending nonce (nonce errors mean our counter was stale)
+                if requeue:
+                    db.execute(
+                        update(Payout)
+                        .where(Payout.payout_id.in_(requeue))
+                        .values(status=QUEUED, owner=None, lease_expires_at=None, nonce=None, transaction_hash=None, raw_transaction=None)
+                    )
+        self._wake.set()
+
+    def _fail(self, db, payout_ids, error):
+        now = datetime.utcnow()
+        payment_ids = select(Payout.payment_id).where(Payout.payout_id.in_(payout_ids))
+        db.execute(update(Payment).where(Payment.payment_id.in_(payment_ids)).values(status=FAILED))
+        db.execute(update(Payout).where(Payout.payout_id.in_(payout_ids)).values(status=FAILED, last_error=error, settled_at=now))
+        self.failed += len(payout_ids)
+
+    def _on_receipt(self, payout_id, receipt):
+        if receipt is None:
+            # No receipt within RECEIPT_TIMEOUT; the lease runs out and recovery resends it
+            return
+        with self._lock:
+            self._receipts.append((payout_id, receipt))
+        self._wake.set()
+
+    def settle(self):
+        """Write every receipt that came in since the last round in one transaction."""
+        with self._lock:
+            receipts, self._receipts = self._receipts, []
+        if not receipts:
+            return
+        now = datetime.utcnow()
+        try:
+            with session_scope() as db:
+                open_payouts = {
+                    row.payout_id: row
+                    for row in db.execute(
+                        select(Payout.payout_id, Payout.payment_id, Payout.user_id, Payout.amount, Payout.transaction_hash)
+                        .where(Payout.payout_id.in_([payout_id for payout_id, _ in receipts]), Payout.status.in_((SENDING, SENT)))
+                    ).all()
+                }
+                payouts, payments, transactions = [], [], []
+                for payout_id, receipt in receipts:
+                    # pop: a payout resent after a takeover can report its receipt twice
+                    row = open_payouts.pop(payout_id, None)
+                    if row is None:
+                        continue
+                    status = SUCCESSFUL if receipt["status"] == 1 else FAILED
+                    gas_fee = (receipt["gasUsed"] * receipt["effectiveGasPrice"]) / 10**18  # Convert from Wei to native token
+                    payouts.append({"payout_id": payout_id, "status": status, "settled_at": now})
+                    payments.append({"payment_id": row.payment_id, "status": status, "transaction_hash": row.transaction_hash, "updated_at": now})
+                    transactions.append({
+                        "transaction_id": str(uuid.uuid4()),
+                        "payment_id": row.payment_id,
+                        "from_address": receipt["from"],
+                        "to_address": receipt["to"],
+                        "amount": row.amount,
+                        "gas_fee": gas_fee,
+                        "status": status,
+                        "block_number": receipt["blockNumber"],
+                        "transaction_hash": row.transaction_hash,
+                        "created_at": now,
+                    })
+                    if status == SUCCESSFUL:
+                        analytics.record_withdrawal(db, row.user_id, row.amount, gas_fee, now)
+                    else:
+                        self.failed += 1
+                db.bulk_update_mappings(Payout, payouts)
+                db.bulk_update_mappings(Payment, payments)
+                db.bulk_insert_mappings(Transaction, transactions)
+        except Exception:
+            # Keep them for the next round
+            with self._lock:
+                self._receipts[:0] = receipts
+            raise
+        self.settled += len(payouts)
+        for _, receipt in receipts:
+            balance_cache.invalidate_transaction(receipt)
+
+    @staticmethod
+    def _on_chain(row):
+        """
+        MINED if the payout's transaction has a receipt, REPLACED if another
+        transaction used its nonce, None if it may still be mined.
+        """
+        # One batch, so one node answers both; the nonce is read first, so a transaction
+        # mined in between shows up as a receipt rather than as a replaced nonce
+        try:
+            count, receipt = web3.provider.make_batch_request([
+                ("eth_getTransactionCount", [row.wallet_address, "latest"]),
+                ("eth_getTransactionReceipt", [row.transaction_hash]),
+            ])
+        except Exception as e:
+            print(f"Checking payout {row.payout_id} on chain failed: {e}")
+            return None
+        if receipt.get("result"):
+            return MINED
+        if count.get("result") is not None and int(count["result"], 16) > row.nonce:
+            return REPLACED
+        return None
+
+    def recover(self):
+        """Take over payouts whose lease ran out."""
+        now = datetime.utcnow()
+        with session_scope() as db:
+            # Claimed but never signed: nothing can have reached the chain
+            db.execute(
+                update(Payout)
+                .where(Payout.status == SENDING, Payout.raw_transaction.is_(None), Payout.lease_expires_at < now)
+                .values(status=QUEUED, owner=None, lease_expires_at=None)
+            )
+            expired = db.execute(
+                select(Payout.payout_id, Payout.wallet_address, Payout.nonce, Payout.raw_transaction, Payout.transaction_hash,
+                       Payout.attempts, Payout.lease_expires_at)
+                .where(Payout.status.in_((SENDING, SENT)), Payout.raw_transaction.isnot(None), Payout.lease_expires_at < now)
+                # A transaction is only mined after the ones before it, so resend in nonce order
+                .order_by(Payout.wallet_address, Payout.nonce)
+                .limit(self.batch_size)
+            ).all()
+
+        # Out of resends: a signed transaction can still be mined, so ask the chain before failing it
+        found = {row.payout_id: self._on_chain(row) for row in expired if row.attempts >= self.max_resends}
+        resend, mined, give_up = [], [], []
+        with session_scope() as db:
+            for row in expired:
+                state = found.get(row.payout_id)
+                taken = db.execute(
+                    update(Payout)
+                    .where(Payout.payout_id == row.payout_id, Payout.lease_expires_at == row.lease_expires_at)
+                    .values(status=SENT, owner=self.owner, lease_expires_at=now + self.sent_ttl,
+                            attempts=Payout.attempts + (0 if state else 1))
+                ).rowcount
+                if not taken:
+                    continue
+                if state == MINED:
+                    mined.append(row)
+                elif state == REPLACED:
+                    give_up.append(row)
+                else:
+                    resend.append(row)
+            if give_up:
+                self._fail(db, [row.payout_id for row in give_up], "Nonce was used by another transaction")
+
+        for row in mined:
+            # The tracker picks the receipt up on its next round and settles it
+            receipt_tracker.track(row.transaction_hash, partial(self._on_receipt, row.payout_id))
+        for row in resend:
+            if row.attempts >= self.max_resends:
+                print(f"Payout {row.payout_id} still has no receipt after {row.attempts} resends")
+            try:
+                web3.eth.send_raw_transaction(row.raw_transaction)
+            except Exception as e:
+                # Usually "already known" or "nonce too low" because it was mined; the receipt settles it
+                print(f"Resending payout {row.payout_id}: {e}")
+            receipt_tracker.track(row.transaction_hash, partial(self._on_receipt, row.payout_id))
+            self.resent += 1
+
+    def stats(self):
+        return {"sent": self.sent, "settled": self.settled, "failed": self.failed, "resent": self.resent, "pending_receipts": len(self._receipts)}
+
+
+scheduler = PayoutScheduler()
@@ -0,0 +1,122 @@
+"""
+Cached ETH/USDC price oracle.
+
+Prices are fetched from cryptocompare over a pooled HTTP session and cached
+for PRICE_TTL seconds. Entries are refreshed in the background shortly before
+they expire, concurrent misses share a single upstream request, and the last
+good price keeps being served if the upstream fails.
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+PRICE_URL = os.getenv("PRICE_URL", "https://min-api.cryptocompare.com/data/price?fsym=ETH&tsyms=USDC")
+PRICE_TTL = float(os.getenv("PRICE_TTL", "30"))
+
+
+class PriceOracle:
+    def __init__(self, url=PRICE_URL, ttl=PRICE_TTL, refresh_ahead=0.8, timeout=10, retry_after=5, symbol="USDC"):
+        self.url = url
+        self.ttl = ttl
+        # Fraction of the TTL after which a hit also triggers a background refresh
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+        # After a failed fetch the last good price is served this long before retrying
+        self.retry_after = retry_after
+        self.symbol = symbol
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=10))
+
+        self._lock = threading.Lock()
+        self._inflight = None
+        self._price = None
+        self._fetched_at = 0.0
+        self._retry_at = 0.0
+        self._last_error = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.errors = 0
+
+    def get_price(self):
+        """Return the current price, fetching it only when the cache can't answer."""
+        now = time.time()
+        price, age = self._price, now - self._fetched_at
+        if price is not None and age < self.ttl:
+            self.hits += 1
+            if age >= self.ttl * self.refresh_ahead:
+                self._refresh_in_background()
+            return price
+        if price is not None and now < self._retry_at:
+            self.stale_served += 1
+            return price
+        self.misses += 1
+        return self._load()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "price": self._price,
+            "age_seconds": round(time.time() - self._fetched_at, 3) if self._price is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "stale_served": self.stale_served,
+            "errors": self.errors,
+        }
+
+    def _refresh_in_background(self):
+        if self._inflight is not None:
+            return
+        threading.Thread(target=self._load, name="price-refresh", daemon=True).start()
+
+    def _load(self):
+        with self._lock:
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = threading.Event()
+
+        if not leader:
+            # Someone else is already fetching, wait for their result
+            inflight.wait(self.timeout)
+            if self._price is None:
+                raise RuntimeError(f"Price unavailable: {self._last_error}")
+            return self._price
+
+        try:
+            self._price = self._fetch()
+            self._fetched_at = time.time()
+            self._last_error = None
+            return self._price
+        except Exception as e:
+            self.errors += 1
+            self._last_error = e
+            self._retry_at = time.time() + self.retry_after
+            if self._price is not None:
+                self.stale_served += 1
+                print(f"Price fetch failed, serving last good price: {e}")
+                return self._price
+            raise
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight.set()
+
+    def _fetch(self):
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        price = response.json().get(self.symbol)
+        if price is None:
+            raise ValueError(f"'{self.symbol}' key not found in API response.")
+        return float(price)
+
+
+price_oracle = PriceOracle()
@@ -0,0 +1,87 @@
+"""
+Lightweight publish/subscribe between the components of a worker and,
+when REDIS_URL is set, across uvicorn workers and hosts.
+
+Messages are JSON-serialisable dicts. Local subscribers are called as soon as
+a message is published; other processes receive it through a Redis channel.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from serialization import dumps
+
+
+REDIS_URL = os.getenv("REDIS_URL")
+CHANNEL_PREFIX = "lianflow:"
+
+# Identifies this process so it ignores its own messages coming back from Redis
+_origin = str(uuid.uuid4())
+_handlers = {}
+_lock = threading.Lock()
+_redis = None
+_listener = None
+
+
+def subscribe(channel, handler):
+    """Call `handler(message)` for every message published on `channel`."""
+    with _lock:
+        _handlers.setdefault(channel, []).append(handler)
+    _start_listener()
+
+
+def publish(channel, message):
+    _dispatch(channel, message)
+    client = _get_redis()
+    if client is not None:
+        try:
+            client.publish(CHANNEL_PREFIX + channel, dumps({"origin": _origin, "message": message}).decode())
+        except Exception as e:
+            print(f"Error publishing to {channel}: {e}")
+
+
+def _dispatch(channel, message):
+    for handler in list(_handlers.get(channel, ())):
+        try:
+            handler(message)
+        except Exception as e:
+            print(f"Subscriber for {channel} failed: {e}")
+
+
+def _get_redis():
+    global _redis
+    if REDIS_URL is None:
+        return None
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+
+def _start_listener():
+    global _listener
+    if REDIS_URL is None:
+        return
+    with _lock:
+        if _listener is not None and _listener.is_alive():
+            return
+        _listener = threading.Thread(target=_listen, name="pubsub-listener", daemon=True)
+        _listener.start()
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(CHANNEL_PREFIX + "*")
+            for item in pubsub.listen():
+                envelope = json.loads(item["data"])
+                if envelope["origin"] == _origin:
+                    continue
+                channel = item["channel"].decode()[len(CHANNEL_PREFIX):]
+                _dispatch(channel, envelope["message"])
+        except Exception as e:
+            print(f"Pub/sub listener disconnected, retrying: {e}")
+            time.sleep(1)
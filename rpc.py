@@ -0,0 +1,287 @@
+"""
+Pool of JSON-RPC endpoints behind one web3 provider.
+
+`ProviderPool` keeps a keep-alive `requests.Session` per endpoint and
+tracks each endpoint's latency and error rate as moving averages. Every
+call goes to the healthiest endpoint. A read that hasn't answered within
+RPC_HEDGE_DELAY (or three times the fastest endpoint's latency, if less) is
+also sent to the next best endpoint, and the first answer wins. A
+connection error, timeout or 429/5xx moves the call on to the next
+endpoint. After RPC_BREAKER_THRESHOLD failures in a row an endpoint is
+ejected for RPC_BREAKER_COOLDOWN seconds; then a single trial request
+decides whether it comes back.
+
+Filters live on the node that created them, so filter calls stick to that
+endpoint. Endpoints are configured as comma-separated URLs, e.g.
+`RPC_URLS=https://mainnet.base.org,https://base.llamarpc.com`.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3.providers.base import JSONBaseProvider
+
+from cache import TTLCache
+
+
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "10"))
+RPC_HEDGE_DELAY = float(os.getenv("RPC_HEDGE_DELAY", "0.5"))
+RPC_BREAKER_THRESHOLD = int(os.getenv("RPC_BREAKER_THRESHOLD", "3"))
+RPC_BREAKER_COOLDOWN = float(os.getenv("RPC_BREAKER_COOLDOWN", "30"))
+# Pooled keep-alive connections per endpoint
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "32"))
+# Nodes drop filters nobody has polled for five minutes; routes for them are forgotten as well
+RPC_FILTER_TTL = float(os.getenv("RPC_FILTER_TTL", "300"))
+RPC_MAX_FILTERS = 10000
+
+# Weight of the newest sample in the latency and error rate averages
+EWMA_ALPHA = 0.2
+# Hedges are never sent sooner than this, whatever the endpoint's latency
+MIN_HEDGE_DELAY = 0.05
+# Every this many reads go to the endpoint used least recently, so a node that
+# recovered is measured again; the hedge covers it if it is still slow
+PROBE_EVERY = 50
+
+FILTER_METHODS = {"eth_newFilter", "eth_newBlockFilter", "eth_newPendingTransactionFilter"}
+FILTER_ID_METHODS = {"eth_getFilterChanges", "eth_getFilterLogs", "eth_uninstallFilter"}
+# Calls with side effects are never hedged. Resending the same signed transaction is harmless,
+# so eth_sendRawTransaction still fails over to the next endpoint.
+WRITE_METHODS = {"eth_sendRawTransaction", "eth_sendTransaction"}
+HEADERS = {"Content-Type": "application/json"}
+
+
+def parse_rpc_urls(value):
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+class Endpoint:
+    def __init__(self, url, timeout=RPC_TIMEOUT, pool_size=RPC_POOL_SIZE):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Seconds, None until the first answer
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial = False
+        self.last_used = 0.0
+
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def post(self, data):
+        response = self.session.post(self.url, data=data, headers=HEADERS, timeout=self.timeout)
+        # 429 and 5xx mean this node can't serve us right now; JSON-RPC errors come back as 200
+        response.raise_for_status()
+        return response.content
+
+    def state(self, now):
+        if not self.open_until:
+            return "closed"
+        return "open" if now < self.open_until else "half-open"
+
+    def score(self):
+        # Errors make an endpoint look slower; an unmeasured one is tried early
+        return (self.latency or 0.0) * (1 + 10 * self.error_rate)
+
+
+class ProviderPool(JSONBaseProvider):
+    def __init__(self, urls, timeout=RPC_TIMEOUT, hedge_delay=RPC_HEDGE_DELAY,
+                 breaker_threshold=RPC_BREAKER_THRESHOLD, breaker_cooldown=RPC_BREAKER_COOLDOWN, pool_size=RPC_POOL_SIZE,
+                 filter_ttl=RPC_FILTER_TTL):
+        super().__init__()
+        if not urls:
+            raise ValueError("ProviderPool needs at least one RPC URL")
+        self.endpoints = [Endpoint(url, timeout, pool_size) for url in urls]
+        self.hedge_delay = hedge_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self._lock = threading.Lock()
+        # filter id -> Endpoint that created it, until it is uninstalled or goes unpolled for filter_ttl
+        self._filters = TTLCache(maxsize=RPC_MAX_FILTERS, ttl=filter_ttl)
+        self._reads = 0
+        self._hedger = ThreadPoolExecutor(max_workers=4 * pool_size, thread_name_prefix="rpc-hedge")
+
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def __str__(self):
+        return f"RPC pool {', '.join(endpoint.url for endpoint in self.endpoints)}"
+
+    @property
+    def endpoint_uri(self):
+        return self.endpoints[0].url
+
+    # -- routing -- #
+
+    def _ranked(self):
+        """Endpoints to try in order: healthy ones by score, then ejected ones as a last resort."""
+        now = time.time()
+        with self._lock:
+            usable, ejected, trial = [], [], None
+            for endpoint in self.endpoints:
+                state = endpoint.state(now)
+                if state == "closed":
+                    usable.append(endpoint)
+                elif state == "half-open" and not endpoint.trial and trial is None:
+                    # One trial request at a time decides whether it comes back
+                    endpoint.trial = True
+                    trial = endpoint
+                else:
+                    ejected.append(endpoint)
+            usable.sort(key=Endpoint.score)
+            self._reads += 1
+            if trial is not None:
+                # Goes first so it is really sent; the next endpoint covers it if it is still down
+                usable.insert(0, trial)
+            elif len(usable) > 1 and self._reads % PROBE_EVERY == 0:
+                probe = min(usable, key=lambda endpoint: endpoint.last_used)
+                usable.remove(probe)
+                usable.insert(0, probe)
+            ejected.sort(key=lambda endpoint: endpoint.open_until)
+            return usable + ejected
+
+    def _record(self, endpoint, latency=None):
+        """A successful answer after `latency` seconds, or a failure when latency is None."""
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.last_used = time.time()
+            endpoint.trial = False
+            if latency is not None:
+                endpoint.latency = latency if endpoint.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * endpoint.latency
+                endpoint.error_rate *= 1 - EWMA_ALPHA
+                endpoint.consecutive_failures = 0
+                endpoint.open_until = 0.0
+                return
+            endpoint.failures += 1
+            endpoint.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * endpoint.error_rate
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.breaker_threshold:
+                if endpoint.state(time.time()) != "open":
+                    print(f"RPC endpoint {endpoint.url} ejected for {self.breaker_cooldown}s")
+                    endpoint.ejections += 1
+                endpoint.open_until = time.time() + self.breaker_cooldown
+
+    def _send(self, endpoint, data):
+        started = time.time()
+        try:
+            response = self.decode_rpc_response(endpoint.post(data))
+        except Exception:
+            self._record(endpoint)
+            raise
+        self._record(endpoint, time.time() - started)
+        return response
+
+    def _call(self, data, endpoints, hedge):
+        if hedge and len(endpoints) > 1:
+            return self._hedged(data, endpoints)
+        for i, endpoint in enumerate(endpoints):
+            try:
+                return self._send(endpoint, data)
+            except Exception:
+                if i == len(endpoints) - 1:
+                    raise
+                self.failovers += 1
+
+    def _hedged(self, data, endpoints):
+        """Send to the best endpoint; also to the next one if it is slow or fails. First answer wins."""
+        remaining = iter(endpoints)
+        primary = next(remaining)
+        delay = self.hedge_delay
+        # Judged by the fastest endpoint, so probes and trials of a slow node are hedged early too
+        latencies = [endpoint.latency for endpoint in endpoints if endpoint.latency is not None]
+        if latencies:
+            delay = max(MIN_HEDGE_DELAY, min(delay, 3 * min(latencies)))
+
+        first = self._hedger.submit(self._send, primary, data)
+        pending = {first}
+        hedged = False
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=None if hedged else delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if hedged and future is not first:
+                    self.hedge_wins += 1
+                return response
+            endpoint = next(remaining, None)
+            if endpoint is None:
+                continue
+            if done:
+                # Failed outright rather than slow
+                self.failovers += 1
+            else:
+                self.hedges += 1
+                hedged = True
+            pending.add(self._hedger.submit(self._send, endpoint, data))
+        raise error
+
+    # -- provider interface -- #
+
+    def make_request(self, method, params):
+        data = self.encode_rpc_request(method, params)
+        if method in FILTER_ID_METHODS:
+            endpoint = self._filters.get(params[0])
+            if endpoint is not None:
+                response = self._send(endpoint, data)
+                if method == "eth_uninstallFilter" or "error" in response:
+                    # Gone from the node too (an error here is usually "filter not found")
+                    self._filters.pop(params[0])
+                else:
+                    # Polled, so the node keeps it alive; so do we
+                    self._filters.set(params[0], endpoint)
+                return response
+
+        endpoints = self._ranked()
+        if method in FILTER_METHODS:
+            # Created on exactly one node, which every later call for it must reach
+            response = self._call(data, endpoints[:1], hedge=False)
+            if "result" in response:
+                self._filters.set(response["result"], endpoints[0])
+            return response
+        return self._call(data, endpoints, hedge=method not in WRITE_METHODS)
+
+    def make_batch_request(self, requests):
+        data = self.encode_batch_rpc_request(requests)
+        hedge = not any(method in WRITE_METHODS or method in FILTER_METHODS or method in FILTER_ID_METHODS for method, _ in requests)
+        responses = self._call(data, self._ranked(), hedge)
+        if isinstance(responses, list):
+            # Nodes may answer a batch in any order
+            responses.sort(key=lambda response: response.get("id") or 0)
+        return responses
+
+    def stats(self):
+        now = time.time()
+        return {
+            "endpoints": [
+                {
+                    "url": endpoint.url,
+                    "state": endpoint.state(now),
+                    "latency_ms": round(endpoint.latency * 1000, 1) if endpoint.latency is not None else None,
+                    "error_rate": round(endpoint.error_rate, 4),
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                    "ejections": endpoint.ejections,
+                }
+                for endpoint in self.endpoints
+            ],
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "filters": len(self._filters),
+        }
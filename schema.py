@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from datetime import datetime
 
 class WalletImportRequest(BaseModel):
     private_key: str
@@ -56,6 +57,17 @@ class UserInDB(BaseModel):
 class BusinessOut(BusinessBase):
     password: str
 
+class BusinessIdentity(BaseModel):
+    """Detached snapshot of an authenticated business, safe to cache between requests."""
+    model_config = ConfigDict(from_attributes=True)
+
+    user_id: str
+    email: str
+    business_name: str
+    api_key: str
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
 class CreateCheckoutRequest(BaseModel):
     amount: float
 
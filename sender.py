@@ -0,0 +1,212 @@
+"""
+Outgoing transaction pipeline for the hot wallets.
+
+`NonceManager` hands out nonces per sender from a local counter, so
+overlapping withdrawals from one wallet get consecutive nonces instead of
+the same one, and it goes back to the node whenever a send fails or a
+transaction never confirms. `GasPriceCache` serves the gas price for
+GAS_PRICE_TTL seconds. `ReceiptTracker` polls receipts for every
+broadcast transaction in one JSON-RPC batch per round and hands each
+receipt to a callback, so a sender doesn't wait for confirmations and
+withdrawals pipeline at the speed the chain includes them.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+
+GAS_PRICE_TTL = float(os.getenv("GAS_PRICE_TTL", "5"))
+RECEIPT_POLL_INTERVAL = float(os.getenv("RECEIPT_POLL_INTERVAL", "2"))
+# Seconds a broadcast transaction may stay unmined before its callback gets None
+RECEIPT_TIMEOUT = float(os.getenv("RECEIPT_TIMEOUT", "600"))
+RECEIPT_BATCH_SIZE = 100
+
+
+class NonceManager:
+    def __init__(self, w3):
+        self.w3 = w3
+        self._lock = threading.Lock()
+        self._wallet_locks = {}
+        # lowercase address -> next nonce to hand out
+        self._next = {}
+        self.resyncs = 0
+
+    def _wallet_lock(self, key):
+        with self._lock:
+            return self._wallet_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def reserve(self, address, count=1, floor=0):
+        """
+        Hold the wallet's next `count` nonces while transactions are signed
+        and sent; yields the first. Sends from one wallet go out in nonce
+        order; if the body raises, the counter is dropped and re-read from
+        the node next time. `floor` is the lowest nonce that may be handed
+        out, for nonces already signed but not yet seen by the node.
+        """
+        key = address.lower()
+        with self._wallet_lock(key):
+            nonce = self._next.get(key)
+            if nonce is None:
+                # "pending" also counts transactions this or another worker already broadcast
+                nonce = self.w3.eth.get_transaction_count(address, "pending")
+                self.resyncs += 1
+            nonce = max(nonce, floor)
+            try:
+                yield nonce
+            except Exception:
+                self._next.pop(key, None)
+                raise
+            self._next[key] = nonce + count
+
+    def resync(self, address):
+        """Forget the local counter, e.g. after a transaction was dropped from the mempool."""
+        key = address.lower()
+        with self._wallet_lock(key):
+            self._next.pop(key, None)
+
+
+class GasPriceCache:
+    def __init__(self, w3, ttl=GAS_PRICE_TTL):
+        self.w3 = w3
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._price = None
+        self._fetched_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        if self._price is not None and time.time() - self._fetched_at < self.ttl:
+            self.hits += 1
+            return self._price
+        with self._lock:
+            # Another thread may have refreshed it while we waited
+            if self._price is None or time.time() - self._fetched_at >= self.ttl:
+                self._price = self.w3.eth.gas_price
+                self._fetched_at = time.time()
+                self.misses += 1
+            else:
+                self.hits += 1
+            return self._price
+
+
+def _format_receipt(raw):
+    """Normalise a raw eth_getTransactionReceipt result the way w3.eth.get_transaction_receipt would."""
+    return AttributeDict({
+        **raw,
+        "transactionHash": HexBytes(raw["transactionHash"]),
+        "blockHash": HexBytes(raw["blockHash"]),
+        "from": Web3.to_checksum_address(raw["from"]),
+        "to": Web3.to_checksum_address(raw["to"]) if raw.get("to") else None,
+        "blockNumber": int(raw["blockNumber"], 16),
+        "gasUsed": int(raw["gasUsed"], 16),
+        "cumulativeGasUsed": int(raw["cumulativeGasUsed"], 16),
+        # Nodes that predate EIP-1559 report the transaction's gasPrice instead
+        "effectiveGasPrice": int(raw.get("effectiveGasPrice") or raw["gasPrice"], 16),
+        "status": int(raw["status"], 16),
+    })
+
+
+class _Tracked:
+    __slots__ = ("future", "callback", "deadline")
+
+    def __init__(self, future, callback, deadline):
+        self.future = future
+        self.callback = callback
+        self.deadline = deadline
+
+
+class ReceiptTracker:
+    def __init__(self, w3, poll_interval=RECEIPT_POLL_INTERVAL, timeout=RECEIPT_TIMEOUT, callback_workers=4):
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # tx hash (0x hex) -> _Tracked
+        self._pending = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._callbacks = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix="receipt-callback")
+
+        self.confirmed = 0
+        self.timed_out = 0
+
+    def track(self, tx_hash, callback=None):
+        """
+        Follow `tx_hash` until it is mined. Returns a Future resolving to the
+        receipt, or None after the timeout; `callback(receipt)` runs on the
+        tracker's callback pool with the same value.
+        """
+        tx_hash = Web3.to_hex(HexBytes(tx_hash))
+        future = Future()
+        with self._lock:
+            self._pending[tx_hash] = _Tracked(future, callback, time.time() + self.timeout)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="receipt-tracker", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return future
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Receipt tracker poll failed: {e}")
+
+    def poll(self):
+        with self._lock:
+            tx_hashes = list(self._pending)
+        if not tx_hashes:
+            return
+        now = time.time()
+        for start in range(0, len(tx_hashes), RECEIPT_BATCH_SIZE):
+            chunk = tx_hashes[start:start + RECEIPT_BATCH_SIZE]
+            responses = self.w3.provider.make_batch_request([("eth_getTransactionReceipt", [tx_hash]) for tx_hash in chunk])
+            for tx_hash, response in zip(chunk, responses):
+                raw = response.get("result")
+                if raw:
+                    try:
+                        receipt = self._receipt(tx_hash, raw)
+                    except Exception as e:
+                        # Only this one waits for the next round; the rest of the batch still settles
+                        print(f"Receipt for {tx_hash} could not be read: {e}")
+                    else:
+                        self._resolve(tx_hash, receipt)
+                        self.confirmed += 1
+                        continue
+                if self._pending[tx_hash].deadline <= now:
+                    self._resolve(tx_hash, None)
+                    self.timed_out += 1
+
+    def _receipt(self, tx_hash, raw):
+        if not raw.get("effectiveGasPrice") and not raw.get("gasPrice"):
+            # Neither is in the receipt on some older nodes; the transaction always has it
+            raw = {**raw, "gasPrice": hex(self.w3.eth.get_transaction(tx_hash)["gasPrice"])}
+        return _format_receipt(raw)
+
+    def _resolve(self, tx_hash, receipt):
+        with self._lock:
+            tracked = self._pending.pop(tx_hash)
+        tracked.future.set_result(receipt)
+        if tracked.callback is not None:
+            self._callbacks.submit(self._run_callback, tracked.callback, tx_hash, receipt)
+
+    @staticmethod
+    def _run_callback(callback, tx_hash, receipt):
+        try:
+            callback(receipt)
+        except Exception as e:
+            print(f"Receipt callback for {tx_hash} failed: {e}")
+
+    def stats(self):
+        return {"pending": len(self._pending), "confirmed": self.confirmed, "timed_out": self.timed_out}
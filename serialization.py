@@ -0,0 +1,65 @@
+"""
+JSON encoding for API responses and webhook payloads.
+
+`to_dict` converts an ORM row with a serializer built once per model: a
+single `attrgetter` over the model's columns, instead of walking
+`__table__.columns` for every row. Encoding goes through orjson, which
+handles datetimes itself; `json_default` covers the other types handlers
+return: Decimal amounts, HexBytes hashes and web3 AttributeDicts.
+
+Decimals are written as exact strings, the way pydantic writes them for
+`response_model` routes, so amounts read the same on every route, webhook
+and event and never lose precision to a float.
+
+`ORJSONResponse` is the app's default response class. Handlers that return
+many rows return one directly, which also skips FastAPI's
+`jsonable_encoder` pass over the content.
+"""
+from collections.abc import Mapping
+from decimal import Decimal
+from operator import attrgetter
+
+import orjson
+from fastapi import responses
+
+
+def json_default(value):
+    # Receipts come back from web3 as AttributeDicts holding HexBytes
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return orjson.dumps(value, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(responses.ORJSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+# model class -> function turning a row into a dict of its columns
+_serializers = {}
+
+
+def row_serializer(model):
+    serializer = _serializers.get(model)
+    if serializer is None:
+        names = tuple(column.name for column in model.__table__.columns)
+        getter = attrgetter(*names)
+        if len(names) == 1:
+            serializer = lambda row: {names[0]: getter(row)}
+        else:
+            serializer = lambda row: dict(zip(names, getter(row)))
+        _serializers[model] = serializer
+    return serializer
+
+
+def to_dict(row):
+    """Convert SQLAlchemy model instance to dictionary."""
+    return row_serializer(type(row))(row)
@@ -0,0 +1,26 @@
+"""
+Test settings. The app's modules read their configuration when they are
+imported, so the environment is set here, before any test imports them:
+a throwaway SQLite database, no Redis, and RPC endpoints that nothing
+listens on (tests point the web3 singletons at a stub node themselves).
+"""
+import os
+import tempfile
+
+import pytest
+
+
+_data_dir = tempfile.mkdtemp(prefix="lianflow-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_data_dir}/test.db"
+os.environ["SECRET_KEY"] = "test-secret"
+os.environ["RPC_URLS"] = "http://127.0.0.1:9"
+os.environ["MONITOR_RPC_URLS"] = "http://127.0.0.1:9"
+os.environ["PRICE_URL"] = "http://127.0.0.1:9/price"
+os.environ.pop("REDIS_URL", None)
+
+
+@pytest.fixture(scope="session")
+def database():
+    from database import migrate
+
+    migrate()
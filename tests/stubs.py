@@ -0,0 +1,466 @@
+"""
+Local stand-ins for the services the app talks to, for tests and benchmarks.
+
+`StubNode` is a JSON-RPC server whose methods are plain Python functions;
+`StubWebSocketNode` serves them over a websocket and pushes subscriptions.
+`StubReceiver` is a merchant webhook endpoint that can be slow or fail, and
+`StubPriceServer` answers price lookups the way cryptocompare does.
+`DevChain` builds a small chain on top of it: accounts with nonces and
+balances, a mempool that checks nonces the way a node does, and blocks
+that are mined on demand. `TokenChain` serves ERC-20 balances behind a
+Multicall3 contract.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rlp
+import websockets
+from eth_abi import decode, encode
+from eth_account import Account
+from eth_account._utils.legacy_transactions import Transaction as LegacyTransaction
+from web3 import Web3
+
+
+class RPCError(Exception):
+    """Raised by a stub method to answer with a JSON-RPC error."""
+
+
+class StubNode:
+    def __init__(self, handlers=None, delay=0.0):
+        self.handlers = dict(handlers or {})
+        self.delay = delay
+        # HTTP status to answer with; anything but 200 fails every request, as a node that is down would
+        self.status = 200
+        self.calls = Counter()
+        self.requests = 0
+        self.batches = 0
+        self._server = None
+
+    def _answer(self, request):
+        method = request["method"]
+        self.calls[method] += 1
+        handler = self.handlers.get(method)
+        if handler is None:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": f"method {method} not found"}}
+        try:
+            return {"jsonrpc": "2.0", "id": request["id"], "result": handler(request.get("params") or [])}
+        except RPCError as e:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32000, "message": str(e)}}
+
+    def start(self):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                node.requests += 1
+                if node.delay:
+                    time.sleep(node.delay)
+                if node.status != 200:
+                    self.send_response(node.status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if isinstance(body, list):
+                    node.batches += 1
+                    response = [node._answer(request) for request in body]
+                else:
+                    response = node._answer(body)
+                data = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.requests = 0
+        self.batches = 0
+
+
+class StubWebSocketNode(StubNode):
+    """
+    StubNode over a websocket. eth_subscribe hands out one id per
+    subscription name; `push` sends a notification for it to every client.
+    """
+
+    def __init__(self, handlers=None, delay=0.0):
+        super().__init__(handlers, delay)
+        self.handlers.setdefault("eth_subscribe", self._subscribe)
+        # subscription name -> id
+        self.subscriptions = {}
+        self._clients = set()
+        self._loop = None
+        self._port = None
+
+    def _subscribe(self, params):
+        if params[0] not in self.subscriptions:
+            self.subscriptions[params[0]] = hex(len(self.subscriptions) + 1)
+        return self.subscriptions[params[0]]
+
+    async def _serve(self, connection):
+        self._clients.add(connection)
+        try:
+            async for message in connection:
+                body = json.loads(message)
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if isinstance(body, list):
+                    self.batches += 1
+                    response = [self._answer(request) for request in body]
+                else:
+                    response = self._answer(body)
+                await connection.send(json.dumps(response))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._clients.discard(connection)
+
+    def start(self):
+        ready = threading.Event()
+
+        async def serve():
+            self._loop = asyncio.get_running_loop()
+            self._stopped = asyncio.Event()
+            async with websockets.serve(self._serve, "127.0.0.1", 0) as server:
+                self._port = server.sockets[0].getsockname()[1]
+                ready.set()
+                await self._stopped.wait()
+
+        threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+        ready.wait(5)
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self._port}"
+
+    def push(self, subscription, result):
+        """Notify every client subscribed to `subscription`, e.g. "newPendingTransactions"."""
+        message = json.dumps({
+            "jsonrpc": "2.0",
+            "method": "eth_subscription",
+            "params": {"subscription": self.subscriptions[subscription], "result": result},
+        })
+
+        async def send():
+            for connection in list(self._clients):
+                await connection.send(message)
+
+        asyncio.run_coroutine_threadsafe(send(), self._loop).result()
+
+
+class StubReceiver:
+    """
+    Accepts webhook POSTs. The path picks the answer: under /slow/ it takes
+    `slow_delay` seconds, under /fail/ it answers 500, anything else 200.
+    """
+
+    def __init__(self, slow_delay=1.0):
+        self.slow_delay = slow_delay
+        # path -> requests received
+        self.received = Counter()
+        self._server = None
+
+    def start(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                receiver.received[self.path] += 1
+                status = 200
+                if self.path.startswith("/slow/"):
+                    time.sleep(receiver.slow_delay)
+                elif self.path.startswith("/fail/"):
+                    status = 500
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                except OSError:
+                    # The sender timed out and hung up
+                    pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+
+class StubPriceServer:
+    """Answers every GET with {symbol: price} after `delay` seconds, or with a 500 while `fail` is set."""
+
+    def __init__(self, price=2000.0, symbol="USDC", delay=0.0):
+        self.price = price
+        self.symbol = symbol
+        self.delay = delay
+        self.fail = False
+        self.requests = 0
+        self._server = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                if server.delay:
+                    time.sleep(server.delay)
+                status, data = 200, json.dumps({server.symbol: server.price}).encode()
+                if server.fail:
+                    status, data = 500, b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/data/price?fsym=ETH&tsyms=USDC"
+
+
+class DevChain:
+    """
+    Enough of a chain for sending ETH: transactions are checked against the
+    sender's nonce, wait in the mempool, and are mined when a receipt is
+    asked for (`auto_mine`) or when `mine()` is called.
+    """
+
+    def __init__(self, chain_id=8453, gas_price=10**9, auto_mine=True):
+        self.chain_id = chain_id
+        self.gas_price = gas_price
+        self.auto_mine = auto_mine
+        self._lock = threading.Lock()
+        self.block_number = 100
+        self.balances = Counter()
+        # lowercase address -> transactions mined
+        self.mined_nonces = Counter()
+        # tx hash -> transaction dict; every transaction ever accepted
+        self.transactions = {}
+        self.mempool = []
+        self.receipts = {}
+        # Raised (once each) by the next eth_sendRawTransaction calls, to inject failures
+        self.send_errors = []
+        self.node = StubNode({
+            "eth_chainId": lambda params: hex(self.chain_id),
+            "eth_blockNumber": lambda params: hex(self.block_number),
+            "eth_gasPrice": lambda params: hex(self.gas_price),
+            "eth_getBalance": lambda params: hex(self.balances[params[0].lower()]),
+            "eth_getTransactionCount": self._transaction_count,
+            "eth_sendRawTransaction": self._send_raw,
+            "eth_getTransactionByHash": self._transaction,
+            "eth_getTransactionReceipt": self._receipt,
+        })
+
+    def start(self):
+        self.node.start()
+        return self
+
+    def stop(self):
+        self.node.stop()
+
+    @property
+    def url(self):
+        return self.node.url
+
+    def _pending_count(self, address):
+        return self.mined_nonces[address] + sum(1 for tx in self.mempool if tx["from"] == address)
+
+    def _transaction_count(self, params):
+        address = params[0].lower()
+        with self._lock:
+            if len(params) > 1 and params[1] == "pending":
+                return hex(self._pending_count(address))
+            return hex(self.mined_nonces[address])
+
+    def _send_raw(self, params):
+        raw = params[0]
+        tx_hash = Web3.to_hex(Web3.keccak(hexstr=raw))
+        sender = Account.recover_transaction(raw).lower()
+        tx = rlp.decode(bytes.fromhex(raw[2:]), LegacyTransaction)
+        with self._lock:
+            if self.send_errors:
+                error = self.send_errors.pop(0)
+                if error is not None:
+                    raise error
+            if tx_hash in self.transactions and tx_hash not in self.receipts:
+                raise RPCError("already known")
+            if tx.nonce < self._pending_count(sender):
+                raise RPCError("nonce too low")
+            if tx.nonce > self._pending_count(sender):
+                raise RPCError("nonce too high")
+            cost = tx.value + tx.gas * tx.gasPrice
+            if self.balances[sender] < cost:
+                raise RPCError("insufficient funds for gas * price + value")
+            entry = {"hash": tx_hash, "from": sender, "to": "0x" + tx.to.hex(), "nonce": tx.nonce, "value": tx.value, "gasPrice": tx.gasPrice}
+            self.transactions[tx_hash] = entry
+            self.mempool.append(entry)
+        return tx_hash
+
+    def _transaction(self, params):
+        with self._lock:
+            tx = self.transactions.get(params[0])
+            if tx is None:
+                return None
+            return {"hash": tx["hash"], "from": tx["from"], "to": tx["to"], "nonce": hex(tx["nonce"]), "value": hex(tx["value"]), "blockNumber": None}
+
+    def mine(self):
+        with self._lock:
+            self._mine()
+
+    def _mine(self):
+        if not self.mempool:
+            return
+        self.block_number += 1
+        for tx in self.mempool:
+            self.mined_nonces[tx["from"]] += 1
+            self.balances[tx["from"]] -= tx["value"] + 21000 * tx["gasPrice"]
+            self.balances[tx["to"]] += tx["value"]
+            self.receipts[tx["hash"]] = {
+                "transactionHash": tx["hash"],
+                "blockHash": "0x" + "00" * 32,
+                "blockNumber": hex(self.block_number),
+                "from": tx["from"],
+                "to": tx["to"],
+                "gasUsed": hex(21000),
+                "cumulativeGasUsed": hex(21000),
+                "effectiveGasPrice": hex(tx["gasPrice"]),
+                "status": "0x1",
+                "logs": [],
+            }
+        self.mempool = []
+
+    def _receipt(self, params):
+        with self._lock:
+            if self.auto_mine and params[0] not in self.receipts:
+                self._mine()
+            return self.receipts.get(params[0])
+
+
+class TokenChain:
+    """
+    Native balances and ERC-20 tokens behind a Multicall3 contract.
+    `add_token` deploys a token; eth_call answers `decimals`, `balanceOf`
+    and `aggregate3`/`getEthBalance` at `multicall_address`. With
+    `multicall_deployed` off, the multicall address has no code and calls
+    to it return empty data, as on a chain without Multicall3.
+    """
+
+    def __init__(self, multicall_address, block_number=100):
+        self.multicall_address = multicall_address.lower()
+        self.multicall_deployed = True
+        self.block_number = block_number
+        self.balances = Counter()
+        # lowercase token address -> (decimals, Counter of lowercase holder -> balance)
+        self.tokens = {}
+        self.decimals_calls = 0
+        self.node = StubNode({
+            "eth_blockNumber": lambda params: hex(self.block_number),
+            "eth_getBalance": lambda params: hex(self.balances[params[0].lower()]),
+            "eth_call": self._eth_call,
+        })
+
+    def start(self):
+        self.node.start()
+        return self
+
+    def stop(self):
+        self.node.stop()
+
+    @property
+    def url(self):
+        return self.node.url
+
+    def add_token(self, address, decimals):
+        self.tokens[address.lower()] = (decimals, Counter())
+        return self.tokens[address.lower()][1]
+
+    def _call(self, target, data):
+        """(success, return data) of one call, the way the contract at `target` would answer it."""
+        selector, args = data[:4].hex(), data[4:]
+        if target == self.multicall_address and selector == "4d2301cc":
+            return True, encode(["uint256"], [self.balances[decode(["address"], args)[0].lower()]])
+        if target not in self.tokens:
+            return False, b""
+        decimals, holders = self.tokens[target]
+        if selector == "313ce567":
+            self.decimals_calls += 1
+            return True, encode(["uint8"], [decimals])
+        if selector == "70a08231":
+            return True, encode(["uint256"], [holders[decode(["address"], args)[0].lower()]])
+        return False, b""
+
+    def _eth_call(self, params):
+        target, data = params[0]["to"].lower(), bytes.fromhex(params[0]["data"][2:])
+        if target == self.multicall_address:
+            if not self.multicall_deployed:
+                return "0x"
+            if data[:4].hex() == "82ad56cb":
+                calls = decode(["(address,bool,bytes)[]"], data[4:])[0]
+                return "0x" + encode(["(bool,bytes)[]"], [[self._call(call[0].lower(), call[2]) for call in calls]]).hex()
+        success, returned = self._call(target, data)
+        if not success:
+            raise RPCError("execution reverted")
+        return "0x" + returned.hex()
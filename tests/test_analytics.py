@@ -0,0 +1,85 @@
+import uuid
+from decimal import Decimal
+from types import SimpleNamespace
+
+from web3 import Web3
+
+import analytics
+import app
+import payouts
+from database import SessionLocal
+from models import Analytics, AnalyticsDaily, Business, Payment, Payout, Wallet
+
+
+CUSTOMER = Web3.to_checksum_address("0x" + "de" * 20)
+
+
+def merchant(db):
+    user_id = str(uuid.uuid4())
+    db.add(Business(user_id=user_id, email=f"{user_id}@example.com", business_name="Rollups", password_hash="x"))
+    wallet = Wallet(wallet_id=str(uuid.uuid4()), user_id=user_id, address=Web3.to_checksum_address("0x" + uuid.uuid4().hex[:20] * 2),
+                    private_key="0x" + "11" * 32)
+    db.add(wallet)
+    return SimpleNamespace(user_id=user_id, wallet_id=wallet.wallet_id, address=wallet.address)
+
+
+def receipt(sender, receiver, gas_price=10**9):
+    return {"from": sender, "to": receiver, "gasUsed": 21000, "effectiveGasPrice": gas_price, "blockNumber": 100, "status": 1}
+
+
+def pay(wallet, amount, success=True):
+    """A checkout payment settled by the chain watcher's handler."""
+    payment_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(Payment(payment_id=payment_id, user_id=wallet.user_id, amount=amount, status="Pending",
+                       sender_address=CUSTOMER, receiver_address=wallet.address))
+        db.commit()
+    data = {"sender": CUSTOMER, "recv": wallet.address, "amount": amount, "email": "", "payment_id": payment_id}
+    result = {"tx_hash": "0x" + uuid.uuid4().hex * 2, "receipt": receipt(CUSTOMER, wallet.address)} if success else False
+    app.settle_checkout(data, result)
+
+
+def withdraw(scheduler, wallet, amount, success=True):
+    """A withdrawal sent by the payout scheduler and settled from its receipt."""
+    with SessionLocal() as db:
+        payout_id = payouts.enqueue(db, db.get(Wallet, wallet.wallet_id), CUSTOMER, amount)
+        db.flush()
+        db.query(Payout).filter(Payout.payout_id == payout_id).update({"status": payouts.SENT, "transaction_hash": "0x" + uuid.uuid4().hex * 2})
+        db.commit()
+    scheduler._on_receipt(payout_id, {**receipt(wallet.address, CUSTOMER, gas_price=3 * 10**9), "status": int(success)})
+    scheduler.settle()
+
+
+def rollups(user_id):
+    with SessionLocal() as db:
+        total = db.query(Analytics).filter(Analytics.user_id == user_id).one_or_none()
+        daily = db.query(AnalyticsDaily).filter(AnalyticsDaily.user_id == user_id).order_by(AnalyticsDaily.day).all()
+        return (
+            total and (total.total_payments, total.total_revenue),
+            [(d.day, d.payment_count, d.payment_volume, d.withdrawal_count, d.withdrawal_volume, d.gas_fees) for d in daily],
+        )
+
+
+def test_rebuild_matches_the_incremental_rollups(database):
+    with SessionLocal() as db:
+        shop, payouts_only, quiet = merchant(db), merchant(db), merchant(db)
+        db.commit()
+    scheduler = payouts.PayoutScheduler()
+
+    for amount in (1.25, 0.1, 0.2, 3):
+        pay(shop, amount)
+    pay(shop, 7, success=False)
+    withdraw(scheduler, shop, 0.5)
+    withdraw(scheduler, shop, 0.3, success=False)
+    withdraw(scheduler, payouts_only, 0.05)
+    pay(quiet, 2, success=False)
+
+    incremental = {wallet.user_id: rollups(wallet.user_id) for wallet in (shop, payouts_only, quiet)}
+    shop_total, (shop_day,) = incremental[shop.user_id]
+    assert shop_total == (4, Decimal("4.55000000"))
+    # Payments, withdrawals and the gas of both, each counted once
+    assert shop_day[1:] == (4, Decimal("4.55000000"), 1, Decimal("0.50000000"), Decimal("0.00014700"))
+
+    with SessionLocal() as db:
+        analytics.rebuild(db)
+    assert {wallet.user_id: rollups(wallet.user_id) for wallet in (shop, payouts_only, quiet)} == incremental
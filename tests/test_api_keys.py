@@ -0,0 +1,80 @@
+import asyncio
+import secrets
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+import api
+import pubsub
+from database import AsyncSessionLocal, SessionLocal, async_engine
+from models import BUSINESS_CHANGED, Business, api_key_hash
+
+
+class RecordingRedis:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, channel, data):
+        self.published.append((channel, data))
+
+
+def authenticate(api_key, db_execute=None):
+    """api.get_current_user on a fresh event loop; `db_execute` wraps the session's execute."""
+    async def run():
+        try:
+            async with AsyncSessionLocal() as db:
+                if db_execute is not None:
+                    db.execute = db_execute(db.execute)
+                return await api.get_current_user(token=api_key, db=db)
+        finally:
+            # Pooled connections belong to this loop
+            await async_engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_rotated_key_is_evicted_without_publishing_it(database, monkeypatch):
+    redis = RecordingRedis()
+    monkeypatch.setattr(pubsub, "_get_redis", lambda: redis)
+    user_id, old_key, new_key = str(uuid.uuid4()), secrets.token_urlsafe(32), secrets.token_urlsafe(32)
+    with SessionLocal() as db:
+        db.add(Business(user_id=user_id, email=f"{user_id}@example.com", business_name="Keys", password_hash="x", api_key=old_key))
+        db.commit()
+
+    assert authenticate(old_key).user_id == user_id
+    assert api.api_key_cache.get(api_key_hash(old_key)) is not None
+
+    with SessionLocal() as db:
+        db.get(Business, user_id).api_key = new_key
+        db.commit()
+
+    assert len(redis.published) == 1
+    channel, data = redis.published[0]
+    assert channel == pubsub.CHANNEL_PREFIX + "business.changed"
+    assert old_key not in data and new_key not in data
+    assert api_key_hash(old_key) in data
+    # Evicted here too, so the old key stops working straight away
+    assert api.api_key_cache.get(api_key_hash(old_key)) is None
+    assert authenticate(new_key).user_id == user_id
+
+
+def test_lookup_racing_a_rotation_does_not_cache_the_old_key(database):
+    user_id, old_key = str(uuid.uuid4()), secrets.token_urlsafe(32)
+    with SessionLocal() as db:
+        db.add(Business(user_id=user_id, email=f"{user_id}@example.com", business_name="Race", password_hash="x", api_key=old_key))
+        db.commit()
+
+    def rotated_during(execute):
+        async def read_then_rotate(*args, **kwargs):
+            # The row is read with the old key, then a rotation committed on another worker evicts it
+            result = await execute(*args, **kwargs)
+            pubsub.publish(BUSINESS_CHANGED, {"user_id": user_id, "api_key_hashes": [api_key_hash(old_key)]})
+            return result
+
+        return read_then_rotate
+
+    # The request already in flight still gets its answer
+    assert authenticate(old_key, rotated_during).user_id == user_id
+    # But doesn't put the rotated key back in the cache
+    assert api.api_key_cache.get(api_key_hash(old_key)) is None
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import pytest
+
+from balances import BalanceCache
+
+
+ADDRESS = "0x" + "Ab" * 20
+
+
+class Chain:
+    """A head block and per-address balances, counting the reads that reach them."""
+
+    def __init__(self, head=100):
+        self.eth = SimpleNamespace(block_number=head)
+        self.balances = {ADDRESS.lower(): 1}
+        self.reads = []
+        # Run in the middle of the next read, after the node has answered
+        self.during_read = None
+
+    def load(self, address, block_identifier):
+        self.reads.append(block_identifier)
+        balance = self.balances[address.lower()]
+        if self.during_read:
+            during, self.during_read = self.during_read, None
+            during()
+        return balance
+
+
+def cache(chain, **kwargs):
+    return BalanceCache(chain, loader=chain.load, head_ttl=0, **kwargs)
+
+
+def test_entry_expires_once_the_head_is_too_far_ahead():
+    chain = Chain()
+    balances = cache(chain, max_block_lag=2)
+    assert balances.get(ADDRESS) == 1
+
+    chain.balances[ADDRESS.lower()] = 2
+    chain.eth.block_number = 102
+    # Still within the lag, and matched case-insensitively
+    assert balances.get(ADDRESS.lower()) == 1
+    chain.eth.block_number = 103
+    assert balances.get(ADDRESS) == 2
+    assert chain.reads == [100, 103]
+    assert (balances.hits, balances.misses) == (1, 2)
+
+
+def test_invalidate_drops_entries_read_before_the_change():
+    chain = Chain()
+    balances = cache(chain)
+    balances.get(ADDRESS)
+
+    # Already included in a balance read at block 100
+    balances.invalidate(ADDRESS, block_number=100)
+    balances.get(ADDRESS)
+    assert chain.reads == [100]
+
+    balances.invalidate_transaction({"from": "0x" + "11" * 20, "to": ADDRESS.lower(), "blockNumber": 101})
+    balances.get(ADDRESS)
+    # Pending transactions have no block yet and always invalidate
+    balances.invalidate_transaction({"from": ADDRESS, "to": None, "blockNumber": None})
+    balances.get(ADDRESS)
+    assert chain.reads == [100, 100, 100]
+    assert balances.invalidations == 2
+
+
+def test_read_racing_an_invalidation_is_not_cached():
+    chain = Chain()
+    balances = cache(chain)
+
+    def send_withdrawal():
+        chain.balances[ADDRESS.lower()] = 0
+        balances.invalidate(ADDRESS)
+
+    chain.during_read = send_withdrawal
+    # The read itself still answers with what the node said
+    assert balances.get(ADDRESS) == 1
+    assert balances.stats()["size"] == 0
+    assert balances.get(ADDRESS) == 0
+    assert balances.get(ADDRESS) == 0
+    assert len(chain.reads) == 2
+    # Nothing left behind for the next read to compare against
+    assert balances._generations == balances._readers == {}
+
+
+def test_fresh_reads_always_go_to_the_node():
+    chain = Chain()
+    balances = cache(chain)
+    # Nothing known about the head yet, so there is no block to file it under
+    assert balances.get(ADDRESS, fresh=True) == 1
+    assert balances.stats()["size"] == 0
+
+    balances.get(ADDRESS)
+    chain.balances[ADDRESS.lower()] = 5
+    assert balances.get(ADDRESS, fresh=True) == 5
+    assert chain.reads == ["latest", 100, "latest"]
+    # And refresh the entry for the reads that follow
+    assert balances.get(ADDRESS) == 5
+    assert len(chain.reads) == 3
+
+
+def test_failed_read_is_not_cached():
+    chain = Chain()
+    balances = cache(chain)
+    chain.balances.clear()
+    with pytest.raises(KeyError):
+        balances.get(ADDRESS)
+    assert balances.stats()["size"] == 0
+    assert balances._readers == {}
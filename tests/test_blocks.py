@@ -0,0 +1,125 @@
+import uuid
+
+import pytest
+from web3 import HTTPProvider, Web3
+
+import monitor
+from database import session_scope
+from models import WatcherCheckpoint
+from tests.stubs import StubNode
+from watcher import BlockChainWatcher, PaymentIndex, Watch
+
+
+SENDER = "0x" + "11" * 20
+RECEIVER = "0x" + "22" * 20
+OTHER = "0x" + "33" * 20
+
+
+class Blocks:
+    """Full-transaction blocks served by a StubNode, with transfers added per block."""
+
+    def __init__(self, head=100):
+        self.head = head
+        # block number -> transactions
+        self.transfers = {}
+        self.fetched = []
+        self.node = StubNode({
+            "eth_blockNumber": lambda params: hex(self.head),
+            "eth_getBlockByNumber": self._block,
+        }).start()
+
+    def transfer(self, block_number, sender, receiver):
+        tx_hash = "0x" + uuid.uuid4().hex * 2
+        self.transfers.setdefault(block_number, []).append({
+            "hash": tx_hash, "from": sender, "to": receiver, "value": hex(10**18),
+            "blockNumber": hex(block_number), "blockHash": "0x" + "00" * 32, "transactionIndex": "0x0",
+            "nonce": "0x0", "gas": hex(21000), "gasPrice": hex(10**9), "input": "0x",
+        })
+        return tx_hash
+
+    def _block(self, params):
+        number = int(params[0], 16)
+        self.fetched.append(number)
+        return {
+            "number": hex(number), "hash": "0x%064x" % number, "parentHash": "0x%064x" % (number - 1),
+            "timestamp": hex(number), "transactions": self.transfers.get(number, []),
+        }
+
+
+@pytest.fixture
+def chain():
+    chain = Blocks()
+    yield chain
+    chain.node.stop()
+
+
+def block_watcher(chain, name):
+    watcher = BlockChainWatcher(Web3(HTTPProvider(chain.node.url)), name=name)
+    watcher.start = lambda: None
+    return watcher
+
+
+def test_match_skips_transfers_mined_before_the_watch_started():
+    index = PaymentIndex()
+    index.add(Watch("payment", SENDER, RECEIVER, 1, callback=None, start_block=100))
+
+    assert index.match(SENDER, RECEIVER, 99) is None
+    assert index.match(OTHER, RECEIVER, 100) is None
+    # Still pending in the mempool, so it can only be newer than the watch
+    assert index.match(Web3.to_checksum_address(SENDER), RECEIVER, None).payment_id == "payment"
+
+
+def test_block_match_intersects_recipients_with_open_receivers():
+    block = {"transactions": [
+        {"hash": "a", "from": SENDER, "to": Web3.to_checksum_address(RECEIVER)},
+        {"hash": "b", "from": SENDER, "to": OTHER},
+        {"hash": "c", "from": SENDER, "to": None},
+        {"hash": "d", "from": OTHER, "to": RECEIVER},
+    ]}
+    assert [tx["hash"] for tx in monitor.match_block_transactions(block, {RECEIVER})] == ["a", "d"]
+    assert monitor.match_block_transactions(block, {"0x" + "44" * 20}) == []
+
+
+def test_registered_payment_ignores_older_transfers_in_catch_up_blocks(database, chain):
+    name = f"blocks-{uuid.uuid4()}"
+    with session_scope() as db:
+        db.add(WatcherCheckpoint(name=name, block_number=90))
+    old = chain.transfer(95, SENDER, RECEIVER)
+    watcher = block_watcher(chain, name)
+    watch = watcher.register("payment", SENDER, RECEIVER, 1, callback=None)
+    assert watch.start_block == 100
+
+    watcher._scan()
+    assert chain.fetched == list(range(91, 101))
+    assert watcher._confirming == {}
+
+    chain.head = 101
+    new = chain.transfer(101, SENDER, RECEIVER)
+    watcher._scan()
+    assert [Web3.to_hex(tx_hash) for tx_hash in watcher._confirming] == [new]
+    assert old != new
+
+
+def test_restart_resumes_from_the_saved_checkpoint(database, chain):
+    name = f"blocks-{uuid.uuid4()}"
+    chain.head = 105
+    first = block_watcher(chain, name)
+    first.index.add(Watch("payment", SENDER, RECEIVER, 1, callback=None, start_block=100))
+    first._scan()
+    with session_scope() as db:
+        assert db.get(WatcherCheckpoint, name).block_number == 105
+
+    # Mined while no process was running
+    chain.head = 110
+    tx_hash = chain.transfer(108, SENDER, RECEIVER)
+    chain.fetched.clear()
+    second = block_watcher(chain, name)
+    second.index.add(Watch("payment", SENDER, RECEIVER, 1, callback=None, start_block=100))
+    # Still open after the first one matches, so the scan goes on to the head
+    second.index.add(Watch("payment-2", OTHER, RECEIVER, 1, callback=None, start_block=100))
+    second._scan()
+
+    assert chain.fetched == list(range(106, 111))
+    assert [Web3.to_hex(tx_hash) for tx_hash in second._confirming] == [tx_hash]
+    with session_scope() as db:
+        assert db.get(WatcherCheckpoint, name).block_number == 110
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import uuid
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import events
+from database import SessionLocal, async_engine
+from models import Business, Payment
+
+
+def test_sse_encodes_amounts_like_the_api():
+    chunk = events._sse({"payment_id": "p", "status": "Successful", "amount": Decimal("1.5")})
+    assert chunk.startswith("event: status\ndata: ") and chunk.endswith("\n\n")
+    assert json.loads(chunk.split("data: ", 1)[1]) == {"payment_id": "p", "status": "Successful", "amount": "1.5"}
+
+
+def sent(chunks):
+    return [json.loads(chunk.split("data: ", 1)[1]) for chunk in chunks if chunk.startswith("event: ")]
+
+
+def test_slow_subscriber_is_dropped_without_holding_up_the_others():
+    broker = events.EventBroker(queue_size=2)
+
+    async def run():
+        with broker.subscribe("payment", "p") as slow, broker.subscribe("merchant", "m") as fast:
+            received = []
+            for i in range(3):
+                broker._fan_out({"payment_id": "p", "user_id": "m", "status": f"s{i}"})
+                received.append((await fast.get(1))["status"])
+            assert slow.dropped and not fast.dropped
+            assert broker.stats()["subscribers"] == 1
+            # What it had queued still goes out, then its stream ends and the client reconnects
+            return received, [chunk async for chunk in events.sse_stream(slow)]
+
+    received, chunks = asyncio.run(run())
+    assert received == ["s0", "s1", "s2"]
+    assert [event["status"] for event in sent(chunks)] == ["s0", "s1"]
+    assert broker.stats() == {"topics": 0, "subscribers": 0, "published": 3, "delivered": 5, "dropped": 1}
+
+
+def business(db):
+    user_id, api_key = str(uuid.uuid4()), uuid.uuid4().hex
+    db.add(Business(user_id=user_id, email=f"{user_id}@example.com", business_name="Events", password_hash="x", api_key=api_key))
+    return user_id, {"Authorization": f"Bearer {api_key}"}
+
+
+def payment(db, user_id, status="Pending"):
+    payment_id = str(uuid.uuid4())
+    db.add(Payment(payment_id=payment_id, user_id=user_id, amount=Decimal("1"), status=status,
+                   sender_address="0x" + "de" * 20, receiver_address="0x" + "ad" * 20))
+    return payment_id
+
+
+@pytest.mark.parametrize("final", ["Successful", "Failed"])
+def test_payment_stream_ends_after_a_final_status(database, final):
+    with SessionLocal() as db:
+        user_id, _ = business(db)
+        payment_id = payment(db, user_id)
+        db.commit()
+
+    async def run():
+        try:
+            stream = events.payment_sse(payment_id)
+            # Subscribed once the current status is out
+            chunks = [await stream.__anext__()]
+            for status in ("Pending", final, "Successful"):
+                events.publish_status(SimpleNamespace(payment_id=payment_id, user_id=user_id, status=status, transaction_hash=None))
+            chunks += [chunk async for chunk in stream]
+            assert ("payment", payment_id) not in events.broker._topics
+            return chunks
+        finally:
+            await async_engine.dispose()
+
+    assert sent(asyncio.run(run())) == [
+        {"payment_id": payment_id, "status": status, "transaction_hash": None} for status in ("Pending", "Pending", final)
+    ]
+
+
+def test_payment_events_are_for_the_owner_only(database):
+    with SessionLocal() as db:
+        owner, owner_headers = business(db)
+        _, other_headers = business(db)
+        payment_id = payment(db, owner, status="Successful")
+        db.commit()
+    client = TestClient(app.app)
+    url = f"/api/v1/payment/events/{payment_id}"
+
+    response = client.get(url, headers=owner_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    # Already final, so the stream is just the current status
+    assert sent(response.text.split("\n\n")[:-1]) == [{"payment_id": payment_id, "status": "Successful", "transaction_hash": None}]
+
+    assert client.get(url, headers=other_headers).status_code == 403
+    assert client.get(url).status_code == 401
+    assert client.get(f"/api/v1/payment/events/{uuid.uuid4()}", headers=owner_headers).status_code == 404
+    # The checkout page's stream is public, like /payment/status, and doesn't give away whose payment it is
+    public = client.get(f"/payment/events/{payment_id}")
+    assert public.status_code == 200
+    assert owner not in public.text
@@ -0,0 +1,124 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+import export
+from database import SessionLocal
+from models import Business, Transaction, Wallet
+
+
+START = datetime(2026, 1, 1)
+OTHER = "0x" + "de" * 20
+AMOUNTS = [Decimal("0.00000001"), Decimal("12345678.12345678"), Decimal("1.10000000")]
+
+
+def business(db, with_wallet=True):
+    user_id = str(uuid.uuid4())
+    email = f"{user_id}@example.com"
+    db.add(Business(user_id=user_id, email=email, business_name="Export", password_hash="x", api_key=uuid.uuid4().hex))
+    address = "0x" + uuid.uuid4().hex[:20] * 2
+    if with_wallet:
+        db.add(Wallet(wallet_id=str(uuid.uuid4()), user_id=user_id, address=address, private_key="0x" + "11" * 32))
+    return address, {"Authorization": f"Bearer {app.create_access_token({'sub': email})}"}
+
+
+@pytest.fixture(scope="module")
+def merchant(database):
+    rows = []
+    with SessionLocal() as db:
+        address, headers = business(db)
+        for i in range(20):
+            # Incoming and outgoing alternate in time, and some share a timestamp
+            created_at = START + timedelta(minutes=i // 2 * 2 + (i % 3 == 0))
+            sender, receiver = [(OTHER, address), (address, OTHER), (address, address)][i % 3]
+            status = "Failed" if i % 5 == 0 else "Successful"
+            transaction_id = str(uuid.uuid4())
+            db.add(Transaction(transaction_id=transaction_id, payment_id=str(uuid.uuid4()), from_address=sender, to_address=receiver,
+                               amount=AMOUNTS[i % 3], gas_fee=Decimal("0.00002100"), status=status, block_number=i,
+                               transaction_hash="0x" + uuid.uuid4().hex * 2, created_at=created_at))
+            rows.append((created_at, transaction_id, status, AMOUNTS[i % 3]))
+        db.add(Transaction(transaction_id=str(uuid.uuid4()), payment_id=str(uuid.uuid4()), from_address=OTHER, to_address=OTHER,
+                           amount=Decimal("1"), gas_fee=Decimal("0"), status="Successful", transaction_hash="0x" + "ff" * 32,
+                           created_at=START))
+        db.commit()
+    rows.sort()
+    return {"headers": headers, "rows": rows}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Small enough that the export spans several chunks and fetches
+    monkeypatch.setattr(export, "EXPORT_CHUNK_ROWS", 3)
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 2)
+    return TestClient(app.app)
+
+
+def download(client, merchant, query):
+    response = client.get(f"/transactions/export?{query}", headers=merchant["headers"])
+    assert response.status_code == 200, response.text
+    return response
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_ndjson_has_every_row_oldest_first(client, merchant):
+    response = download(client, merchant, "format=ndjson")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["content-disposition"].endswith('.ndjson"')
+    records = ndjson(response)
+    # Incoming and outgoing merged into one stream, each transaction once
+    assert [record["transaction_id"] for record in records] == [row[1] for row in merchant["rows"]]
+    assert list(records[0]) == export.FIELDS
+    assert records[0]["created_at"] == START.isoformat()
+
+
+def test_csv_matches_the_ndjson_export(client, merchant):
+    response = download(client, merchant, "format=csv")
+    assert response.headers["content-type"].startswith("text/csv")
+    header, *rows = list(csv.reader(io.StringIO(response.text)))
+    assert header == export.FIELDS
+    records = ndjson(download(client, merchant, "format=ndjson"))
+    assert [dict(zip(header, row)) for row in rows] == [
+        {name: "" if value is None else str(value) for name, value in record.items()} for record in records
+    ]
+
+
+def test_amounts_are_exact_decimal_strings(client, merchant):
+    expected = [format(row[3], "f") for row in merchant["rows"]]
+    assert [record["amount"] for record in ndjson(download(client, merchant, "format=ndjson"))] == expected
+    rows = list(csv.DictReader(io.StringIO(download(client, merchant, "format=csv").text)))
+    assert [row["amount"] for row in rows] == expected
+    assert "0.00000001" in expected and "12345678.12345678" in expected
+
+
+def test_filters_are_applied(client, merchant):
+    start, end = START + timedelta(minutes=4), START + timedelta(minutes=14)
+    expected = [row[1] for row in merchant["rows"] if row[2] == "Successful" and start <= row[0] < end]
+    query = f"status=Successful&start={start.isoformat()}&end={end.isoformat()}"
+    assert [record["transaction_id"] for record in ndjson(download(client, merchant, "format=ndjson&" + query))] == expected
+    rows = list(csv.DictReader(io.StringIO(download(client, merchant, "format=csv&" + query).text)))
+    assert [row["transaction_id"] for row in rows] == expected
+    assert 0 < len(expected) < len(merchant["rows"])
+
+
+def test_unknown_format_is_rejected(client, merchant):
+    response = client.get("/transactions/export?format=xml", headers=merchant["headers"])
+    assert response.status_code == 400
+
+
+def test_business_without_a_wallet_gets_404(client, database):
+    with SessionLocal() as db:
+        _, headers = business(db, with_wallet=False)
+        db.commit()
+    response = client.get("/transactions/export", headers=headers)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "No wallet found for this business"
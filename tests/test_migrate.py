@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import create_engine, text
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_workers_migrating_one_sqlite_database_at_once():
+    path = os.path.join(tempfile.mkdtemp(prefix="lianflow-migrate-"), "app.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+    workers = [
+        subprocess.Popen([sys.executable, "-c", "import database; database.migrate()"], cwd=ROOT, env=env, stderr=subprocess.PIPE)
+        for _ in range(4)
+    ]
+    for worker in workers:
+        _, stderr = worker.communicate(timeout=120)
+        assert worker.returncode == 0, stderr.decode()
+
+    with create_engine(f"sqlite:///{path}").connect() as connection:
+        assert connection.execute(text("SELECT version_num FROM alembic_version")).scalar() == "0008"
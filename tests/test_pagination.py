@@ -0,0 +1,136 @@
+import base64
+import json
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from database import SessionLocal
+from models import Business, Payment, Transaction, Wallet
+from pagination import encode_cursor
+
+
+START = datetime(2026, 1, 1)
+OTHER = "0x" + "de" * 20
+
+
+@pytest.fixture(scope="module")
+def merchant(database):
+    user_id = str(uuid.uuid4())
+    address = "0x" + uuid.uuid4().hex[:20] * 2
+    email = f"{user_id}@example.com"
+    rows = []
+    with SessionLocal() as db:
+        db.add(Business(user_id=user_id, email=email, business_name="Pages", password_hash="x", api_key=uuid.uuid4().hex))
+        db.add(Wallet(wallet_id=str(uuid.uuid4()), user_id=user_id, address=address, private_key="0x" + "11" * 32))
+        for i in range(12):
+            # Pairs share a timestamp, so the id has to break the tie
+            created_at = START + timedelta(hours=i // 2)
+            # Incoming, outgoing, and a transfer to itself that both branches match
+            sender, receiver = [(OTHER, address), (address, OTHER), (address, address)][i % 3]
+            status = "Successful" if i % 4 else "Failed"
+            transaction_id = str(uuid.uuid4())
+            db.add(Transaction(transaction_id=transaction_id, payment_id=str(uuid.uuid4()), from_address=sender, to_address=receiver,
+                               amount=Decimal("1.5"), gas_fee=Decimal("0.000021"), status=status,
+                               transaction_hash="0x" + uuid.uuid4().hex * 2, created_at=created_at))
+            rows.append((created_at, transaction_id, status))
+        # Neither side is this merchant
+        db.add(Transaction(transaction_id=str(uuid.uuid4()), payment_id=str(uuid.uuid4()), from_address=OTHER, to_address=OTHER,
+                           amount=Decimal("1"), gas_fee=Decimal("0"), status="Successful", transaction_hash="0x" + "ff" * 32,
+                           created_at=START))
+        for i in range(5):
+            db.add(Payment(payment_id=str(uuid.uuid4()), user_id=user_id, amount=Decimal("2"), status="Pending",
+                           sender_address=OTHER, receiver_address=address, created_at=START + timedelta(minutes=i)))
+        db.commit()
+    rows.sort(reverse=True)
+    return {"headers": {"Authorization": f"Bearer {app.create_access_token({'sub': email})}"}, "rows": rows}
+
+
+@pytest.fixture
+def client():
+    return TestClient(app.app)
+
+
+def pages(client, merchant, url):
+    """Every page of `url`, following next_cursor to the end."""
+    ids, cursor = [], None
+    while True:
+        response = client.get(url + (f"&cursor={cursor}" if cursor else ""), headers=merchant["headers"])
+        assert response.status_code == 200, response.text
+        body = response.json()
+        ids.append([transaction["transaction_id"] for transaction in body["transacts"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def expected(merchant, status=None, start=None, end=None):
+    return [
+        transaction_id for created_at, transaction_id, row_status in merchant["rows"]
+        if (status is None or row_status == status) and (start is None or created_at >= start) and (end is None or created_at < end)
+    ]
+
+
+def test_pages_merge_both_branches_newest_first(client, merchant):
+    ids = pages(client, merchant, "/transactions/?limit=5")
+    assert [len(page) for page in ids] == [5, 5, 2]
+    # Incoming and outgoing interleaved by time, ties broken by id, nothing repeated
+    assert sum(ids, []) == expected(merchant)
+
+
+def test_pages_split_between_rows_with_the_same_timestamp(client, merchant):
+    # An odd page size ends every page between the two rows sharing a timestamp
+    assert sum(pages(client, merchant, "/transactions/?limit=3"), []) == expected(merchant)
+    assert sum(pages(client, merchant, "/transactions/?limit=1"), []) == expected(merchant)
+
+
+def test_filters_apply_to_every_page(client, merchant):
+    start, end = START + timedelta(hours=1), START + timedelta(hours=5)
+    ids = pages(client, merchant, f"/transactions/?limit=2&status=Successful&start={start.isoformat()}&end={end.isoformat()}")
+    assert sum(ids, []) == expected(merchant, "Successful", start, end)
+    assert len(sum(ids, [])) == 6
+
+
+def test_num_alias_sets_the_page_size(client, merchant):
+    response = client.get("/transactions/4", headers=merchant["headers"])
+    assert [transaction["transaction_id"] for transaction in response.json()["transacts"]] == expected(merchant)[:4]
+    # `limit` wins when both are given
+    assert len(client.get("/transactions/4?limit=2", headers=merchant["headers"]).json()["transacts"]) == 2
+    payments = client.get("/payments/3", headers=merchant["headers"]).json()
+    assert len(payments["payments"]) == 3 and payments["next_cursor"]
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    "%%%",
+    raw_cursor("2026-01-01T00:00:00"),
+    raw_cursor(["yesterday", "id"]),
+    raw_cursor(["2026-01-01T00:00:00", "id", "extra"]),
+    raw_cursor([1767225600, "id"]),
+    raw_cursor(["2026-01-01T00:00:00", {"id": 1}]),
+    raw_cursor(["2026-01-01T00:00:00", ["id"]]),
+    raw_cursor(["2026-01-01T00:00:00", None]),
+])
+def test_bad_cursor_is_a_client_error(client, merchant, cursor):
+    for url in ("/transactions/", "/payments/"):
+        response = client.get(f"{url}?cursor={cursor}", headers=merchant["headers"])
+        assert response.status_code == 400, response.text
+        assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_cursor_resumes_after_its_row_within_a_tie(client, merchant):
+    created_at, transaction_id, _ = merchant["rows"][0]
+    # Unpadded, so it can go in a URL as is
+    cursor = encode_cursor(created_at, transaction_id)
+    assert "=" not in cursor
+    response = client.get(f"/transactions/?limit=1&cursor={cursor}", headers=merchant["headers"])
+    # The other row with the same timestamp, not the next hour down
+    assert merchant["rows"][1][0] == created_at
+    assert [transaction["transaction_id"] for transaction in response.json()["transacts"]] == [merchant["rows"][1][1]]
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import passwords
+
+
+def test_disconnected_caller_keeps_its_slot_until_the_work_finishes():
+    started, finish = threading.Event(), threading.Event()
+
+    def slow_hash():
+        started.set()
+        finish.wait(5)
+        return "hash"
+
+    async def disconnect():
+        request = asyncio.ensure_future(passwords._run_async(slow_hash))
+        await asyncio.to_thread(started.wait, 5)
+        request.cancel()
+        await asyncio.gather(request, return_exceptions=True)
+
+    before = passwords.stats()["pending"]
+    asyncio.run(disconnect())
+    # bcrypt is still running for the request that went away
+    assert passwords.stats()["pending"] == before + 1
+
+    finish.set()
+    for _ in range(100):
+        if passwords.stats()["pending"] == before:
+            break
+        threading.Event().wait(0.01)
+    assert passwords.stats()["pending"] == before
+
+
+def test_queued_work_is_dropped_with_its_caller(monkeypatch):
+    finish = threading.Event()
+    runs = []
+    monkeypatch.setattr(passwords, "_executor", passwords.ThreadPoolExecutor(max_workers=1))
+
+    async def burst():
+        busy = asyncio.ensure_future(passwords._run_async(finish.wait, 5))
+        queued = asyncio.ensure_future(passwords._run_async(runs.append, "queued"))
+        await asyncio.sleep(0.05)
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        finish.set()
+        await asyncio.gather(busy, queued, return_exceptions=True)
+
+    before = passwords.stats()["pending"]
+    asyncio.run(burst())
+    passwords._executor.shutdown(wait=True)
+    assert runs == []
+    assert passwords.stats()["pending"] == before
@@ -0,0 +1,214 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from eth_account import Account
+from web3 import HTTPProvider, Web3
+
+import payouts
+from database import SessionLocal
+from models import Business, Payment, Payout, Transaction, Wallet
+from sender import GasPriceCache, NonceManager, ReceiptTracker
+from tests.stubs import DevChain, RPCError
+
+
+@pytest.fixture
+def chain(database, monkeypatch):
+    chain = DevChain().start()
+    w3 = Web3(HTTPProvider(chain.url))
+    monkeypatch.setattr(payouts, "web3", w3)
+    monkeypatch.setattr(payouts, "nonce_manager", NonceManager(w3))
+    monkeypatch.setattr(payouts, "gas_price_cache", GasPriceCache(w3))
+    monkeypatch.setattr(payouts, "receipt_tracker", ReceiptTracker(w3, poll_interval=0.05, timeout=5))
+    yield chain
+    chain.stop()
+
+
+@pytest.fixture
+def wallet(chain):
+    account = Account.create()
+    user_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(Business(user_id=user_id, email=f"{user_id}@example.com", business_name="Shop", password_hash="x"))
+        db.add(Wallet(wallet_id=str(uuid.uuid4()), user_id=user_id, address=account.address, private_key=account.key.hex()))
+        db.commit()
+    chain.balances[account.address.lower()] = 10**21
+    return account
+
+
+def queue(account, count, amount=0.001):
+    with SessionLocal() as db:
+        wallet = db.query(Wallet).filter(Wallet.address == account.address).one()
+        ids = [payouts.enqueue(db, wallet, Web3.to_checksum_address("0x" + "%040x" % (i + 1)), amount) for i in range(count)]
+        db.commit()
+    return ids
+
+
+def rows(ids):
+    with SessionLocal() as db:
+        return {row.payout_id: row for row in db.query(Payout).filter(Payout.payout_id.in_(ids))}
+
+
+def settle(scheduler, ids, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        scheduler.recover()
+        scheduler.dispatch()
+        scheduler.settle()
+        if all(row.status in (payouts.SUCCESSFUL, payouts.FAILED) for row in rows(ids).values()):
+            return rows(ids)
+        time.sleep(0.05)
+    raise AssertionError({row.payout_id: row.status for row in rows(ids).values()})
+
+
+def scheduler(**kwargs):
+    kwargs.setdefault("lease_ttl", 1)
+    return payouts.PayoutScheduler(poll_interval=0.05, **kwargs)
+
+
+def test_group_is_sent_with_sequential_nonces_and_settled_in_bulk(chain, wallet):
+    ids = queue(wallet, 20)
+    settled = settle(scheduler(), ids)
+
+    assert sorted(row.nonce for row in settled.values()) == list(range(20))
+    assert {row.status for row in settled.values()} == {payouts.SUCCESSFUL}
+    with SessionLocal() as db:
+        payment_ids = [row.payment_id for row in settled.values()]
+        assert db.query(Transaction).filter(Transaction.payment_id.in_(payment_ids)).count() == 20
+        assert {p.status for p in db.query(Payment).filter(Payment.payment_id.in_(payment_ids))} == {"Successful"}
+    # One nonce read for the whole group
+    assert chain.node.calls["eth_getTransactionCount"] == 1
+
+
+def test_wallet_is_sent_from_by_one_scheduler_at_a_time(chain, wallet):
+    ids = queue(wallet, 5)
+    first, second = scheduler(), scheduler()
+    assert first._lease_wallet(wallet.address)
+
+    assert second._send_wallet(wallet.address) == 0
+    assert {row.status for row in rows(ids).values()} == {payouts.QUEUED}
+
+    first._release_wallet(wallet.address)
+    assert second._send_wallet(wallet.address) == 5
+
+
+def test_nonces_are_reread_from_the_node_when_the_wallet_is_taken(chain, wallet):
+    # Another process (or a send from outside the app) used nonces 0 and 1
+    chain.mined_nonces[wallet.address.lower()] = 2
+    payouts.nonce_manager._next[wallet.address.lower()] = 0
+
+    settled = settle(scheduler(), queue(wallet, 3))
+
+    assert sorted(row.nonce for row in settled.values()) == [2, 3, 4]
+    assert {row.status for row in settled.values()} == {payouts.SUCCESSFUL}
+
+
+def test_groups_sent_under_one_lease_share_the_local_counter(chain, wallet):
+    ids = queue(wallet, 12)
+    s = scheduler(batch_size=5)
+
+    assert s._send_wallet(wallet.address) == 12
+    assert sorted(row.nonce for row in rows(ids).values()) == list(range(12))
+    # Three groups, one nonce read
+    assert chain.node.calls["eth_getTransactionCount"] == 1
+    assert {row.status for row in settle(s, ids).values()} == {payouts.SUCCESSFUL}
+
+
+def test_nonce_error_requeues_instead_of_failing(chain, wallet):
+    ids = queue(wallet, 3)
+    chain.send_errors.append(RPCError("nonce too low"))
+    s = scheduler()
+
+    assert s._send_wallet(wallet.address) == 0
+    requeued = rows(ids)
+    assert {row.status for row in requeued.values()} == {payouts.QUEUED}
+    assert {row.nonce for row in requeued.values()} == {None}
+
+    settled = settle(s, ids)
+    assert {row.status for row in settled.values()} == {payouts.SUCCESSFUL}
+    assert sorted(row.nonce for row in settled.values()) == [0, 1, 2]
+
+
+def test_ambiguous_send_error_keeps_every_signed_transaction(chain, wallet):
+    ids = queue(wallet, 4)
+    s = scheduler()
+    # The second broadcast fails without a JSON-RPC answer: it may or may not have reached the node
+    chain.send_errors.extend([None, ConnectionResetError("connection reset")])
+
+    assert s._send_wallet(wallet.address) == 1
+    stopped = rows(ids)
+    unsent = [row for row in stopped.values() if row.status == payouts.SENDING]
+    assert len(unsent) == 3
+    assert all(row.raw_transaction is not None for row in unsent)
+    assert sorted(row.nonce for row in unsent) == [1, 2, 3]
+
+    # A new payout queued meanwhile must not reuse the nonces those transactions hold
+    ids += queue(wallet, 1)
+    settled = settle(s, ids)
+    assert {row.status for row in settled.values()} == {payouts.SUCCESSFUL}
+    assert sorted(row.nonce for row in settled.values()) == [0, 1, 2, 3, 4]
+    assert len(chain.receipts) == 5
+
+
+def test_rejected_payout_fails_and_the_rest_are_signed_again(chain, wallet):
+    ids = queue(wallet, 3)
+    chain.send_errors.append(RPCError("insufficient funds for gas * price + value"))
+    settled = settle(scheduler(), ids)
+
+    statuses = sorted(row.status for row in settled.values())
+    assert statuses == [payouts.FAILED, payouts.SUCCESSFUL, payouts.SUCCESSFUL]
+    assert sorted(row.nonce for row in settled.values() if row.status == payouts.SUCCESSFUL) == [0, 1]
+
+
+def sent_and_expired(chain, wallet):
+    """One payout broadcast but not mined, whose lease has run out after its last resend."""
+    chain.auto_mine = False
+    ids = queue(wallet, 1)
+    s = scheduler(max_resends=0)
+    assert s._send_wallet(wallet.address) == 1
+    with SessionLocal() as db:
+        db.query(Payout).filter(Payout.payout_id.in_(ids)).update({"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+    return s, ids
+
+
+def payment_status(ids):
+    with SessionLocal() as db:
+        payment_ids = [row.payment_id for row in rows(ids).values()]
+        return {p.status for p in db.query(Payment).filter(Payment.payment_id.in_(payment_ids))}
+
+
+def test_payout_mined_after_its_last_resend_is_settled(chain, wallet):
+    s, ids = sent_and_expired(chain, wallet)
+    chain.mine()
+
+    s.recover()
+    assert {row.status for row in rows(ids).values()} == {payouts.SENT}
+    assert {row.status for row in settle(s, ids).values()} == {payouts.SUCCESSFUL}
+    assert payment_status(ids) == {"Successful"}
+    assert s.failed == 0
+
+
+def test_payout_still_in_the_mempool_is_not_failed(chain, wallet):
+    s, ids = sent_and_expired(chain, wallet)
+
+    s.recover()
+    resent = rows(ids)
+    assert {row.status for row in resent.values()} == {payouts.SENT}
+    assert {row.attempts for row in resent.values()} == {1}
+    assert s.resent == 1
+    assert payment_status(ids) == {"Pending"}
+
+
+def test_payout_whose_nonce_was_used_by_another_transaction_fails(chain, wallet):
+    s, ids = sent_and_expired(chain, wallet)
+    # Dropped from the mempool, and the nonce went to a transaction sent from outside the app
+    chain.mempool.clear()
+    chain.mined_nonces[wallet.address.lower()] = 1
+
+    s.recover()
+    failed = rows(ids)
+    assert {row.status for row in failed.values()} == {payouts.FAILED}
+    assert {row.last_error for row in failed.values()} == {"Nonce was used by another transaction"}
+    assert payment_status(ids) == {payouts.FAILED}
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from price import PriceOracle
+from tests.stubs import StubPriceServer
+
+
+@pytest.fixture
+def upstream():
+    server = StubPriceServer(delay=0.1).start()
+    yield server
+    server.stop()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_concurrent_misses_share_one_upstream_request(upstream):
+    oracle = PriceOracle(url=upstream.url, ttl=60)
+    prices = []
+    threads = [threading.Thread(target=lambda: prices.append(oracle.get_price())) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert prices == [2000.0] * 50
+    assert upstream.requests == 1
+    # Served from the cache from here on
+    assert oracle.get_price() == 2000.0
+    assert upstream.requests == 1
+
+
+def test_price_is_refreshed_in_the_background_before_it_expires(upstream):
+    oracle = PriceOracle(url=upstream.url, ttl=0.5, refresh_ahead=0.5)
+    assert oracle.get_price() == 2000.0
+    upstream.price = 2100.0
+    time.sleep(0.3)
+
+    # Still the cached price, while a refresh runs behind it
+    assert oracle.get_price() == 2000.0
+    wait_for(lambda: oracle._price == 2100.0)
+    assert upstream.requests == 2
+    assert oracle.misses == 1
+
+
+def test_last_good_price_is_served_while_upstream_fails(upstream):
+    oracle = PriceOracle(url=upstream.url, ttl=0.1, retry_after=60)
+    assert oracle.get_price() == 2000.0
+    upstream.fail = True
+    time.sleep(0.15)
+
+    assert oracle.get_price() == 2000.0
+    # Not retried until retry_after has passed
+    for _ in range(10):
+        assert oracle.get_price() == 2000.0
+    assert upstream.requests == 2
+    assert oracle.errors == 1
+
+
+def test_no_price_without_a_good_fetch(upstream):
+    upstream.fail = True
+    oracle = PriceOracle(url=upstream.url)
+    with pytest.raises(Exception):
+        oracle.get_price()
+    assert oracle.stats()["price"] is None
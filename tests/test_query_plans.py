@@ -0,0 +1,205 @@
+"""
+The hot read paths must be served by the indexes from migration 0003, not by
+scanning a table. Each test drives the real code path (an endpoint through
+TestClient, or a background job), captures every statement it sends to the
+database and checks SQLite's EXPLAIN QUERY PLAN for all of them.
+"""
+import asyncio
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import analytics
+import app
+import webhooks
+from database import Base, SessionLocal, async_engine, engine
+from models import Business, Payment, PaymentWatch, Transaction, Wallet
+from watcher import ChainWatcher
+
+
+TABLES = set(Base.metadata.tables)
+
+
+@contextmanager
+def captured():
+    """Collect (statement, parameters) for everything run on the sync and async engines."""
+    statements = []
+
+    def capture(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters[0] if executemany else parameters))
+
+    targets = (engine, async_engine.sync_engine)
+    for target in targets:
+        event.listen(target, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        for target in targets:
+            event.remove(target, "before_cursor_execute", capture)
+
+
+def query_plans(statements):
+    """{statement: plan} for every statement that reads or writes a table."""
+    plans = {}
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            if statement.split(None, 1)[0].upper() not in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH"):
+                continue
+            rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, tuple(parameters or ()))
+            plans[statement] = "\n".join(row[-1] for row in rows)
+    return plans
+
+
+def assert_no_scans(statements, *indexes):
+    """No statement reads a whole table, and each of `indexes` is used by at least one of them."""
+    plans = query_plans(statements)
+    assert plans, "nothing was captured"
+    for statement, plan in plans.items():
+        for line in plan.splitlines():
+            # "SCAN <table>" reads every row, even when it walks an index to do it
+            words = line.split()
+            assert not (words[:1] == ["SCAN"] and words[1] in TABLES), f"{statement}\n{plan}"
+    used = "\n".join(plans.values())
+    for index in indexes:
+        assert index in used, used
+
+
+@pytest.fixture(autouse=True)
+def sqlite_only(database):
+    if engine.dialect.name != "sqlite":
+        pytest.skip("query plans are checked on SQLite")
+
+
+@pytest.fixture(scope="module")
+def merchant(database):
+    user_id = str(uuid.uuid4())
+    address = "0x" + uuid.uuid4().hex[:20] * 2
+    api_key = uuid.uuid4().hex
+    email = f"{user_id}@example.com"
+    with SessionLocal() as db:
+        db.add(Business(user_id=user_id, email=email, business_name="Plans", password_hash="x", api_key=api_key))
+        db.add(Wallet(wallet_id=str(uuid.uuid4()), user_id=user_id, address=address, private_key="0x" + "11" * 32))
+        for i in range(30):
+            created_at = datetime.utcnow() - timedelta(hours=i)
+            incoming = i % 3 != 0
+            payment = Payment(payment_id=str(uuid.uuid4()), user_id=user_id, amount=Decimal("1.5"), status="Successful",
+                              receiver_address=address if incoming else "0x" + "cd" * 20,
+                              sender_address="0x" + "de" * 20 if incoming else address, created_at=created_at)
+            db.add(payment)
+            db.add(Transaction(transaction_id=str(uuid.uuid4()), payment_id=payment.payment_id,
+                               from_address=payment.sender_address, to_address=payment.receiver_address,
+                               amount=Decimal("1.5"), gas_fee=Decimal("0.000021"), status="Successful",
+                               transaction_hash="0x" + uuid.uuid4().hex * 2, created_at=created_at))
+            analytics.record_payment(db, user_id, Decimal("1.5"), Decimal("0.000021"), when=created_at)
+        db.commit()
+    token = app.create_access_token({"sub": email})
+    return {
+        "user_id": user_id,
+        "address": address,
+        "jwt": {"Authorization": f"Bearer {token}"},
+        "api_key": {"Authorization": f"Bearer {api_key}"},
+    }
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Balances come from the chain; only the database work is under test
+    monkeypatch.setattr(app, "get_wallet_balances", lambda address, fresh=False: {"ETH": 1.0})
+    # Every request authenticates against the database rather than the caches
+    app.principal_cache.clear()
+    app.api.api_key_cache.clear()
+    return TestClient(app.app)
+
+
+def get(client, url, headers):
+    with captured() as statements:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.text
+    return response, statements
+
+
+def test_dashboard_uses_indexes(client, merchant):
+    response, statements = get(client, "/dashboard", merchant["jwt"])
+    assert response.json()["num_of_payments"] == 30
+    assert_no_scans(
+        statements,
+        "ix_wallets_user_id",
+        "ix_payments_user_id_created_at",
+        "ix_transactions_to_address_created_at",
+        "ix_transactions_from_address_created_at",
+    )
+    # Including the successful-volume SUM
+    assert any("sum(transactions.amount)" in statement for statement, _ in statements)
+
+
+def test_history_pages_use_address_indexes(client, merchant):
+    for url, indexes in (
+        ("/transactions/?limit=5&status=Successful", ("ix_transactions_to_address_created_at", "ix_transactions_from_address_created_at")),
+        ("/payments/?limit=5", ("ix_payments_receiver_address_created_at", "ix_payments_sender_address_created_at")),
+    ):
+        response, statements = get(client, url, merchant["jwt"])
+        cursor = response.json()["next_cursor"]
+        assert cursor
+        # The following page adds the keyset condition
+        _, more = get(client, f"{url}&cursor={cursor}", merchant["jwt"])
+        assert_no_scans(statements + more, *indexes)
+
+
+def test_export_uses_address_indexes(client, merchant):
+    for fmt in ("ndjson", "csv"):
+        response, statements = get(client, f"/transactions/export?format={fmt}&status=Successful", merchant["jwt"])
+        assert response.text
+        assert_no_scans(statements, "ix_transactions_to_address_created_at", "ix_transactions_from_address_created_at")
+
+
+def test_analytics_buckets_use_indexes(client, merchant):
+    response, statements = get(client, "/analytics?days=7", merchant["jwt"])
+    assert response.json()["daily"]
+    assert_no_scans(statements, "ix_analytics_user_id")
+
+
+def test_api_key_routes_use_indexes(client, merchant):
+    response, statements = get(client, f"/api/v1/transaction/to/{merchant['address']}?limit=5", merchant["api_key"])
+    assert response.json()
+    transaction_id = response.json()[0]["transaction_id"]
+    _, details = get(client, f"/api/v1/transaction/{transaction_id}", merchant["api_key"])
+    # The API key itself is looked up through its unique index
+    assert_no_scans(statements + details, "sqlite_autoindex_businesses", "ix_transactions_to_address_created_at")
+
+
+def test_webhook_outbox_claim_uses_status_index(merchant):
+    with SessionLocal() as db:
+        payment_id = db.query(Payment.payment_id).filter(Payment.user_id == merchant["user_id"]).first()[0]
+        webhooks.enqueue(db, payment_id, "http://127.0.0.1:9/hook", {"status": "Successful"})
+        db.commit()
+
+    with captured() as statements:
+        claimed = asyncio.run(webhooks.WebhookDispatcher()._claim(10))
+    assert claimed
+    assert_no_scans(statements, "ix_webhook_outbox_status_next_attempt_at")
+
+
+def test_watch_leases_use_indexes(merchant):
+    watcher = ChainWatcher(None)
+    watcher.start = lambda: None
+    watcher._start_backfill = lambda from_block, payment_ids: None
+    watcher._head, watcher._head_at = 100, float("inf")
+    with SessionLocal() as db:
+        payment_id = db.query(Payment.payment_id).filter(Payment.user_id == merchant["user_id"]).first()[0]
+        db.query(Payment).filter(Payment.payment_id == payment_id).update({"status": "Pending"})
+        watcher.open_watch(db, "checkout", payment_id, "0x" + "de" * 20, merchant["address"], 1, {})
+        # Left by a process that stopped, for this one to take over
+        db.flush()
+        db.query(PaymentWatch).filter(PaymentWatch.payment_id == payment_id).update({"owner": None, "lease_expires_at": None})
+        db.commit()
+
+    with captured() as statements:
+        watcher.acquire()
+        watcher.renew()
+    assert payment_id in watcher._leased
+    assert_no_scans(statements, "ix_payment_watches_lease_expires_at", "ix_payment_watches_owner")
@@ -0,0 +1,138 @@
+import time
+
+import pytest
+
+from rpc import ProviderPool
+from tests.stubs import StubNode
+
+
+@pytest.fixture
+def nodes():
+    started = []
+
+    def start(count, **handlers):
+        for i in range(count):
+            node = StubNode({
+                "eth_blockNumber": lambda params, i=i: hex(100 + i),
+                "eth_sendRawTransaction": lambda params: "0x" + "ab" * 32,
+                "eth_newBlockFilter": lambda params, i=i: f"0xf{i}",
+                "eth_getFilterChanges": lambda params, i=i: [f"from node {i}"],
+                **handlers,
+            }).start()
+            started.append(node)
+        return started[-count:]
+
+    yield start
+    for node in started:
+        node.stop()
+
+
+def pool(nodes, **kwargs):
+    return ProviderPool([node.url for node in nodes], **kwargs)
+
+
+def test_5xx_fails_over_to_the_next_endpoint(nodes):
+    down, up = nodes(2)
+    down.status = 503
+    rpc = pool([down, up], hedge_delay=5)
+
+    assert rpc.make_request("eth_blockNumber", [])["result"] == hex(101)
+    assert down.requests == 1
+    assert rpc.failovers == 1
+    assert rpc.endpoints[0].failures == 1
+
+
+def test_timeout_fails_over_to_the_next_endpoint(nodes):
+    slow, fast = nodes(2)
+    slow.delay = 1.0
+    rpc = pool([slow, fast], timeout=0.2, hedge_delay=5)
+
+    started = time.time()
+    assert rpc.make_request("eth_blockNumber", [])["result"] == hex(101)
+    assert time.time() - started < 0.9
+    assert rpc.failovers == 1
+    assert rpc.hedges == 0
+
+
+def test_hedged_read_takes_the_first_answer(nodes):
+    slow, fast = nodes(2)
+    slow.delay = 0.5
+    rpc = pool([slow, fast], hedge_delay=0.05)
+
+    started = time.time()
+    assert rpc.make_request("eth_blockNumber", [])["result"] == hex(101)
+    assert time.time() - started < 0.4
+    assert rpc.hedges == rpc.hedge_wins == 1
+    assert slow.requests == fast.requests == 1
+
+
+def test_breaker_ejects_and_readmits_an_endpoint(nodes):
+    flaky, steady = nodes(2)
+    flaky.status = 500
+    rpc = pool([flaky, steady], hedge_delay=5, breaker_threshold=2, breaker_cooldown=0.3)
+    endpoint = rpc.endpoints[0]
+
+    for _ in range(2):
+        # Both answered by the healthy node; the failing one is still tried first
+        assert rpc.make_request("eth_blockNumber", [])["result"] == hex(101)
+    assert endpoint.state(time.time()) == "open"
+    assert endpoint.ejections == 1
+
+    # Ejected: nothing is sent to it while it cools down
+    for _ in range(5):
+        rpc.make_request("eth_blockNumber", [])
+    assert flaky.requests == 2
+
+    flaky.status = 200
+    time.sleep(0.35)
+    assert endpoint.state(time.time()) == "half-open"
+    # The trial request goes to it and brings it back
+    assert rpc.make_request("eth_blockNumber", [])["result"] == hex(100)
+    assert endpoint.state(time.time()) == "closed"
+    assert flaky.requests == 3
+
+
+def test_filters_stay_on_the_node_that_created_them(nodes):
+    first, second = nodes(2)
+    rpc = pool([first, second])
+    filter_id = rpc.make_request("eth_newBlockFilter", [])["result"]
+    assert filter_id == "0xf0"
+
+    # The other node is now the faster one, but only the first knows the filter
+    rpc.endpoints[0].latency, rpc.endpoints[1].latency = 1.0, 0.001
+    for _ in range(3):
+        assert rpc.make_request("eth_getFilterChanges", [filter_id])["result"] == ["from node 0"]
+    assert first.calls["eth_getFilterChanges"] == 3
+    assert second.calls["eth_getFilterChanges"] == 0
+
+    rpc.make_request("eth_uninstallFilter", [filter_id])
+    assert rpc.stats()["filters"] == 0
+
+
+def test_abandoned_filters_are_forgotten(nodes):
+    node, = nodes(1)
+    rpc = pool([node], filter_ttl=0.2)
+    polled = rpc.make_request("eth_newBlockFilter", [])["result"]
+    rpc._filters.set("0xabandoned", rpc.endpoints[0])
+    for _ in range(3):
+        time.sleep(0.1)
+        rpc.make_request("eth_getFilterChanges", [polled])
+
+    # Still polled, so still routed; the one nobody polled has expired
+    assert rpc._filters.get(polled) is rpc.endpoints[0]
+    assert rpc._filters.get("0xabandoned") is None
+
+
+def test_writes_are_never_hedged(nodes):
+    slow, fast = nodes(2)
+    slow.delay = 0.3
+    rpc = pool([slow, fast], hedge_delay=0.05)
+
+    assert rpc.make_request("eth_sendRawTransaction", ["0x00"])["result"] == "0x" + "ab" * 32
+    assert fast.requests == 0
+    # Now measured as slow, so the next goes to the other node first; still only there
+    slow.delay, fast.delay = 0, 0.3
+    rpc.make_batch_request([("eth_blockNumber", []), ("eth_sendRawTransaction", ["0x00"])])
+
+    assert rpc.hedges == 0
+    assert slow.calls["eth_sendRawTransaction"] == fast.calls["eth_sendRawTransaction"] == 1
@@ -0,0 +1,143 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from web3 import HTTPProvider, Web3
+
+from sender import NonceManager, ReceiptTracker
+from tests.stubs import StubNode
+
+
+WALLET = Web3.to_checksum_address("0x" + "ab" * 20)
+OTHER = Web3.to_checksum_address("0x" + "cd" * 20)
+
+
+class Node:
+    """Pending nonces per address, counting how often they are read."""
+
+    def __init__(self, **pending):
+        self.pending = {WALLET: 0, OTHER: 0, **pending}
+        self.reads = 0
+        self.eth = SimpleNamespace(get_transaction_count=self.get_transaction_count)
+
+    def get_transaction_count(self, address, block_identifier):
+        assert block_identifier == "pending"
+        self.reads += 1
+        return self.pending[address]
+
+
+def test_reservations_count_up_from_one_node_read():
+    node = Node(**{WALLET: 7})
+    nonces = NonceManager(node)
+    with nonces.reserve(WALLET, count=3) as first:
+        assert first == 7
+    with nonces.reserve(WALLET.lower()) as second:
+        assert second == 10
+    with nonces.reserve(OTHER) as other:
+        assert other == 0
+    assert node.reads == nonces.resyncs == 2
+
+
+def test_floor_skips_nonces_already_signed():
+    node = Node(**{WALLET: 3})
+    nonces = NonceManager(node)
+    # 3..5 are signed and stored, but the node hasn't seen them yet
+    with nonces.reserve(WALLET, count=2, floor=6) as first:
+        assert first == 6
+    with nonces.reserve(WALLET, floor=4) as second:
+        assert second == 8
+
+
+def test_failed_send_drops_the_counter():
+    node = Node()
+    nonces = NonceManager(node)
+    with pytest.raises(ValueError):
+        with nonces.reserve(WALLET, count=2):
+            raise ValueError("nonce too low")
+    node.pending[WALLET] = 5
+    with nonces.reserve(WALLET) as nonce:
+        assert nonce == 5
+    assert node.reads == 2
+
+
+def test_resync_reads_the_node_again():
+    node = Node()
+    nonces = NonceManager(node)
+    with nonces.reserve(WALLET):
+        pass
+    node.pending[WALLET] = 4
+    nonces.resync(WALLET)
+    with nonces.reserve(WALLET) as nonce:
+        assert nonce == 4
+
+
+def test_concurrent_reservations_never_share_a_nonce():
+    nonces = NonceManager(Node())
+    handed_out = []
+
+    def send():
+        for _ in range(20):
+            with nonces.reserve(WALLET) as nonce:
+                # Held while "signing and sending", so the next caller waits
+                time.sleep(0.0005)
+                handed_out.append(nonce)
+
+    threads = [threading.Thread(target=send) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # In order, too: each wallet's sends go out one after another
+    assert handed_out == list(range(80))
+
+
+def raw_receipt(tx_hash, **fields):
+    receipt = {
+        "transactionHash": tx_hash, "blockHash": "0x" + "00" * 32, "blockNumber": "0x64", "from": WALLET, "to": OTHER,
+        "gasUsed": hex(21000), "cumulativeGasUsed": hex(21000), "effectiveGasPrice": hex(10**9), "status": "0x1",
+    }
+    receipt.update(fields)
+    return {key: value for key, value in receipt.items() if value is not None}
+
+
+@pytest.fixture
+def receipts():
+    served = {}
+    node = StubNode({
+        "eth_getTransactionReceipt": lambda params: served.get(params[0]),
+        "eth_getTransactionByHash": lambda params: {
+            "hash": params[0], "from": WALLET, "to": OTHER, "value": "0x1", "gas": hex(21000), "gasPrice": hex(3 * 10**9),
+            "nonce": "0x0", "input": "0x", "blockNumber": "0x64", "blockHash": "0x" + "00" * 32, "transactionIndex": "0x0",
+        },
+    }).start()
+    tracker = ReceiptTracker(Web3(HTTPProvider(node.url)), poll_interval=0.05, timeout=1)
+    yield served, tracker, node
+    node.stop()
+
+
+def test_receipt_without_effective_gas_price(receipts):
+    served, tracker, node = receipts
+    current, legacy, oldest = ("0x" + digit * 64 for digit in "123")
+    served[current] = raw_receipt(current)
+    served[legacy] = raw_receipt(legacy, effectiveGasPrice=None, gasPrice=hex(2 * 10**9))
+    served[oldest] = raw_receipt(oldest, effectiveGasPrice=None)
+    futures = [tracker.track(tx_hash) for tx_hash in (current, legacy, oldest)]
+
+    assert [future.result(5)["effectiveGasPrice"] for future in futures] == [10**9, 2 * 10**9, 3 * 10**9]
+    # Only the receipt without either price needed its transaction
+    assert node.calls["eth_getTransactionByHash"] == 1
+
+
+def test_unreadable_receipt_does_not_hold_up_the_batch(receipts):
+    served, tracker, node = receipts
+    broken, good = "0x" + "4" * 64, "0x" + "5" * 64
+    served[broken] = raw_receipt(broken, blockNumber=None)
+    served[good] = raw_receipt(good)
+    broken_future, good_future = tracker.track(broken), tracker.track(good)
+
+    assert good_future.result(5)["status"] == 1
+    assert not broken_future.done()
+    # It still gives up at the deadline rather than being polled forever
+    assert broken_future.result(5) is None
+    assert tracker.stats() == {"pending": 0, "confirmed": 1, "timed_out": 1}
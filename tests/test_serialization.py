@@ -0,0 +1,33 @@
+import uuid
+from decimal import Decimal
+
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+import app
+from database import SessionLocal
+from models import Business, Transaction, Wallet
+from serialization import dumps, to_dict
+
+
+def test_decimals_are_exact_strings():
+    assert dumps({"amount": Decimal("1.50000000"), "fee": Decimal("0.00000001")}) == b'{"amount":"1.50000000","fee":"1E-8"}'
+
+
+def test_transaction_details_match_the_response_model_encoding(database):
+    user_id, api_key, address = str(uuid.uuid4()), uuid.uuid4().hex, "0x" + uuid.uuid4().hex[:20] * 2
+    transaction_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(Business(user_id=user_id, email=f"{user_id}@example.com", business_name="Wire", password_hash="x", api_key=api_key))
+        db.add(Wallet(wallet_id=str(uuid.uuid4()), user_id=user_id, address=address, private_key="0x" + "11" * 32))
+        db.add(Transaction(transaction_id=transaction_id, payment_id=str(uuid.uuid4()), from_address="0x" + "de" * 20, to_address=address,
+                           amount=Decimal("1.5"), gas_fee=Decimal("0.000021"), status="Successful", transaction_hash="0x" + "ab" * 32))
+        db.commit()
+        row = db.get(Transaction, transaction_id)
+        # What the route sent when it went through `response_model=dict`
+        expected = TypeAdapter(dict).dump_python(to_dict(row), mode="json")
+
+    response = TestClient(app.app).get(f"/api/v1/transaction/{transaction_id}", headers={"Authorization": f"Bearer {api_key}"})
+    assert response.status_code == 200, response.text
+    assert response.json() == expected
+    assert response.json()["amount"] == "1.50000000"
@@ -0,0 +1,83 @@
+import pytest
+from web3 import HTTPProvider, Web3
+
+from tests.stubs import RPCError, TokenChain
+from tokens import MULTICALL3_ADDRESS, TokenBalanceReader
+
+WALLETS = [Web3.to_checksum_address("0x" + "%02x" % (100 + i) * 20) for i in range(5)]
+TOKENS = {f"T{i}": Web3.to_checksum_address("0x" + "%02x" % (i + 1) * 20) for i in range(20)}
+
+
+@pytest.fixture
+def chain():
+    chain = TokenChain(MULTICALL3_ADDRESS)
+    for i, address in enumerate(TOKENS.values()):
+        holders = chain.add_token(address, decimals=6 + i)
+        for j, wallet in enumerate(WALLETS):
+            holders[wallet.lower()] = (j + 1) * 10 ** (6 + i)
+    for j, wallet in enumerate(WALLETS):
+        chain.balances[wallet.lower()] = (j + 1) * 10**18
+    chain.start()
+    yield chain
+    chain.stop()
+
+
+def expected(wallets):
+    return {
+        wallet: {"wei": (j + 1) * 10**18, "tokens": {symbol: float(j + 1) for symbol in TOKENS}}
+        for j, wallet in enumerate(WALLETS) if wallet in wallets
+    }
+
+
+def test_every_wallet_and_token_in_one_request(chain):
+    reader = TokenBalanceReader(Web3(HTTPProvider(chain.url)), TOKENS)
+    assert reader.balances(WALLETS, 100) == expected(WALLETS)
+    assert chain.node.requests == 1
+    assert chain.node.calls == {"eth_call": 1}
+
+
+def test_decimals_are_read_once(chain):
+    reader = TokenBalanceReader(Web3(HTTPProvider(chain.url)), TOKENS)
+    first = reader.balances(WALLETS[:1], 100)
+    second = reader.balances(WALLETS[:1], 100)
+
+    assert first == second == expected(WALLETS[:1])
+    assert chain.node.requests == 2
+    assert chain.decimals_calls == len(TOKENS)
+
+
+def test_token_without_a_contract_is_none(chain):
+    reader = TokenBalanceReader(Web3(HTTPProvider(chain.url)), {"BAD": "0x" + "ee" * 20, "T0": TOKENS["T0"]})
+    assert reader.balances(WALLETS[:1]) == {WALLETS[0]: {"wei": 10**18, "tokens": {"BAD": None, "T0": 1.0}}}
+
+
+def test_json_rpc_batch_without_multicall(chain):
+    chain.multicall_deployed = False
+    reader = TokenBalanceReader(Web3(HTTPProvider(chain.url)), TOKENS)
+    first = reader.balances(WALLETS[:2], 100)
+    chain.node.reset_counters()
+    second = reader.balances(WALLETS[:2], 100)
+
+    assert first == second == expected(WALLETS[:2])
+    # Multicall3 isn't tried again once it's known to be missing
+    assert chain.node.requests == chain.node.batches == 1
+    assert chain.node.calls == {"eth_getBalance": 2, "eth_call": 2 * len(TOKENS)}
+    assert chain.decimals_calls == len(TOKENS)
+
+
+def test_failed_native_balance_is_read_again(chain):
+    chain.multicall_deployed = False
+    reader = TokenBalanceReader(Web3(HTTPProvider(chain.url)), TOKENS)
+    failed = []
+
+    def get_balance(params):
+        # Fails inside the batch only
+        if not failed:
+            failed.append(params[0])
+            raise RPCError("header not found")
+        return hex(chain.balances[params[0].lower()])
+
+    chain.node.handlers["eth_getBalance"] = get_balance
+    assert reader.balances(WALLETS[:2], 100) == expected(WALLETS[:2])
+    assert failed == [WALLETS[0]]
+    assert chain.node.calls["eth_getBalance"] == 3
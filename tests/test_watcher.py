@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from hexbytes import HexBytes
+
+from database import SessionLocal
+from models import Payment, PaymentWatch
+from tests.stubs import StubWebSocketNode
+from watcher import AsyncChainWatcher, ChainWatcher, Watch
+
+
+SENDER = "0x" + "11" * 20
+RECEIVER = "0x" + "22" * 20
+
+
+async def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def async_watcher():
+    watcher = AsyncChainWatcher(None, "ws://127.0.0.1:9", "http://127.0.0.1:9")
+    runs = []
+
+    async def run():
+        runs.append(threading.current_thread().name)
+        await asyncio.Event().wait()
+
+    watcher.run = run
+    return watcher, runs
+
+
+def test_async_watcher_runs_once_on_the_app_loop():
+    watcher, runs = async_watcher()
+
+    # A watch opened before the app started waits for astart instead of starting a loop of its own
+    watcher.start()
+    assert watcher._thread is None
+
+    async def app():
+        await watcher.astart()
+        # Resuming watches in the threadpool starts the watcher again
+        await asyncio.gather(*(asyncio.to_thread(watcher.start) for _ in range(5)))
+        await asyncio.sleep(0.05)
+        await watcher.astop()
+
+    asyncio.run(app())
+    assert runs == [threading.main_thread().name]
+
+    # Settlements finishing after shutdown don't bring it back either
+    watcher.start()
+    assert watcher._thread is None
+    assert len(runs) == 1
+
+
+def test_websocket_pending_hashes_are_looked_up_in_batches():
+    transactions = {}
+    for i in range(200):
+        tx_hash = "0x%064x" % i
+        transactions[tx_hash] = {
+            "hash": tx_hash,
+            "from": SENDER if i == 150 else "0x" + "33" * 20,
+            "to": RECEIVER,
+            "value": hex(10**18),
+            "blockNumber": None,
+        }
+    node = StubWebSocketNode({"eth_getTransactionByHash": lambda params: transactions.get(params[0])}).start()
+    watcher = AsyncChainWatcher(None, node.url, "http://127.0.0.1:9")
+    watcher.index.add(Watch("payment-1", SENDER, RECEIVER, 1, callback=None))
+    # Still open after the first one matches, so the rest keep being looked up
+    watcher.index.add(Watch("payment-2", RECEIVER, SENDER, 1, callback=None))
+
+    async def app():
+        await watcher.astart()
+        await wait_for(lambda: "newPendingTransactions" in node.subscriptions)
+        await asyncio.to_thread(lambda: [node.push("newPendingTransactions", tx_hash) for tx_hash in transactions])
+        await wait_for(lambda: node.calls["eth_getTransactionByHash"] == len(transactions) and watcher._confirming)
+        await watcher.astop()
+
+    try:
+        asyncio.run(app())
+    finally:
+        node.stop()
+
+    assert list(watcher._confirming) == [HexBytes("0x%064x" % 150)]
+    # A window's worth of hashes per batch rather than one request each
+    assert node.batches < 20
+    assert node.requests - node.batches == 2  # the two eth_subscribe calls
+
+
+def test_renew_leaves_a_watch_being_opened_alone(database):
+    watcher = ChainWatcher(None)
+    watcher.start = lambda: None
+    watcher._head, watcher._head_at = 100, float("inf")
+    payment_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(Payment(payment_id=payment_id, user_id="merchant", receiver_address=RECEIVER, amount=1))
+        db.commit()
+
+    with SessionLocal() as db:
+        row = watcher.open_watch(db, "checkout", payment_id, SENDER, RECEIVER, 1, {})
+        # Heartbeats land before the caller commits, and between its commit and track
+        watcher.renew()
+        db.commit()
+        watcher.renew()
+        watcher.track(row)
+    watcher.renew()
+
+    assert payment_id in watcher._leased
+    assert watcher.index.get(payment_id) is not None
+    with SessionLocal() as db:
+        assert db.get(PaymentWatch, payment_id).owner == watcher.owner
+
+
+def test_resumed_payload_encodes_amounts_like_the_api(database):
+    watcher = ChainWatcher(None)
+    watcher._head, watcher._head_at = 100, float("inf")
+    payment_id = str(uuid.uuid4())
+    with SessionLocal() as db:
+        db.add(Payment(payment_id=payment_id, user_id="merchant", receiver_address=RECEIVER, amount=Decimal("1.5")))
+        watcher.open_watch(db, "checkout", payment_id, SENDER, RECEIVER, Decimal("1.5"), {"payment_id": payment_id, "amount": Decimal("1.5")})
+        db.commit()
+
+    with SessionLocal() as db:
+        watch = watcher._watch_from_row(db.get(PaymentWatch, payment_id))
+    # The payload handed to the settlement handler after a restart, as REST would return it
+    assert watch.callback.args[2] == {"payment_id": payment_id, "amount": "1.5"}
+
@@ -0,0 +1,73 @@
+import asyncio
+import time
+import uuid
+
+import webhooks
+from database import SessionLocal, async_engine
+from models import WebhookOutbox
+from tests.stubs import StubReceiver
+
+
+def queue(urls):
+    with SessionLocal() as db:
+        for url in urls:
+            webhooks.enqueue(db, str(uuid.uuid4()), url, {"status": "Successful"})
+        db.commit()
+
+
+def rows(urls):
+    with SessionLocal() as db:
+        return {row.url: row for row in db.query(WebhookOutbox).filter(WebhookOutbox.url.in_(urls))}
+
+
+def deliver(dispatcher, urls, timeout=10):
+    """Run `dispatcher` until every webhook for `urls` has had an attempt."""
+
+    async def run():
+        await dispatcher.start()
+        try:
+            deadline = time.time() + timeout
+            while not all(row.attempts for row in rows(urls).values()):
+                assert time.time() < deadline, "timed out"
+                await asyncio.sleep(0.05)
+        finally:
+            await dispatcher.stop()
+            await async_engine.dispose()
+
+    asyncio.run(run())
+    return rows(urls)
+
+
+def test_every_failed_attempt_is_recorded(database, monkeypatch):
+    receiver = StubReceiver(slow_delay=2).start()
+    run = uuid.uuid4().hex
+    urls = {name: f"{receiver.url}/{name}/{run}" for name in ("ok", "fail", "slow", "broken")}
+    queue(urls.values())
+    dispatcher = webhooks.WebhookDispatcher(timeout=0.5, base_delay=60, poll_interval=0.05)
+
+    # Something other than a network error going wrong inside the request
+    async def start():
+        await webhooks.WebhookDispatcher.start(dispatcher)
+        post = dispatcher._session.post
+
+        def broken_post(url, **kwargs):
+            if "/broken/" in url:
+                raise RuntimeError("request could not be built")
+            return post(url, **kwargs)
+
+        monkeypatch.setattr(dispatcher._session, "post", broken_post)
+
+    dispatcher.start = start
+    try:
+        result = deliver(dispatcher, list(urls.values()))
+    finally:
+        receiver.stop()
+
+    assert result[urls["ok"]].status == webhooks.DELIVERED
+    for name, error in (("fail", "HTTP 500"), ("slow", "TimeoutError"), ("broken", "RuntimeError")):
+        row = result[urls[name]]
+        assert (row.status, row.attempts) == (webhooks.PENDING, 1), name
+        assert error in row.last_error, name
+    # Retried with backoff rather than when the claim times out
+    assert dispatcher.retried == 3
+    assert not dispatcher._host_load
@@ -0,0 +1,151 @@
+"""
+ERC-20 and native balances for one or many wallets in a single RPC call.
+
+Every `balanceOf` and `getEthBalance` for the requested wallets goes into one
+Multicall3 `aggregate3` eth_call, so adding tokens doesn't add round trips.
+Token decimals never change; they are read once, in the same call, and kept
+for the life of the process. On chains without Multicall3 at
+MULTICALL3_ADDRESS the same reads are sent as one JSON-RPC batch instead.
+
+Tokens are configured with TOKEN_CONTRACTS, e.g. `USDC=0x8335...,DAI=0x50c5...`.
+"""
+import os
+import threading
+
+from eth_abi import decode, encode
+from web3 import Web3
+
+
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+# USDC on Base mainnet
+DEFAULT_TOKEN_CONTRACTS = "USDC=0x833589fCD6eDb6E08f4c7C32D4f71b54bdA02913"
+
+AGGREGATE3 = bytes.fromhex("82ad56cb")
+GET_ETH_BALANCE = bytes.fromhex("4d2301cc")
+BALANCE_OF = bytes.fromhex("70a08231")
+DECIMALS = bytes.fromhex("313ce567")
+
+
+def parse_token_contracts(value):
+    """`SYMBOL=address,...` -> {symbol: checksum address}"""
+    tokens = {}
+    for item in value.split(","):
+        if item.strip():
+            symbol, address = item.split("=", 1)
+            tokens[symbol.strip()] = Web3.to_checksum_address(address.strip())
+    return tokens
+
+
+TOKEN_CONTRACTS = parse_token_contracts(os.getenv("TOKEN_CONTRACTS", DEFAULT_TOKEN_CONTRACTS))
+
+
+def _address_arg(address):
+    return encode(["address"], [address])
+
+
+def _block_param(block_identifier):
+    return hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+
+
+def _uint(data):
+    return decode(["uint256"], data)[0] if len(data) >= 32 else None
+
+
+class TokenBalanceReader:
+    def __init__(self, w3, tokens=TOKEN_CONTRACTS, multicall_address=MULTICALL3_ADDRESS):
+        self.w3 = w3
+        self.tokens = dict(tokens)
+        self.multicall_address = Web3.to_checksum_address(multicall_address)
+        # token address -> decimals; fixed for a deployed token, so never expired
+        self._decimals = {}
+        self._lock = threading.Lock()
+        # None until the first call tells us whether Multicall3 is deployed
+        self._multicall = None
+
+    def balances(self, wallets, block_identifier="latest"):
+        """
+        {wallet: {"wei": native balance, "tokens": {symbol: balance}}} for
+        every wallet, all read at the same block. A token whose call fails is
+        reported as None; a native balance whose call fails is read again on
+        its own, so "wei" is always a number.
+        """
+        wallets = list(wallets)
+        if not self.tokens:
+            # Nothing to aggregate, a plain eth_getBalance is cheaper
+            return {
+                wallet: {"wei": self.w3.eth.get_balance(wallet, block_identifier=block_identifier), "tokens": {}}
+                for wallet in wallets
+            }
+
+        with self._lock:
+            missing = [address for address in self.tokens.values() if address not in self._decimals]
+
+        # (target, calldata) in result order: decimals first, then per wallet native + each token
+        calls = [(address, DECIMALS) for address in missing]
+        for wallet in wallets:
+            calls.append((self.multicall_address, GET_ETH_BALANCE + _address_arg(wallet)))
+            calls.extend((address, BALANCE_OF + _address_arg(wallet)) for address in self.tokens.values())
+
+        if self._multicall is not False:
+            results = self._aggregate(calls, block_identifier)
+            if results is None:
+                print(f"No Multicall3 at {self.multicall_address}, falling back to JSON-RPC batches")
+                self._multicall = False
+            else:
+                self._multicall = True
+        if self._multicall is False:
+            results = self._batch(calls, block_identifier)
+
+        results = iter(results)
+        with self._lock:
+            for address in missing:
+                decimals = _uint(next(results))
+                if decimals is not None:
+                    self._decimals[address] = decimals
+            decimals = dict(self._decimals)
+
+        snapshot = {}
+        for wallet in wallets:
+            wei = _uint(next(results))
+            if wei is None:
+                # One request of the batch failed; the node answers it or raises, callers can't use a missing balance
+                wei = self.w3.eth.get_balance(wallet, block_identifier=block_identifier)
+            tokens = {}
+            for symbol, address in self.tokens.items():
+                raw = _uint(next(results))
+                tokens[symbol] = None if raw is None or address not in decimals else raw / 10 ** decimals[address]
+            snapshot[wallet] = {"wei": wei, "tokens": tokens}
+        return snapshot
+
+    def _aggregate(self, calls, block_identifier):
+        """Return data of each call (b"" where it failed), or None when Multicall3 isn't deployed."""
+        data = AGGREGATE3 + encode(["(address,bool,bytes)[]"], [[(target, True, calldata) for target, calldata in calls]])
+        # Straight to the provider: web3's request validation would add two eth_chainId round trips
+        response = self.w3.provider.make_request("eth_call", [{"to": self.multicall_address, "data": "0x" + data.hex()}, _block_param(block_identifier)])
+        if "error" in response:
+            raise ValueError(f"Multicall3 aggregate3 failed: {response['error']}")
+        output = bytes.fromhex(response["result"][2:])
+        if not output:
+            return None
+        return [returned if success else b"" for success, returned in decode(["(bool,bytes)[]"], output)[0]]
+
+    def _batch(self, calls, block_identifier):
+        block = _block_param(block_identifier)
+        requests = []
+        for target, calldata in calls:
+            if target == self.multicall_address:
+                # getEthBalance(wallet) becomes a plain eth_getBalance
+                requests.append(("eth_getBalance", [decode(["address"], calldata[4:])[0], block]))
+            else:
+                requests.append(("eth_call", [{"to": target, "data": "0x" + calldata.hex()}, block]))
+
+        results = []
+        for (method, _), response in zip(requests, self.w3.provider.make_batch_request(requests)):
+            value = response.get("result")
+            if not value or value == "0x":
+                results.append(b"")
+            elif method == "eth_getBalance":
+                results.append(encode(["uint256"], [int(value, 16)]))
+            else:
+                results.append(bytes.fromhex(value[2:]))
+        return results
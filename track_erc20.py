@@ -1,7 +1,11 @@
+import os
+
 from web3 import Web3
 
-# Connect to Neo X node
-w3 = Web3(Web3.HTTPProvider("https://neoxt4seed1.ngd.network"))
+from rpc import ProviderPool, parse_rpc_urls
+
+# Connect to Neo X nodes; list more seeds in NEOX_RPC_URLS to fail over between them
+w3 = Web3(ProviderPool(parse_rpc_urls(os.getenv("NEOX_RPC_URLS", "https://neoxt4seed1.ngd.network"))))
 
 # ERC-20 Token contract address and Transfer event signature
 token_contract_address = '0xYourTokenContractAddress'  # Replace with the actual token contract address
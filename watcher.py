@@ -0,0 +1,737 @@
+"""
+Shared chain watcher.
+
+A single watcher per process pulls new transactions from the chain and
+dispatches them against an in-memory index of every open payment, so the
+RPC cost of watching payments stays flat no matter how many are open.
+
+Payments opened with `open_watch` are also recorded in the payment_watches
+table. On startup `resume` loads them back into the index and scans the
+blocks mined since each watch started, so a deploy or crash doesn't leave
+payments Pending forever. Settlement for a durable watch goes through the
+handler registered for its kind with `register_handler`.
+
+Every uvicorn worker and host runs its own watcher. Each durable watch is
+leased to one of them; the owner renews its leases on a heartbeat, and a
+lease that lapses because its owner died is taken over by another process.
+"""
+import asyncio
+import heapq
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from hexbytes import HexBytes
+from sqlalchemy import or_, select, update
+from web3 import AsyncWeb3, AsyncHTTPProvider
+from web3.providers.persistent import WebSocketProvider
+
+import monitor
+from cache import TTLCache
+from database import session_scope
+from models import Payment, PaymentWatch, WatcherCheckpoint
+from serialization import dumps
+from xenon import ws_url, balance_cache
+
+
+DEFAULT_TIMEOUT = 60 * 10
+# Seconds a watch stays leased to a process without a heartbeat
+WATCH_LEASE_TTL = int(os.getenv("WATCH_LEASE_TTL", "30"))
+# Durable watches one process will hold at once
+WATCH_CAPACITY = int(os.getenv("WATCH_CAPACITY", "10000"))
+# Seconds pending hashes from the websocket are collected before they are looked up in one batch
+WS_BATCH_WINDOW = float(os.getenv("WS_BATCH_WINDOW", "0.05"))
+
+# kind -> handler(payload, result) settling a durable watch
+_handlers = {}
+
+
+def register_handler(kind, handler):
+    """Settle durable watches of `kind` with `handler(payload, result)`; result is False on timeout."""
+    _handlers[kind] = handler
+
+
+def close_watch(db, payment_id):
+    """Delete a payment's durable watch as part of the caller's settlement transaction."""
+    db.query(PaymentWatch).filter(PaymentWatch.payment_id == payment_id).delete(synchronize_session=False)
+
+
+class Watch:
+    """An open payment waiting for a matching transaction on chain."""
+
+    def __init__(self, payment_id, sender_address, receiver_address, amount, callback, timeout=DEFAULT_TIMEOUT, deadline=None, start_block=None):
+        self.payment_id = payment_id
+        self.sender = sender_address.lower()
+        self.receiver = receiver_address.lower()
+        self.amount = amount
+        self.callback = callback
+        self.deadline = deadline if deadline is not None else time.time() + timeout
+        # Transactions mined before this block can't pay for this watch
+        self.start_block = start_block
+        self.cancelled = False
+
+    @property
+    def key(self):
+        return (self.sender, self.receiver)
+
+
+class PaymentIndex:
+    """Open payments keyed by (sender, receiver) with O(1) add and remove."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_key = {}
+        self._receivers = {}
+        self._deadlines = []
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def add(self, watch):
+        with self._lock:
+            self._remove(watch.payment_id)
+            self._by_id[watch.payment_id] = watch
+            self._by_key.setdefault(watch.key, {})[watch.payment_id] = watch
+            self._receivers[watch.receiver] = self._receivers.get(watch.receiver, 0) + 1
+            heapq.heappush(self._deadlines, (watch.deadline, watch.payment_id))
+
+    def remove(self, payment_id):
+        with self._lock:
+            return self._remove(payment_id)
+
+    def get(self, payment_id):
+        return self._by_id.get(payment_id)
+
+    def receivers(self):
+        """Snapshot of the lowercase receiver addresses with an open payment."""
+        with self._lock:
+            return set(self._receivers)
+
+    def match(self, sender_address, receiver_address, block_number=None):
+        """Claim the oldest open payment from sender to receiver, if any, that a transaction mined in `block_number` could pay."""
+        if not sender_address or not receiver_address:
+            return None
+        key = (sender_address.lower(), receiver_address.lower())
+        with self._lock:
+            bucket = self._by_key.get(key)
+            if not bucket:
+                return None
+            for payment_id, watch in bucket.items():
+                if block_number is None or watch.start_block is None or watch.start_block <= block_number:
+                    return self._remove(payment_id)
+            return None
+
+    def pop_expired(self, now):
+        """Remove and return every watch whose deadline has passed."""
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, payment_id = heapq.heappop(self._deadlines)
+                watch = self._by_id.get(payment_id)
+                # Entries left behind by cancelled or re-registered watches are skipped
+                if watch is not None and watch.deadline == deadline:
+                    expired.append(self._remove(payment_id))
+        return expired
+
+    def _remove(self, payment_id):
+        watch = self._by_id.pop(payment_id, None)
+        if watch is None:
+            return None
+        bucket = self._by_key.get(watch.key)
+        if bucket is not None:
+            bucket.pop(payment_id, None)
+            if not bucket:
+                del self._by_key[watch.key]
+        self._receivers[watch.receiver] -= 1
+        if not self._receivers[watch.receiver]:
+            del self._receivers[watch.receiver]
+        return watch
+
+
+class ChainWatcher:
+    """
+    Long-lived watcher that polls one pending filter for the whole process.
+    Matched payments are confirmed against their receipt and then handed to
+    the payment's callback with the same result `monitor_transactions` returns.
+    """
+
+    def __init__(self, w3, poll_interval=1.0, callback_workers=5, lease_ttl=WATCH_LEASE_TTL, capacity=WATCH_CAPACITY):
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self.capacity = capacity
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Durable watches this process holds a lease on
+        self._leased = set()
+        # payment id -> time.time() of watches opened but not yet tracked; their callers may not have committed
+        self._opening = {}
+        self._lease_thread = None
+        self.index = PaymentIndex()
+        self._confirming = {}
+        self._filter_id = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._callbacks = ThreadPoolExecutor(max_workers=callback_workers, thread_name_prefix="settlement")
+        # Transactions already matched, so a backfill and the live feed can't both claim one
+        self._claimed = TTLCache(maxsize=100000, ttl=DEFAULT_TIMEOUT * 2)
+        self._head = None
+        self._head_at = 0.0
+
+    def register(self, payment_id, sender_address, receiver_address, amount, callback, timeout=DEFAULT_TIMEOUT):
+        """Start watching a payment. Registering the same payment again replaces its watch."""
+        # Like durable watches, only transfers mined from the current head on can pay it
+        watch = Watch(payment_id, sender_address, receiver_address, amount, callback, timeout, start_block=self.head_block())
+        self.index.add(watch)
+        self.start()
+        return watch
+
+    def open_watch(self, db, kind, payment_id, sender_address, receiver_address, amount, payload, timeout=DEFAULT_TIMEOUT):
+        """
+        Record a durable watch in `db` without committing it, replacing any
+        earlier watch for the payment. Once the caller has committed, pass the
+        returned row to `track` to start watching.
+        """
+        # Leased once tracked; until then renew neither drops nor gives it back
+        self._opening[payment_id] = time.time()
+        return db.merge(PaymentWatch(
+            payment_id=payment_id,
+            kind=kind,
+            sender_address=sender_address,
+            receiver_address=receiver_address,
+            amount=amount,
+            # Encoded like API responses, so a Decimal amount comes back a number and not a string
+            payload=dumps(payload).decode(),
+            start_block=self.head_block(),
+            deadline=datetime.utcnow() + timedelta(seconds=timeout),
+            owner=self.owner,
+            lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_ttl),
+        ))
+
+    def track(self, row):
+        """Start watching a committed durable watch."""
+        # Leased before it stops being "opening", so renew always sees it as one or the other
+        self._leased.add(row.payment_id)
+        self._opening.pop(row.payment_id, None)
+        self.index.add(self._watch_from_row(row))
+        self.start()
+
+    def resume(self):
+        """
+        Take over durable watches nobody holds a lease on, e.g. after a
+        restart, and keep doing so on a heartbeat. Watches whose deadline
+        passed while nothing was watching settle as failed on the next poll;
+        the rest are matched against every block mined since they started.
+        """
+        resumed = self.acquire()
+        print(f"Resumed {resumed} payment watches")
+        if self._lease_thread is None or not self._lease_thread.is_alive():
+            self._lease_thread = threading.Thread(target=self._heartbeat, name="watch-leases", daemon=True)
+            self._lease_thread.start()
+        return resumed
+
+    def acquire(self):
+        """Lease unowned or expired watches, up to this process's capacity, and start watching them."""
+        room = self.capacity - len(self._leased)
+        if room <= 0:
+            return 0
+        now = datetime.utcnow()
+        lease = {"owner": self.owner, "lease_expires_at": now + timedelta(seconds=self.lease_ttl)}
+        available = or_(PaymentWatch.lease_expires_at.is_(None), PaymentWatch.lease_expires_at < now)
+        candidates = select(PaymentWatch.payment_id).where(available).order_by(PaymentWatch.deadline).limit(room)
+        with session_scope() as db:
+            if db.get_bind().dialect.name == "postgresql":
+                # Rows another process is claiming right now are skipped rather than waited on
+                payment_ids = db.scalars(candidates.with_for_update(skip_locked=True)).all()
+                if payment_ids:
+                    db.execute(update(PaymentWatch).where(PaymentWatch.payment_id.in_(payment_ids)).values(**lease))
+            else:
+                # No row locks on SQLite; claim each row with a compare-and-set on its lease instead
+                payment_ids = [
+                    payment_id for payment_id in db.scalars(candidates).all()
+                    if db.execute(
+                        update(PaymentWatch).where(PaymentWatch.payment_id == payment_id, available).values(**lease)
+                    ).rowcount == 1
+                ]
+            db.commit()
+
+            rows = []
+            for i in range(0, len(payment_ids), 500):
+                rows += (
+                    db.query(PaymentWatch, Payment.status)
+                    .join(Payment, Payment.payment_id == PaymentWatch.payment_id)
+                    .filter(PaymentWatch.payment_id.in_(payment_ids[i:i + 500]))
+                    .all()
+                )
+            settled = [row.payment_id for row, status in rows if status != "Pending"]
+            if settled:
+                # Settlement finished but the previous owner stopped before closing the watch
+                db.query(PaymentWatch).filter(PaymentWatch.payment_id.in_(settled)).delete(synchronize_session=False)
+            acquired = [self._watch_from_row(row) for row, status in rows if status == "Pending"]
+
+        for watch in acquired:
+            self._leased.add(watch.payment_id)
+            self.index.add(watch)
+        start_blocks = [watch.start_block for watch in acquired if watch.start_block is not None and watch.deadline > time.time()]
+        if start_blocks:
+            self._start_backfill(min(start_blocks), {watch.payment_id for watch in acquired})
+        if acquired:
+            self.start()
+        return len(acquired)
+
+    def renew(self):
+        """
+        Extend every lease this process holds, stop watching any that were
+        lost to another process, and give back leases on watches no longer
+        being watched here (a failed settlement) so they are retried.
+        Watches tracked after the query started are left for the next renew.
+        """
+        leased = self._leased.copy()
+        # An open_watch whose caller never committed
+        stale = time.time() - self.lease_ttl
+        for payment_id, opened_at in list(self._opening.items()):
+            if opened_at < stale:
+                self._opening.pop(payment_id, None)
+        with session_scope() as db:
+            db.execute(
+                update(PaymentWatch)
+                .where(PaymentWatch.owner == self.owner)
+                .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_ttl))
+            )
+            held = set(db.scalars(select(PaymentWatch.payment_id).where(PaymentWatch.owner == self.owner)).all())
+            orphaned = list(held - self._leased.copy() - set(self._opening.copy()))
+            if orphaned:
+                db.execute(
+                    update(PaymentWatch)
+                    .where(PaymentWatch.payment_id.in_(orphaned), PaymentWatch.owner == self.owner)
+                    .values(owner=None, lease_expires_at=None)
+                )
+        for payment_id in leased - held:
+            self._leased.discard(payment_id)
+            self.cancel(payment_id)
+
+    def release(self):
+        """Hand this process's leases back so another process takes them over straight away."""
+        if self._lease_thread is None:
+            return
+        try:
+            with session_scope() as db:
+                db.execute(
+                    update(PaymentWatch)
+                    .where(PaymentWatch.owner == self.owner)
+                    .values(owner=None, lease_expires_at=None)
+                )
+        except Exception as e:
+            print(f"Error releasing payment watch leases: {e}")
+        self._leased.clear()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_ttl / 3):
+            try:
+                self.renew()
+                self.acquire()
+            except Exception as e:
+                print(f"Payment watch lease heartbeat failed: {e}")
+
+    def head_block(self, max_age=5):
+        """Latest block number, cached briefly so opening watches doesn't cost an RPC call each."""
+        if self._head is None or time.time() - self._head_at > max_age:
+            try:
+                self._head = self.w3.eth.block_number
+                self._head_at = time.time()
+            except Exception as e:
+                print(f"Error fetching block number: {e}")
+        return self._head
+
+    def _watch_from_row(self, row):
+        deadline = row.deadline.replace(tzinfo=timezone.utc).timestamp()
+        callback = partial(self._settle, row.kind, row.payment_id, json.loads(row.payload))
+        return Watch(row.payment_id, row.sender_address, row.receiver_address, row.amount, callback, deadline=deadline, start_block=row.start_block)
+
+    def _settle(self, kind, payment_id, payload, result):
+        handler = _handlers.get(kind)
+        if handler is None:
+            print(f"No settlement handler for {kind} payment {payment_id}")
+            return
+        # Handlers close the watch in their settlement transaction; if one fails
+        # the lease is given back on the next heartbeat and the watch is retried
+        try:
+            handler(payload, result)
+        except Exception:
+            if result:
+                self._claimed.pop(HexBytes(result["tx_hash"]))
+            raise
+        finally:
+            self._leased.discard(payment_id)
+
+    def _start_backfill(self, from_block, payment_ids):
+        threading.Thread(target=self._backfill, args=(from_block, payment_ids), name="chain-backfill", daemon=True).start()
+
+    def _backfill(self, from_block, payment_ids, batch_blocks=50):
+        """
+        Match resumed watches against blocks from `from_block` onwards. Keeps
+        following the head until every resumed watch has settled or expired,
+        so a payment still in the mempool during the restart is caught once
+        it is mined.
+        """
+        next_block = from_block
+        while payment_ids and not self._stop.is_set():
+            try:
+                head = self.w3.eth.block_number
+                while next_block <= head and not self._stop.is_set():
+                    numbers = range(next_block, min(head, next_block + batch_blocks - 1) + 1)
+                    for block in monitor.fetch_blocks(numbers):
+                        if block is None:
+                            raise RuntimeError(f"block {numbers[0]}-{numbers[-1]} unavailable")
+                        for tx in monitor.match_block_transactions(block, self.index.receivers()):
+                            self._dispatch(tx)
+                    next_block = numbers[-1] + 1
+            except Exception as e:
+                print(f"Chain backfill from block {next_block} failed, retrying: {e}")
+            payment_ids = {payment_id for payment_id in payment_ids if self.index.get(payment_id) is not None}
+            self._stop.wait(self.poll_interval * 2)
+
+    def cancel(self, payment_id):
+        """Stop watching a payment without calling its callback."""
+        watch = self.index.remove(payment_id)
+        for confirming in list(self._confirming.values()):
+            if confirming.payment_id == payment_id:
+                confirming.cancelled = True
+                watch = confirming
+        return watch is not None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="chain-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 5)
+        self._uninstall_filter()
+        self.release()
+
+    async def astart(self):
+        self.start()
+
+    async def astop(self):
+        await asyncio.to_thread(self.stop)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Chain watcher poll failed: {e}")
+                # Filters expire on the node; install a fresh one next round
+                self._filter_id = None
+            self._stop.wait(self.poll_interval)
+
+    def poll(self):
+        now = time.time()
+        for watch in self.index.pop_expired(now):
+            self._finish(watch, False)
+
+        if len(self.index) == 0 and not self._confirming:
+            self._idle()
+            return
+
+        if len(self.index):
+            self._scan()
+        self._check_confirmations(now)
+
+    def _idle(self):
+        self._uninstall_filter()
+
+    def _scan(self):
+        if self._filter_id is None:
+            self._filter_id = self.w3.eth.filter('pending').filter_id
+        tx_hashes = self.w3.eth.get_filter_changes(self._filter_id)
+        for tx in monitor.fetch_transactions(tx_hashes):
+            if tx:
+                self._dispatch(tx)
+
+    def _dispatch(self, tx):
+        balance_cache.invalidate_transaction(tx)
+        if self._claimed.get(tx['hash']):
+            return
+        watch = self.index.match(tx['from'], tx['to'], tx.get('blockNumber'))
+        if watch is not None:
+            self._claimed.set(tx['hash'], True)
+            self._confirming[tx['hash']] = watch
+
+    def _check_confirmations(self, now):
+        for tx_hash, watch in list(self._confirming.items()):
+            if watch.cancelled:
+                del self._confirming[tx_hash]
+                continue
+            self._handle_receipt(tx_hash, watch, monitor.monitor_confirmed_transactions(tx_hash), now)
+
+    def _handle_receipt(self, tx_hash, watch, receipt, now):
+        if receipt:
+            del self._confirming[tx_hash]
+            balance_cache.invalidate_transaction(receipt)
+            if receipt['status'] == 1:
+                self._finish(watch, {"receipt": receipt, "tx_hash": f"0x{tx_hash.hex()}"})
+            elif watch.deadline > now:
+                # Reverted transaction, keep waiting for another attempt
+                self.index.add(watch)
+            else:
+                self._finish(watch, False)
+        elif watch.deadline <= now:
+            del self._confirming[tx_hash]
+            self._finish(watch, False)
+
+    def _finish(self, watch, result):
+        if watch.cancelled:
+            return
+        self._callbacks.submit(self._run_callback, watch, result)
+
+    @staticmethod
+    def _run_callback(watch, result):
+        try:
+            watch.callback(result)
+        except Exception as e:
+            print(f"Settlement callback for payment {watch.payment_id} failed: {e}")
+
+    def _uninstall_filter(self):
+        if self._filter_id is None:
+            return
+        try:
+            self.w3.eth.uninstall_filter(self._filter_id)
+        except Exception as e:
+            print(f"Error uninstalling filter: {e}")
+        self._filter_id = None
+
+
+class BlockChainWatcher(ChainWatcher):
+    """
+    Chain watcher that follows the chain head instead of the mempool. Every
+    new block is fetched once with full transactions and matched against the
+    open payments in one pass; the last processed block is checkpointed in
+    the database so a restart resumes where the previous process stopped.
+    """
+
+    def __init__(self, w3, poll_interval=2.0, callback_workers=5, name="blocks", blocks_per_poll=20, max_catchup_blocks=600):
+        super().__init__(w3, poll_interval, callback_workers)
+        self.name = name
+        self.blocks_per_poll = blocks_per_poll
+        # Older blocks can't hold a payment for any watch that is still open
+        self.max_catchup_blocks = max_catchup_blocks
+        self._last_block = None
+
+    def _idle(self):
+        pass
+
+    def _start_backfill(self, from_block, payment_ids):
+        # Blocks are followed in order anyway; just make sure the scan starts early enough
+        checkpoint = self._load_checkpoint()
+        self._last_block = from_block - 1 if checkpoint is None else min(checkpoint, from_block - 1)
+
+    def _scan(self):
+        if self._last_block is None:
+            self._last_block = self._load_checkpoint()
+
+        head = self.w3.eth.block_number
+        start = head if self._last_block is None else self._last_block + 1
+        start = max(start, head - self.max_catchup_blocks)
+        end = min(head, start + self.blocks_per_poll - 1)
+        if start > end:
+            return
+
+        for block_number in range(start, end + 1):
+            block = self.w3.eth.get_block(block_number, full_transactions=True)
+            for tx in block['transactions']:
+                balance_cache.invalidate_transaction(tx)
+            receivers = self.index.receivers()
+            if not receivers:
+                break
+            for tx in monitor.match_block_transactions(block, receivers):
+                self._dispatch(tx)
+            self._last_block = block_number
+        self._save_checkpoint(self._last_block)
+
+    def _load_checkpoint(self):
+        with session_scope() as db:
+            checkpoint = db.get(WatcherCheckpoint, self.name)
+            return checkpoint.block_number if checkpoint else None
+
+    def _save_checkpoint(self, block_number):
+        if block_number is None:
+            return
+        try:
+            with session_scope() as db:
+                db.merge(WatcherCheckpoint(name=self.name, block_number=block_number))
+        except Exception as e:
+            print(f"Error saving watcher checkpoint: {e}")
+
+
+class AsyncChainWatcher(ChainWatcher):
+    """
+    Asyncio variant of the chain watcher. Pending transactions and new heads
+    arrive over one websocket subscription inside the application's event
+    loop; while the socket is down it falls back to HTTP filter polling.
+
+    It only ever runs on the loop `astart` is awaited on. Watches added
+    before that (or after `astop`) are indexed and picked up once it runs.
+    """
+
+    def __init__(self, w3, ws_url, http_url, poll_interval=1.0, callback_workers=5, fallback_period=30, batch_window=WS_BATCH_WINDOW):
+        super().__init__(w3, poll_interval, callback_workers)
+        self.ws_url = ws_url
+        self.http_url = http_url
+        self.fallback_period = fallback_period
+        self.batch_window = batch_window
+        self._loop = None
+        self._task = None
+
+    async def astart(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop.clear()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def astop(self):
+        self._stop.set()
+        # Starts requested from here on wait for the next astart
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.release)
+
+    def start(self):
+        loop = self._loop
+        if loop is None:
+            # Deferred until the application loop calls astart, which runs whatever is indexed by then
+            return
+        if self._task is None or self._task.done():
+            asyncio.run_coroutine_threadsafe(self.astart(), loop)
+
+    def stop(self):
+        loop = self._loop
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.astop(), loop)
+        else:
+            super().stop()
+
+    async def run(self):
+        expiry = asyncio.create_task(self._expire_loop())
+        try:
+            while not self._stop.is_set():
+                try:
+                    await self._subscribe()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Websocket subscription dropped, falling back to HTTP polling: {e}")
+                if not self._stop.is_set():
+                    await self._poll_http(self.fallback_period)
+        finally:
+            expiry.cancel()
+
+    async def _subscribe(self):
+        async with AsyncWeb3(WebSocketProvider(self.ws_url)) as w3:
+            pending_id = await w3.eth.subscribe("newPendingTransactions")
+            await w3.eth.subscribe("newHeads")
+            # Hashes waiting for the next batch lookup, and the task that looks them up
+            tx_hashes = []
+            fetcher = None
+            try:
+                async for message in w3.socket.process_subscriptions():
+                    if self._stop.is_set():
+                        return
+                    if message["subscription"] == pending_id:
+                        if len(self.index):
+                            tx_hashes.append(message["result"])
+                            if fetcher is None or fetcher.done():
+                                fetcher = asyncio.create_task(self._fetch_and_dispatch(w3, tx_hashes))
+                    elif self._confirming:
+                        await self._check_confirmations_async(w3, time.time())
+            finally:
+                if fetcher is not None:
+                    fetcher.cancel()
+
+    async def _poll_http(self, period):
+        w3 = AsyncWeb3(AsyncHTTPProvider(self.http_url))
+        filter_id = None
+        deadline = time.time() + period
+        try:
+            while time.time() < deadline and not self._stop.is_set():
+                try:
+                    if len(self.index):
+                        if filter_id is None:
+                            filter_id = (await w3.eth.filter('pending')).filter_id
+                        tx_hashes = await w3.eth.get_filter_changes(filter_id)
+                        for tx in await monitor.fetch_transactions_async(w3, tx_hashes):
+                            if tx:
+                                self._dispatch(tx)
+                    if self._confirming:
+                        await self._check_confirmations_async(w3, time.time())
+                except Exception as e:
+                    print(f"HTTP fallback poll failed: {e}")
+                    filter_id = None
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            if filter_id is not None:
+                try:
+                    await w3.eth.uninstall_filter(filter_id)
+                except Exception as e:
+                    print(f"Error uninstalling filter: {e}")
+
+    async def _expire_loop(self):
+        while True:
+            for watch in self.index.pop_expired(time.time()):
+                self._finish(watch, False)
+            await asyncio.sleep(self.poll_interval)
+
+    async def _fetch_and_dispatch(self, w3, tx_hashes):
+        """Look up the hashes collected in `tx_hashes` a batch at a time until no more arrive."""
+        while tx_hashes:
+            await asyncio.sleep(self.batch_window)
+            batch = tx_hashes[:]
+            tx_hashes.clear()
+            # One batch at a time: the websocket provider answers every batch under the same request id.
+            # Transactions dropped from the mempool before the lookup come back as None.
+            for tx in await monitor.fetch_transactions_async(w3, batch, max_in_flight=1):
+                if tx:
+                    self._dispatch(tx)
+
+    async def _check_confirmations_async(self, w3, now):
+        for tx_hash, watch in list(self._confirming.items()):
+            if watch.cancelled:
+                del self._confirming[tx_hash]
+                continue
+            try:
+                receipt = await w3.eth.get_transaction_receipt(tx_hash)
+            except Exception:
+                receipt = None
+            self._handle_receipt(tx_hash, watch, receipt, now)
+
+
+# One watcher per process, shared by app.py and api.py.
+# WATCHER_MODE=websocket runs it on the application's event loop instead of a thread,
+# WATCHER_MODE=blocks matches mined blocks instead of the mempool.
+WATCHER_MODE = os.getenv("WATCHER_MODE", "pending")
+
+if WATCHER_MODE == "websocket":
+    chain_watcher = AsyncChainWatcher(monitor.w3, ws_url, monitor.rpc_url)
+elif WATCHER_MODE == "blocks":
+    chain_watcher = BlockChainWatcher(monitor.w3)
+else:
+    chain_watcher = ChainWatcher(monitor.w3)
@@ -0,0 +1,250 @@
+"""
+Merchant webhook delivery through a transactional outbox.
+
+Settlement calls `enqueue` inside its own database transaction, so a webhook
+row exists exactly when the payment it describes has committed. The async
+`WebhookDispatcher` running on the app's event loop claims due rows, posts
+them over pooled keep-alive connections with a per-host concurrency limit,
+and reschedules failures with exponential backoff until they are delivered
+or dead-lettered after WEBHOOK_MAX_ATTEMPTS. Delivery is at-least-once; each
+request carries an `X-Webhook-Id` header merchants can use to deduplicate.
+
+Dead-lettered webhooks can be queued again with:
+
+    python webhooks.py requeue-dead
+"""
+import argparse
+import asyncio
+import os
+import random
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import aiohttp
+from sqlalchemy import select, update
+
+from database import AsyncSessionLocal, SessionLocal
+from models import WebhookOutbox
+from serialization import dumps
+
+
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+WEBHOOK_PER_HOST = int(os.getenv("WEBHOOK_PER_HOST", "4"))
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "10"))
+
+PENDING = "Pending"
+DELIVERED = "Delivered"
+DEAD = "Dead"
+
+
+def enqueue(db, payment_id, url, payload):
+    """Add a webhook to the outbox. Does not commit; call `dispatcher.notify()` after the commit."""
+    db.add(WebhookOutbox(
+        webhook_id=str(uuid.uuid4()),
+        payment_id=payment_id,
+        url=url,
+        payload=dumps(payload).decode(),
+        status=PENDING,
+        attempts=0,
+        next_attempt_at=datetime.utcnow(),
+    ))
+
+
+class WebhookDispatcher:
+    def __init__(self, max_in_flight=WEBHOOK_MAX_IN_FLIGHT, per_host=WEBHOOK_PER_HOST, timeout=WEBHOOK_TIMEOUT,
+                 max_attempts=WEBHOOK_MAX_ATTEMPTS, base_delay=5, max_delay=3600, poll_interval=2.0):
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        # A claimed row is hidden from other dispatchers this long; if the claimer dies it becomes due again
+        self.claim_timeout = timedelta(seconds=timeout + 30)
+
+        self._loop = None
+        self._wake = None
+        self._task = None
+        self._session = None
+        self._deliveries = set()
+        self._host_load = Counter()
+
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.per_host, keepalive_timeout=30)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Unfinished deliveries stay claimed in the outbox and are retried once the claim times out
+        for delivery in list(self._deliveries):
+            delivery.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def notify(self):
+        """Wake the dispatcher after new rows commit. Safe to call from any thread."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def run(self):
+        while True:
+            self._wake.clear()
+            capacity = self.max_in_flight - len(self._deliveries)
+            claimed = []
+            if capacity > 0:
+                try:
+                    claimed = await self._claim(capacity)
+                except Exception as e:
+                    print(f"Error claiming webhooks: {e}")
+            for row in claimed:
+                delivery = asyncio.create_task(self._deliver(row))
+                self._deliveries.add(delivery)
+                delivery.add_done_callback(self._deliveries.discard)
+            if claimed and len(claimed) == capacity:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, limit):
+        """
+        Take up to `limit` due rows, skipping hosts that are already at their
+        concurrency limit so one slow merchant can't hold every slot.
+        """
+        now = datetime.utcnow()
+        claimed = []
+        async with AsyncSessionLocal() as db:
+            candidates = (await db.execute(
+                select(WebhookOutbox.webhook_id, WebhookOutbox.url, WebhookOutbox.payload,
+                       WebhookOutbox.attempts, WebhookOutbox.next_attempt_at)
+                .where(WebhookOutbox.status == PENDING, WebhookOutbox.next_attempt_at <= now)
+                .order_by(WebhookOutbox.next_attempt_at)
+                .limit(limit * 4)
+            )).all()
+            for row in candidates:
+                host = urlsplit(row.url).netloc
+                if self._host_load[host] >= self.per_host:
+                    continue
+                # Conditional update, so only one dispatcher wins a row across workers
+                result = await db.execute(
+                    update(WebhookOutbox)
+                    .where(
+                        WebhookOutbox.webhook_id == row.webhook_id,
+                        WebhookOutbox.status == PENDING,
+                        WebhookOutbox.next_attempt_at == row.next_attempt_at,
+                    )
+                    .values(next_attempt_at=now + self.claim_timeout)
+                )
+                if result.rowcount != 1:
+                    continue
+                self._host_load[host] += 1
+                claimed.append(row)
+                if len(claimed) >= limit:
+                    break
+            await db.commit()
+        return claimed
+
+    async def _deliver(self, row):
+        host = urlsplit(row.url).netloc
+        attempt = row.attempts + 1
+        error = None
+        retry_after = None
+        try:
+            headers = {"Content-Type": "application/json", "X-Webhook-Id": row.webhook_id, "X-Webhook-Attempt": str(attempt)}
+            async with self._session.post(row.url, data=row.payload, headers=headers) as response:
+                # Drain the body so the connection goes back to the pool
+                await response.read()
+                if response.status >= 300:
+                    error = f"HTTP {response.status}"
+                    retry_after = response.headers.get("Retry-After")
+        except Exception as e:
+            # Anything that went wrong with this attempt counts against it, so the row is retried or dead-lettered
+            # instead of sitting claimed until the claim times out
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            self._host_load[host] -= 1
+            if self._host_load[host] <= 0:
+                del self._host_load[host]
+            self._wake.set()
+
+        try:
+            await self._record(row, attempt, error, retry_after)
+        except Exception as e:
+            print(f"Error recording webhook {row.webhook_id}: {e}")
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        # Jitter spreads retries for a recovering merchant out over time
+        delay *= random.uniform(0.5, 1.0)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.max_delay, int(retry_after)))
+        return timedelta(seconds=delay)
+
+    async def _record(self, row, attempt, error, retry_after):
+        now = datetime.utcnow()
+        values = {"attempts": attempt, "last_error": error}
+        if error is None:
+            values.update(status=DELIVERED, delivered_at=now)
+            self.delivered += 1
+        elif attempt >= self.max_attempts:
+            values.update(status=DEAD)
+            self.dead += 1
+            print(f"Webhook {row.webhook_id} dead-lettered after {attempt} attempts: {error}")
+        else:
+            values.update(next_attempt_at=now + self._backoff(attempt, retry_after))
+            self.retried += 1
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(WebhookOutbox).where(WebhookOutbox.webhook_id == row.webhook_id).values(**values))
+            await db.commit()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._deliveries),
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+            "busy_hosts": len(self._host_load),
+        }
+
+
+dispatcher = WebhookDispatcher()
+
+
+def requeue_dead(db):
+    """Give every dead-lettered webhook a fresh set of attempts."""
+    result = db.execute(
+        update(WebhookOutbox)
+        .where(WebhookOutbox.status == DEAD)
+        .values(status=PENDING, attempts=0, next_attempt_at=datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the webhook outbox")
+    parser.add_argument("command", choices=["requeue-dead"])
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(f"Requeued {requeue_dead(db)} webhooks")
+    finally:
+        db.close()
@@ -1,61 +1,40 @@
 from web3 import Web3
 from eth_account import Account
-import requests
 import json
-from hexbytes import HexBytes
-from typing import Dict, Any
-import base64
-
-class HexJsonEncoder:
-    @staticmethod
-    def encode_receipt(receipt: Dict[str, Any]) -> Dict[str, Any]:
-        """Convert transaction receipt to JSON-serializable format."""
-        serialized = {}
-        for key, value in receipt.items():
-            if isinstance(value, HexBytes):
-                serialized[key] = value.hex()
-            elif isinstance(value, bytes):
-                serialized[key] = base64.b64encode(value).decode('ascii')
-            elif isinstance(value, (list, tuple)):
-                serialized[key] = [
-                    item.hex() if isinstance(item, HexBytes)
-                    else base64.b64encode(item).decode('ascii') if isinstance(item, bytes)
-                    else item
-                    for item in value
-                ]
-            else:
-                serialized[key] = value
-        return serialized
-
-# RPC endpoint of the Ethereum network
-rpc_url = "https://mainnet.base.org"
+import os
+from price import price_oracle
+from balances import BalanceCache
+from tokens import TokenBalanceReader
+from sender import NonceManager, GasPriceCache, ReceiptTracker
+from rpc import ProviderPool, parse_rpc_urls
+
+# RPC endpoints of the Ethereum network, comma-separated (RPC_URL still works for a single one)
+rpc_urls = parse_rpc_urls(os.getenv("RPC_URLS", os.getenv("RPC_URL", "https://mainnet.base.org")))
+rpc_url = rpc_urls[0]
 "https://sepolia.base.org"
 # "https://neoxt4seed1.ngd.network"
-ws_url = "wss://neoxt4wss1.ngd.network" 
-web3 = Web3(Web3.HTTPProvider(rpc_url))
+ws_url = os.getenv("WS_URL", "wss://neoxt4wss1.ngd.network")
+web3 = Web3(ProviderPool(rpc_urls))
+# Native and ERC-20 balances, read together in one Multicall3 call
+token_reader = TokenBalanceReader(web3)
+# Balances per address; the chain watcher invalidates entries for addresses it sees move
+balance_cache = BalanceCache(web3, loader=lambda address, block_identifier: token_reader.balances([address], block_identifier)[address])
+# Outgoing transfers: local nonces, cached gas price, receipts confirmed in the background
+nonce_manager = NonceManager(web3)
+gas_price_cache = GasPriceCache(web3)
+receipt_tracker = ReceiptTracker(web3)
 
 
 def get_gas_to_usdc(value):
-    # try:
-        if value == 0:
-            return 0.0  # Return 0 directly for input value 0
-        
-        # API Request
-        url = "https://min-api.cryptocompare.com/data/price?fsym=ETH&tsyms=USDC"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()  # Raise an error for HTTP issues
-        data = response.json()
-        usdt_val = data.get('USDC')  # Safely get 'USDT' value
-        if usdt_val is None:
-            return "Error: 'USDC' key not found in API response."
-        # Calculate equivalent USDT balance
-        usdt_balance = float(value) * usdt_val
-        # Format the output for readability
-        return round(usdt_balance, 6)  # Rounded to 6 decimal places
-    # except requests.exceptions.RequestException as e:
-    #     return f"API Request Error: {e}"
-    # except Exception as e:
-    #     return f"An error occurred: {e}"
+    if value == 0:
+        return 0.0  # Return 0 directly for input value 0
+
+    # Cached ETH/USDC price, refreshed in the background
+    usdt_val = price_oracle.get_price()
+    # Calculate equivalent USDT balance
+    usdt_balance = float(value) * usdt_val
+    # Format the output for readability
+    return round(usdt_balance, 6)  # Rounded to 6 decimal places
 
 
 def create_wallet():
@@ -84,101 +63,40 @@ def import_wallet(private_key_user):
     return {"wallet_address":account.address, "USDT":usdt_balance, "GAS":balance}
 
 
-def send_base_eth(sender_address, private_key, recipient_address, amount_in_ether):
-
+def sign_base_eth(private_key, recipient_address, amount_in_ether, nonce, gas_price=None):
+    """Build and sign an ETH transfer with the given nonce, without sending it."""
     amount_in_wei = web3.to_wei(amount_in_ether, 'ether')
 
-    # Get the nonce (number of transactions sent from the sender address)
-    nonce = web3.eth.get_transaction_count(sender_address)
     # Create the transaction
     tx = {
         'nonce': nonce,
         'to': recipient_address,
         'value': amount_in_wei,
         'gas': 21000,  # Standard gas limit for ETH transfers
-        'gasPrice': web3.to_wei('30', 'gwei'),  # Replace '30' with current gas price in Gwei
+        'gasPrice': gas_price or gas_price_cache.get(),
         'chainId':  8453,
         # 12227332  # Mainnet chain ID. Use 3, 4, or 5 for testnets like Ropsten, Rinkeby, or Goerli
     }
 
-    gas_price = web3.eth.gas_price
-    tx['gasPrice'] = gas_price
-
-
     # Sign the transaction with the sender's private key
-    signed_tx = web3.eth.account.sign_transaction(tx, private_key)
-
-    # Send the transaction
-    tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    return web3.eth.account.sign_transaction(tx, private_key)
 
-    # Get the transaction hash
-    # print(f"Transaction hash: {web3.to_hex(tx_hash)}")
 
-    # Optional: Wait for the transaction receipt (to confirm it was mined)
-    receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-    
-    serialized_receipt = HexJsonEncoder.encode_receipt(dict(receipt))
-
-    return serialized_receipt
-
-# from eth_abi import decode
-# import json
-
-# # Add this near the top with other constants
-# # Example token contract addresses on NeoX (replace with actual addresses)
-# TOKEN_CONTRACTS = {
-#     "USDT": "0x24222633A8A20A34A7A8eF3ae0Cd3dF2fE36b548",  # Replace with actual USDT contract
-#     # Add other tokens as needed
-# }
-
-# # Standard ERC20 ABI for token balance checking
-# ERC20_ABI = json.loads('''[
-#     {
-#         "constant": true,
-#         "inputs": [{"name": "_owner", "type": "address"}],
-#         "name": "balanceOf",
-#         "outputs": [{"name": "balance", "type": "uint256"}],
-#         "type": "function"
-#     },
-#     {
-#         "constant": true,
-#         "inputs": [],
-#         "name": "decimals",
-#         "outputs": [{"name": "", "type": "uint8"}],
-#         "type": "function"
-#     }
-# ]''')
-
-def get_wallet_balances(wallet_address):
+def get_wallet_balances(wallet_address, fresh=False):
     """
     Get GAS and token balances for a wallet address
     Returns a dictionary with token symbols and their balances
+    Served from the balance cache unless `fresh` is set
     """
     balances = {}
+    snapshot = balance_cache.get(wallet_address, fresh=fresh)
     
     # Get GAS balance
-    gas_balance = web3.eth.get_balance(wallet_address) / 10**18
+    gas_balance = snapshot["wei"] / 10**18
     balances["ETH"] = gas_balance
     balances["USDT"] = get_gas_to_usdc(gas_balance)
     
-    # Get other token balances
-    # for token_symbol, contract_address in TOKEN_CONTRACTS.items():
-    #     try:
-    #         # Create contract instance
-    #         contract = web3.eth.contract(address=contract_address, abi=ERC20_ABI)
-            
-    #         # Get token decimals
-    #         decimals = contract.functions.decimals().call()
-            
-    #         # Get raw balance
-    #         raw_balance = contract.functions.balanceOf(wallet_address).call()
-            
-    #         # Convert to proper decimal places
-    #         token_balance = raw_balance / (10 ** decimals)
-            
-    #         balances[token_symbol] = token_balance
-            
-    #     except Exception as e:
-    #         balances[token_symbol] = f"Error: {str(e)}"
+    # ERC-20 balances from TOKEN_CONTRACTS, None where a token couldn't be read
+    balances["tokens"] = snapshot["tokens"]
     
     return balances
\ No newline at end of file